@@ -0,0 +1,123 @@
+import hashlib
+import pickle
+import sqlite3
+import threading
+import time
+
+'''
+Persistent key-value cache in a local SQLite database, used to keep the results of expensive steps (OCR of the
+figure images, ...) across runs. Values are pickled, keys are usually built with cache_key from everything the
+result depends on, so that an entry never has to be invalidated, a changed input simply gets a new key.
+
+Each user of the cache has its own namespace, so several caches can share one database file. Delete the file to
+empty every cache.
+'''
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+
+# Function to build a cache key from the inputs of a result
+def cache_key(*parts):
+    """
+    Hashes the inputs a cached result depends on into a key.
+
+    Args:
+        *parts (bytes or str): The inputs (e.g. the image content, the tool version and its settings).
+
+    Returns:
+        str: The SHA-256 hex digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        # the length prefix keeps ('ab', 'c') and ('a', 'bc') apart
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Thread-safe persistent cache of picklable values. The database is opened on first use.
+
+    Args:
+        db_path (str): The path of the SQLite database.
+        namespace (str): The namespace of the entries of this cache.
+    """
+
+    def __init__(self, db_path, namespace):
+        self.db_path = db_path
+        self.namespace = namespace
+        self.lock = threading.RLock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        with self.lock:
+            if self._connection is None:
+                self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._connection.executescript(SCHEMA)
+            return self._connection
+
+    def get(self, key, default=None):
+        """
+        Looks up a cached value.
+
+        Args:
+            key (str): The key of the value.
+            default: The value returned if the key is not cached (default is None).
+
+        Returns:
+            The cached value, or default.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM entries WHERE namespace = ? AND key = ?",
+                                          (self.namespace, key)).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def get_many(self, keys):
+        """
+        Looks up several cached values at once.
+
+        Args:
+            keys (list): The keys of the values.
+
+        Returns:
+            dict: The cached values by key, keys that are not cached are left out.
+        """
+        keys = list(dict.fromkeys(keys))
+        values = {}
+        with self.lock:
+            # SQLite limits the number of parameters of a statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT key, value FROM entries WHERE namespace = ? AND key IN ({', '.join('?' * len(batch))})",
+                    [self.namespace] + batch
+                ).fetchall()
+                values.update((key, pickle.loads(value)) for key, value in rows)
+        return values
+
+    def set(self, key, value):
+        """
+        Stores a value in the cache, replacing the previous value of the key.
+
+        Args:
+            key (str): The key of the value.
+            value: The value, it must be picklable.
+
+        Returns:
+            None
+        """
+        with self.lock, self.connection as connection:
+            connection.execute("INSERT OR REPLACE INTO entries (namespace, key, value, created) VALUES (?, ?, ?, ?)",
+                               (self.namespace, key, pickle.dumps(value), time.time()))
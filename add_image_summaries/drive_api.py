@@ -0,0 +1,473 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+from collections import defaultdict
+import google_auth_httplib2
+import httplib2
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from rate_limit import TokenBucket
+
+'''
+Wrapper used for every google Drive API call in this folder.
+
+Requires user specific inputs
+
+1. DRIVE_REQUESTS_PER_SECOND is the sustained request rate shared by all threads of one run. Size it to the
+   Drive API quota of the project (default quota is 12,000 queries per minute, i.e. 200 per second, per project)
+   divided by the number of runs executing at the same time.
+
+2. DRIVE_BURST is the number of requests that may be sent back to back before the rate limit applies.
+
+3. MAX_RETRIES, BACKOFF_BASE and BACKOFF_MAX control the exponential backoff (in seconds) for transient errors.
+
+4. CHANGES_PAGE_SIZE is the number of changes requested per page of the Drive changes feed.
+
+5. HTTP_TIMEOUT is the socket timeout in seconds of the HTTP connections of the Drive clients.
+'''
+DRIVE_REQUESTS_PER_SECOND = 10
+DRIVE_BURST = 20
+MAX_RETRIES = 6
+BACKOFF_BASE = 1
+BACKOFF_MAX = 64
+CHANGES_PAGE_SIZE = 1000
+HTTP_TIMEOUT = 120
+
+# 403 is only retried for these reasons, other 403s (e.g. insufficient permissions) fail immediately
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+# token bucket shared by every Drive call made from this process
+drive_bucket = TokenBucket(DRIVE_REQUESTS_PER_SECOND, DRIVE_BURST)
+
+# Drive clients are created lazily by get_service, one per thread and process
+_service_account_file = None
+_scopes = None
+_credentials = None
+_credentials_pid = None
+_credentials_lock = threading.Lock()
+_local = threading.local()
+
+
+# Function to set the credentials used by the Drive clients
+def configure_drive(service_account_file, scopes):
+    """
+    Sets the service account key used by get_service. Nothing is read until the first client is needed,
+    so calling this at import time has no side effects.
+
+    Args:
+        service_account_file (str): The path to the JSON key file of the service account.
+        scopes (list): The OAuth scopes to request.
+
+    Returns:
+        None
+    """
+    global _service_account_file, _scopes, _credentials
+    with _credentials_lock:
+        _service_account_file = service_account_file
+        _scopes = scopes
+        _credentials = None
+
+
+# Function to load the service account credentials once per process
+def get_credentials():
+    """
+    Loads the service account credentials on first use and caches them for the process. They are loaded again
+    in a forked child process, which must not reuse the parent's token refresh state.
+
+    Returns:
+        google.oauth2.service_account.Credentials: The credentials.
+    """
+    global _credentials, _credentials_pid
+    with _credentials_lock:
+        if _credentials is None or _credentials_pid != os.getpid():
+            if not _service_account_file:
+                raise RuntimeError("The service account key is not set, call configure_drive with SERVICE_ACCOUNT_FILE.")
+            _credentials = service_account.Credentials.from_service_account_file(_service_account_file, scopes=_scopes)
+            _credentials_pid = os.getpid()
+        return _credentials
+
+
+# Function to get the Drive client of the current thread
+def get_service():
+    """
+    Returns the Drive API client of the calling thread, creating it on first use. httplib2 connections are not
+    thread-safe, so every thread gets its own client, which keeps its HTTP connections open for reuse. Clients
+    inherited from a parent process through fork are replaced, since their sockets are shared with the parent.
+
+    Returns:
+        googleapiclient.discovery.Resource: The authenticated Google Drive API service.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        http = google_auth_httplib2.AuthorizedHttp(get_credentials(), http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        _local.service = build('drive', 'v3', http=http, cache_discovery=False)
+        _local.pid = os.getpid()
+    return _local.service
+
+
+class CallMetrics:
+    """
+    Thread-safe collector of per-call latency, retry and failure counts, grouped by API method.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.waits = defaultdict(float)
+        self.retries = defaultdict(int)
+        self.failures = defaultdict(int)
+
+    def record(self, name, latency, waited=0.0, retried=False, failed=False):
+        """
+        Records the outcome of a single API call attempt.
+
+        Args:
+            name (str): The API method name (e.g. 'drive.files.list').
+            latency (float): The duration of the attempt in seconds.
+            waited (float): The time spent waiting on the rate limiter in seconds.
+            retried (bool): Whether the attempt failed and will be retried.
+            failed (bool): Whether the attempt failed and will not be retried.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.latencies[name].append(latency)
+            self.waits[name] += waited
+            if retried:
+                self.retries[name] += 1
+            if failed:
+                self.failures[name] += 1
+
+    def summary(self):
+        """
+        Summarises the recorded calls.
+
+        Returns:
+            list: A list of dictionaries, one per API method, with the number of calls, retries, failures,
+            total rate limiter wait and mean / p95 / max latency in milliseconds.
+        """
+        rows = []
+        with self.lock:
+            for name, latencies in sorted(self.latencies.items()):
+                ordered = sorted(latencies)
+                rows.append({
+                    'method': name,
+                    'calls': len(ordered),
+                    'retries': self.retries[name],
+                    'failures': self.failures[name],
+                    'wait_s': round(self.waits[name], 3),
+                    'mean_ms': round(1000 * sum(ordered) / len(ordered), 1),
+                    'p95_ms': round(1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 1),
+                    'max_ms': round(1000 * ordered[-1], 1),
+                })
+        return rows
+
+    def report(self):
+        """
+        Prints the summary of the recorded calls.
+
+        Returns:
+            None
+        """
+        for row in self.summary():
+            print(f"{row['method']}: {row['calls']} calls, {row['retries']} retries, {row['failures']} failures, "
+                  f"waited {row['wait_s']}s, mean {row['mean_ms']}ms, p95 {row['p95_ms']}ms, max {row['max_ms']}ms")
+
+
+drive_metrics = CallMetrics()
+
+
+# Function to decide whether a failed call should be retried
+def is_retryable_error(error):
+    """
+    Checks whether an error raised by a Drive API call is transient.
+
+    Args:
+        error (Exception): The error raised by the call.
+
+    Returns:
+        bool: True for rate limit errors (403 rateLimitExceeded / userRateLimitExceeded, 429), server errors (5xx)
+        and network errors, False otherwise.
+    """
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS or is_rate_limit_error(error)
+    return isinstance(error, (socket.timeout, ConnectionError, TimeoutError))
+
+
+# Function to decide whether a failed call was refused by the rate limits
+def is_rate_limit_error(error):
+    """
+    Checks whether an error is a rate limit error (429, 403 rateLimitExceeded / userRateLimitExceeded). Those
+    requests are refused before they are carried out, so repeating a create cannot duplicate the file.
+
+    Args:
+        error (Exception): The error raised by the call.
+
+    Returns:
+        bool: True for rate limit errors, False otherwise.
+    """
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    if error.resp.status != 403:
+        return False
+    details = error.error_details
+    if not isinstance(details, list):
+        try:
+            details = json.loads(error.content.decode('utf-8'))['error']['errors']
+        except (ValueError, KeyError, TypeError):
+            details = []
+    return any(isinstance(detail, dict) and detail.get('reason') in RATE_LIMIT_REASONS for detail in details)
+
+
+# Function to call the Drive API with rate limiting, retries and metrics
+def call_with_retry(func, name, max_retries=MAX_RETRIES, recover=None):
+    """
+    Calls a Drive API function, waiting on the shared token bucket before every attempt and retrying
+    transient errors with exponential backoff and full jitter.
+
+    Args:
+        func (callable): A function without arguments that performs the API call.
+        name (str): The API method name used for the latency metrics.
+        max_retries (int): The maximum number of retries before the error is raised (default is MAX_RETRIES).
+        recover (callable, optional): For calls that are not idempotent (creates). After a server or network
+            error the call may have been carried out anyway, recover is then called before retrying and returns
+            the result of the earlier attempt if there is one, None otherwise. Defaults to None (idempotent call).
+
+    Returns:
+        Any: The result of the function call.
+    """
+    for attempt in range(max_retries + 1):
+        waited = drive_bucket.acquire()
+        start = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            latency = time.perf_counter() - start
+            if attempt == max_retries or not is_retryable_error(e):
+                drive_metrics.record(name, latency, waited, failed=True)
+                raise
+            drive_metrics.record(name, latency, waited, retried=True)
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            print(f"{name} failed with {e}, retrying in {delay:.1f}s (attempt {attempt + 1} of {max_retries}).")
+            time.sleep(delay)
+            if recover is not None and not is_rate_limit_error(e):
+                result = recover()
+                if result is not None:
+                    print(f"{name} had been carried out before the error, not repeating it.")
+                    return result
+        else:
+            drive_metrics.record(name, time.perf_counter() - start, waited)
+            return result
+
+
+# Function to execute a Drive API request
+def execute(request, max_retries=MAX_RETRIES, recover=None):
+    """
+    Executes a Drive API request (e.g. service.files().list(...)) through call_with_retry.
+
+    Args:
+        request (googleapiclient.http.HttpRequest): The request to execute.
+        max_retries (int): The maximum number of retries before the error is raised (default is MAX_RETRIES).
+        recover (callable, optional): See call_with_retry. Defaults to None.
+
+    Returns:
+        dict: The response of the request.
+    """
+    name = getattr(request, 'methodId', None) or 'drive.request'
+    return call_with_retry(request.execute, name, max_retries, recover)
+
+
+# Function to create a file or folder without duplicating it when a create is retried
+def execute_create(service, request, folder_id, file_name, fields, md5=None, mime_type=None, max_retries=MAX_RETRIES):
+    """
+    Executes a files().create request. Rate limit errors are retried as they are, after a server or network error
+    the folder is first searched for a file created by the failed attempt (same name, and same MD5 checksum or
+    mime type when given), which is returned instead of creating the file again.
+
+    Args:
+        service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        request (googleapiclient.http.HttpRequest): The files().create request.
+        folder_id (str): The ID of the folder the file is created in.
+        file_name (str): The name of the file.
+        fields (str): The fields of the file to return, as requested by the create (with md5Checksum if md5 is given).
+        md5 (str, optional): The MD5 checksum of the uploaded content. Defaults to None.
+        mime_type (str, optional): The mime type of the file (e.g. for folders). Defaults to None.
+        max_retries (int): The maximum number of retries before the error is raised (default is MAX_RETRIES).
+
+    Returns:
+        dict: The created file.
+    """
+    def find_created():
+        escaped_name = file_name.replace('\\', '\\\\').replace("'", "\\'")
+        query = f"'{folder_id}' in parents and name = '{escaped_name}' and trashed = false"
+        if mime_type:
+            query += f" and mimeType = '{mime_type}'"
+        response = execute(service.files().list(q=query, orderBy='modifiedTime desc',
+                                                fields=f"files({fields})"))
+        matches = [file for file in response.get('files', []) if md5 is None or file.get('md5Checksum') == md5]
+        return matches[0] if matches else None
+
+    return execute(request, max_retries, find_created)
+
+
+# Function to download the next chunk of a media download
+def next_chunk(downloader, max_retries=MAX_RETRIES):
+    """
+    Downloads the next chunk of a MediaIoBaseDownload through call_with_retry.
+
+    Args:
+        downloader (googleapiclient.http.MediaIoBaseDownload): The downloader of the file.
+        max_retries (int): The maximum number of retries before the error is raised (default is MAX_RETRIES).
+
+    Returns:
+        tuple: The (status, done) pair returned by MediaIoBaseDownload.next_chunk.
+    """
+    return call_with_retry(downloader.next_chunk, 'drive.files.get_media', max_retries)
+
+
+# Function to load the saved start page token of the changes feed
+def load_page_token(token_file):
+    """
+    Loads the changes feed page token saved by the previous run, with the IDs of the changed folders that run did
+    not process. The token is on the first line of the file and the folder IDs on the following lines.
+
+    Args:
+        token_file (str): The path of the file holding the token.
+
+    Returns:
+        tuple: The saved token (None if there is none) and the set of pending folder IDs.
+    """
+    try:
+        with open(token_file, 'r') as f:
+            lines = [line.strip() for line in f.read().splitlines()]
+    except FileNotFoundError:
+        return None, set()
+    if not lines or not lines[0]:
+        return None, set()
+    return lines[0], {line for line in lines[1:] if line}
+
+
+# Function to save the start page token of the changes feed
+def save_page_token(token_file, page_token, pending_ids=()):
+    """
+    Saves the changes feed page token for the next run, replacing the file atomically.
+
+    Args:
+        token_file (str): The path of the file holding the token.
+        page_token (str): The token to save.
+        pending_ids (iterable): The IDs of the changed folders that were not processed (e.g. filtered out by name,
+            without an extract or failed), selected again by the next run. Defaults to none.
+
+    Returns:
+        None
+    """
+    tmp_file = f"{token_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        f.write("\n".join([page_token, *sorted(set(pending_ids))]) + "\n")
+    os.replace(tmp_file, token_file)
+
+
+# Function to get the current start page token of the changes feed
+def get_start_page_token(service):
+    """
+    Gets the page token pointing at the current end of the changes feed.
+
+    Args:
+        service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+
+    Returns:
+        str: The start page token.
+    """
+    return execute(service.changes().getStartPageToken())['startPageToken']
+
+
+# Function to list the changes since a page token
+def fetch_changes(service, page_token):
+    """
+    Lists every change of the changes feed since the page token.
+
+    Args:
+        service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        page_token (str): The page token saved by the previous run.
+
+    Returns:
+        tuple: The list of changes and the new start page token to save for the next run.
+    """
+    changes = []
+    while True:
+        response = execute(service.changes().list(
+            pageToken=page_token, pageSize=CHANGES_PAGE_SIZE, includeRemoved=True, spaces='drive',
+            fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, trashed))"
+        ))
+        changes.extend(response.get('changes', []))
+        if 'newStartPageToken' in response:
+            return changes, response['newStartPageToken']
+        page_token = response['nextPageToken']
+
+
+# Function to find the folders affected by a list of changes
+def changed_folder_ids(changes):
+    """
+    Collects the IDs of the changed files and of the folders directly containing them.
+
+    Args:
+        changes (list): The changes returned by fetch_changes.
+
+    Returns:
+        set: The IDs of the changed files and of their parent folders.
+    """
+    ids = set()
+    for change in changes:
+        ids.add(change['fileId'])
+        ids.update(change.get('file', {}).get('parents', []))
+    return ids
+
+
+# Function to keep only the folders changed since the previous run
+def filter_changed_folders(service, folders, token_file, drive_index):
+    """
+    Keeps the folders that changed (or whose files changed, at any depth) since the previous run, using the Drive
+    changes feed instead of checking every folder. The folders left pending by the previous run are kept as well.
+    Every folder is kept when there is no saved token or it is no longer valid.
+
+    The returned token must only be saved with save_page_token after the run, together with the IDs of the returned
+    folders that were not processed, so that they are selected again by the next run.
+
+    Args:
+        service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        folders (list): The candidate folders, each a dict with 'id' and 'name'.
+        token_file (str): The path of the file holding the token saved by the previous run.
+        drive_index (DriveIndex): The local index of the Drive metadata, used to find the folders containing the
+            changed files.
+
+    Returns:
+        tuple: The folders to process and the page token to save after the run.
+    """
+    page_token, pending_ids = load_page_token(token_file)
+    if page_token is not None:
+        try:
+            changes, new_page_token = fetch_changes(service, page_token)
+        except HttpError as e:
+            print(f"Could not read the changes feed ({e}), processing every folder.")
+        else:
+            changed_ids = changed_folder_ids(changes)
+            # files in subfolders (e.g. figures/ or tables/) select the candidate folder they are under
+            candidate_ids = {folder['id'] for folder in folders}
+            changed_ids |= drive_index.ancestors(service, changed_ids, stop_ids=candidate_ids)
+            changed_ids |= pending_ids
+            changed_folders = [folder for folder in folders if folder['id'] in changed_ids]
+            print(f"{len(changes)} changes since the previous run, {len(pending_ids)} folders pending, "
+                  f"{len(changed_folders)} of {len(folders)} folders to process.")
+            return changed_folders, new_page_token
+    else:
+        print(f"No saved page token in {token_file}, processing every folder.")
+
+    # take the token before processing so that changes made during the run are seen by the next run
+    return folders, get_start_page_token(service)
@@ -1,12 +1,15 @@
+import io
 import json
 import math
 import os
 import pandas as pd
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+from drive_api import configure_drive, drive_metrics, filter_changed_folders, get_service, next_chunk, save_page_token
+from drive_index import DriveIndex, md5_checksum, upload_or_update
+from element_table import EDITED_TEXT_FILE, ELEMENT_TABLE_FILE, element_table_to_df, read_element_table, write_text_column
+from extract_bundle import is_extract_bundle, open_bundle, read_structured_data
 
-# Authenticate and build the google Drive API client
+# Authenticate the google Drive API clients, built lazily for each thread by get_service
 '''
 Requires user specific inputs
 
@@ -14,8 +17,14 @@ Replace SERVICE_ACCOUNT_FILE with the path to your JSON key file.
 '''
 SCOPES = ['https://www.googleapis.com/auth/drive']
 SERVICE_ACCOUNT_FILE = ''
-creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-service = build('drive', 'v3', credentials=creds)
+configure_drive(SERVICE_ACCOUNT_FILE, SCOPES)
+
+# page token of the Drive changes feed, saved after every successful run so that the next run only processes the
+# folders changed since. Delete the file to process every folder again.
+CHANGES_TOKEN_FILE = 'drive_changes_token_edit_json.txt'
+
+# local index of the Drive folder and file metadata, used for every lookup, see drive_index.py
+drive_index = DriveIndex()
 
 # Function to list files in shared folder
 def list_files_in_folder(folder_id):
@@ -28,9 +37,7 @@ def list_files_in_folder(folder_id):
     Returns:
         list: A list of dictionaries representing the files in the folder, each containing metadata like 'name' and 'id'.
     """
-    query = f"'{folder_id}' in parents and mimeType != 'application/vnd.google-apps.folder'"
-    results = service.files().list(q=query).execute()
-    return results.get('files', [])
+    return drive_index.children(get_service(), folder_id, folders=False)
 
 # Function to list subfolders in folder
 def list_folders_in_folder(folder_id):
@@ -43,9 +50,7 @@ def list_folders_in_folder(folder_id):
     Returns:
         list: A list of dictionaries representing the subfolders, each containing metadata like 'name' and 'id'.
     """
-    query = f"'{folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder'"                                                                                                                              
-    results = service.files().list(q=query).execute()
-    return results.get('files', [])
+    return drive_index.children(get_service(), folder_id, folders=True)
 
 # Function to download file
 def download_file(file_id, file_name):
@@ -59,19 +64,39 @@ def download_file(file_id, file_name):
     Returns:
         str: The name of the downloaded file.
     """
-    request = service.files().get_media(fileId=file_id)
+    request = get_service().files().get_media(fileId=file_id)
     with open(file_name, 'wb') as file:
         downloader = MediaIoBaseDownload(file, request)
         done = False
         while not done:
-            status, done = downloader.next_chunk()
+            status, done = next_chunk(downloader)
             print(f"Download {int(status.progress() * 100)}%")
     return file_name  # Return the name of the downloaded file
 
+# Function to download file into memory
+def download_file_to_memory(file_id):
+    """
+    Downloads a file from Google Drive into memory using its file ID.
+
+    Args:
+        file_id (str): The ID of the file to download.
+
+    Returns:
+        bytes: The content of the downloaded file.
+    """
+    request = get_service().files().get_media(fileId=file_id)
+    fh = io.BytesIO()
+    downloader = MediaIoBaseDownload(fh, request)
+    done = False
+    while not done:
+        status, done = next_chunk(downloader)
+    return fh.getvalue()
+
 # Function to upload file
 def upload_file(file_path, folder_id, service):
     """
-    Uploads a file to a specified Google Drive folder.
+    Uploads a file to a specified Google Drive folder. An existing file with the same name is updated in place,
+    or left untouched if its content is unchanged.
 
     Args:
         file_path (str): The path of the file to upload.
@@ -81,12 +106,9 @@ def upload_file(file_path, folder_id, service):
     Returns:
         None
     """
-    file_metadata = {
-        'name': file_path.split('/')[-1],  # Name of the file
-        'parents': [folder_id]  # Parent folder ID
-    }
+    file_name = file_path.split('/')[-1]  # Name of the file
     media = MediaFileUpload(file_path, resumable=True)
-    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    file = upload_or_update(service, drive_index, folder_id, file_name, media, md5_checksum(file_path))
     print(f"Uploaded file with ID: {file.get('id')}")
 
 
@@ -98,28 +120,18 @@ def remove_nan_fields(obj):
         return [remove_nan_fields(v) for v in obj]
     return obj
 
-# Function to process the Excel file and update the JSON file
-def process_files(excel_file_path, json_file_path, updated_json_file_path):
+# Function to update the element Text from the Excel file
+def update_elements(df, elements_df):
     """
-    Processes an Excel file and a JSON file to update the JSON based on the Excel data.
+    Replaces the Text of the figure / table elements by their summaries and blanks the text found inside them.
 
     Args:
-        excel_file_path (str): Path to the Excel file to process.
-        json_file_path (str): Path to the JSON file to update.
-        updated_json_file_path (str): Path where the updated JSON file will be saved.
+        df (pd.DataFrame): The Excel file content, with 'ObjectID_file', 'Summaries' and 'Specific Paths' columns.
+        elements_df (pd.DataFrame): The elements extracted from the PDF, updated in place.
 
     Returns:
         None
-
     """
-    # Load the Excel file
-    df = pd.read_excel(excel_file_path)
-
-    # Load JSON file
-    with open(json_file_path, 'r') as json_file:
-        json_data = json.load(json_file)
-        elements_df = pd.DataFrame(json_data['elements'])
-
     # Process each row in the Excel file
     for row_number, row in df.iterrows():
         Files = row['Files']
@@ -154,7 +166,53 @@ def process_files(excel_file_path, json_file_path, updated_json_file_path):
                 elements_df.at[index_number, 'Text'] = ""
                 new_text = elements_df.at[index_number, 'Text']
                 print(f'Text changed in JSON: {new_text}')
-                    
+
+# Function to export the updated elements as a CSV file
+def export_elements_csv(elements_df):
+    """
+    Exports the updated elements to a CSV file in the Downloads folder for checking.
+
+    Args:
+        elements_df (pd.DataFrame): The updated elements.
+
+    Returns:
+        None
+    """
+    # Get the path to the Downloads folder
+    downloads_folder = os.path.join(os.path.expanduser("~"), "Downloads")
+
+    # Set the CSV output path to the Downloads folder
+    csv_output_path = os.path.join(downloads_folder, 'updated_elements.csv')
+
+    # Output the updated elements_df as a CSV file
+    elements_df.to_csv(csv_output_path, index=False)
+    print(f"Updated elements DataFrame exported to CSV in the Downloads folder: {csv_output_path}")
+
+# Function to process the Excel file and update the JSON file
+def process_files(excel_file_path, json_file_path, updated_json_file_path, json_data=None):
+    """
+    Processes an Excel file and a JSON file to update the JSON based on the Excel data.
+
+    Args:
+        excel_file_path (str): Path to the Excel file to process.
+        json_file_path (str): Path to the JSON file to update, ignored if json_data is given.
+        updated_json_file_path (str): Path where the updated JSON file will be saved.
+        json_data (dict, optional): The already parsed JSON data (e.g. read from an extract bundle). Defaults to None.
+
+    Returns:
+        None
+
+    """
+    # Load the Excel file
+    df = pd.read_excel(excel_file_path)
+
+    # Load JSON file
+    if json_data is None:
+        with open(json_file_path, 'r') as json_file:
+            json_data = json.load(json_file)
+    elements_df = pd.DataFrame(json_data['elements'])
+
+    update_elements(df, elements_df)
 
     # Convert the updated DataFrame back to a list of dictionaries
     updated_elements = elements_df.to_dict(orient='records')
@@ -169,15 +227,35 @@ def process_files(excel_file_path, json_file_path, updated_json_file_path):
 
     print("JSON file updated successfully.")
 
-    # Get the path to the Downloads folder
-    downloads_folder = os.path.join(os.path.expanduser("~"), "Downloads")
+    export_elements_csv(elements_df)
 
-    # Set the CSV output path to the Downloads folder
-    csv_output_path = os.path.join(downloads_folder, 'updated_elements.csv')
+# Function to process the Excel file and update the element table
+def process_element_table(excel_file_path, table_path, edited_text_path):
+    """
+    Processes an Excel file and the Arrow element table to update the element Text based on the Excel data.
+    Only the replaced Text column is saved, the element table itself is left unchanged.
 
-    # Output the updated elements_df as a CSV file
-    elements_df.to_csv(csv_output_path, index=False)
-    print(f"Updated elements DataFrame exported to CSV in the Downloads folder: {csv_output_path}")
+    Args:
+        excel_file_path (str): Path to the Excel file to process.
+        table_path (str): Path to the element table, which is memory-mapped.
+        edited_text_path (str): Path where the edited Text column will be saved.
+
+    Returns:
+        None
+    """
+    # Load the Excel file
+    df = pd.read_excel(excel_file_path)
+
+    # Load the element table
+    elements_df = element_table_to_df(read_element_table(table_path))
+
+    update_elements(df, elements_df)
+
+    # Save the updated Text column as a new file
+    write_text_column(elements_df['Text'], edited_text_path)
+    print("Edited Text column saved successfully.")
+
+    export_elements_csv(elements_df)
 
 # Main Application
 def main():
@@ -190,6 +268,9 @@ def main():
         - Updates the JSON file based on the Excel file.
         - Uploads the updated JSON file back to Google Drive.
 
+    If the folder has the Arrow element table written by image_summaries, only the edited Text column is saved and
+    uploaded instead of a rewritten JSON file.
+
         
     The google drive folder of interest in this script is the "PDF_Extrated data" subfolder under the "Data" folder.
 
@@ -200,9 +281,19 @@ def main():
     # Define the folder ID
     root_folder_id = '1r38pL-SjbkwYBoK5EF1_Ou4sxb3iw0H7'
 
+    # Drive client of the main thread
+    service = get_service()
+
+    # Bring the local Drive index up to date
+    drive_index.refresh(service)
+
     # List all subfolders in the root folder
     folders = list_folders_in_folder(root_folder_id)
 
+    # Only look at the folders changed since the previous run
+    folders, page_token = filter_changed_folders(service, folders, CHANGES_TOKEN_FILE, drive_index)
+
+    processed_ids = set()
     for folder in folders:
         folder_id = folder['id']
         folder_name = folder['name']
@@ -212,41 +303,79 @@ def main():
         # List all files in the folder
         files = list_files_in_folder(folder_id)
 
-        # Check if structuredData_edited.json exists in the folder
-        if any(file['name'] == 'structuredData_edited.json' for file in files):
-            print(f"Skipping folder {folder_name} as structuredData_edited.json already exists.")
+        # Check if structuredData_edited.json or the edited Text column exists in the folder
+        if any(file['name'] in ('structuredData_edited.json', EDITED_TEXT_FILE) for file in files):
+            print(f"Skipping folder {folder_name} as it has already been edited.")
+            processed_ids.add(folder_id)
             continue 
 
         # Variable to hold the path of the JSON file (if found)
         json_file_path = None
+        json_data = None
+        bundle_file = None
+        table_path = None
+        excel_file_path = None
+        has_element_table = any(file['name'] == ELEMENT_TABLE_FILE for file in files)
 
         for file in files:
             file_id = file['id']
             file_name = file['name']
             mime_type = file['mimeType']
 
-            if mime_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet':
-                # Download the Excel file
+            if mime_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' and file_name.startswith('Combined_'):
+                # Download the Combined Excel file written by image_summaries
                 excel_file_path = download_file(file_id, file_name)
                 print(f"Downloaded Excel file: {excel_file_path}")
 
-            elif mime_type == 'application/json' and file_name == 'structuredData.json':
+            elif mime_type == 'application/json' and file_name == 'structuredData.json' and not has_element_table:
                 # Download the JSON file
                 json_file_path = download_file(file_id, file_name)
                 print(f"Downloaded JSON file: {json_file_path}")
 
+            elif file_name == ELEMENT_TABLE_FILE:
+                # Download the element table
+                table_path = download_file(file_id, file_name)
+                print(f"Downloaded element table: {table_path}")
+
+            elif is_extract_bundle(file):
+                bundle_file = file
+
+        # The summaries are only complete once image_summaries has written the Combined file, try again next run
+        if not excel_file_path:
+            print(f"No Combined Excel file found in folder {folder_name}. Skipping folder.")
+            continue
+
+        # Update the element table rather than the JSON file when image_summaries has written it
+        if table_path:
+            process_element_table(excel_file_path, table_path, EDITED_TEXT_FILE)
+            upload_file(EDITED_TEXT_FILE, folder_id, service)
+            processed_ids.add(folder_id)
+            continue
+
+        # Read structuredData.json straight from the extract bundle if it was not uploaded separately
+        if not json_file_path and bundle_file:
+            json_data = read_structured_data(open_bundle(download_file_to_memory(bundle_file['id'])))
+            print(f"Read structuredData.json from extract bundle: {bundle_file['name']}")
+
         # Ensure the JSON file is downloaded
-        if json_file_path:
+        if json_file_path or json_data:
             # Define the path for the updated JSON file
             updated_json_file_path = 'structuredData_edited.json'
 
             # Process the downloaded Excel file and create the updated JSON
-            process_files(excel_file_path, json_file_path, updated_json_file_path)
+            process_files(excel_file_path, json_file_path, updated_json_file_path, json_data)
 
             # Upload the updated JSON file back to Google Drive
             upload_file(updated_json_file_path, folder_id, service)
+            processed_ids.add(folder_id)
         else:
             print("No structuredData.json file found in the folder.")
 
+    # The next run starts from here, with the changed folders this run could not edit (e.g. no JSON file yet)
+    save_page_token(CHANGES_TOKEN_FILE, page_token, [folder['id'] for folder in folders if folder['id'] not in processed_ids])
+
+    # Print the latency and retry metrics of the Drive API calls
+    drive_metrics.report()
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,196 @@
+import numpy as np
+from PIL import Image
+
+'''
+Requires user specific inputs
+
+Pre-processing of the figure images before OCR. Adobe figure renditions are often large, high DPI colour images,
+Tesseract gets slower with the number of pixels and less accurate on coloured or shaded backgrounds.
+
+PREPROCESS_CONFIG holds the steps, applied in this order (see ocr_benchmark.py to compare settings):
+
+1. 'grayscale': convert to grayscale, transparent areas become white.
+
+2. 'target_dpi': downscale images with a higher resolution (from their DPI metadata) to this DPI, None to keep the
+   resolution. Tesseract works best at about 300 DPI.
+   'max_side': downscale images whose width or height is larger than this, in pixels, whatever their DPI (images
+   often have no DPI metadata), None for no limit. 3600 is a full A4 page at about 300 DPI.
+
+3. 'binarize': adaptive binarisation, a pixel becomes black when it is darker than the mean of the
+   'binarize_window' x 'binarize_window' pixels around it by more than 'binarize_offset' (a fraction of that mean).
+   Unlike one global threshold this keeps text on shaded table cells and coloured boxes.
+
+4. 'deskew': straighten the image, the angle (up to 'max_skew' degrees either way, in 'skew_step' steps) whose
+   horizontal ink profile is the sharpest is used. Rotations by 90 degrees are left to the Tesseract OSD.
+
+Changing the settings changes the OCR cache key, so the images are OCRed again with the new settings.
+'''
+PREPROCESS_CONFIG = {
+    'grayscale': True,
+    'target_dpi': 300,
+    'max_side': 3600,
+    'binarize': True,
+    'binarize_window': 31,
+    'binarize_offset': 0.15,
+    'deskew': True,
+    'max_skew': 5.0,
+    'skew_step': 0.5,
+}
+
+# width of the downscaled copy used to estimate the skew angle
+SKEW_ESTIMATE_WIDTH = 800
+
+
+# Function to convert an image to grayscale on a white background
+def to_grayscale(img):
+    """
+    Converts an image to grayscale, flattening any transparency onto a white background.
+
+    Args:
+        img (PIL.Image.Image): The image.
+
+    Returns:
+        PIL.Image.Image: The grayscale ('L') image.
+    """
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    return img.convert('L')
+
+
+# Function to downscale an image to a target DPI
+def downscale_to_dpi(img, target_dpi):
+    """
+    Downscales an image whose DPI metadata is higher than the target DPI. Images without DPI metadata or with a
+    lower DPI are returned unchanged.
+
+    Args:
+        img (PIL.Image.Image): The image.
+        target_dpi (int): The target DPI.
+
+    Returns:
+        PIL.Image.Image: The downscaled image.
+    """
+    dpi = img.info.get('dpi')
+    if not dpi or not dpi[0] or dpi[0] <= target_dpi:
+        return img
+    scale = target_dpi / float(dpi[0])
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+
+# Function to downscale an image to a maximum side
+def downscale_to_max_side(img, max_side):
+    """
+    Downscales an image whose width or height is larger than the maximum side, keeping its aspect ratio.
+
+    Args:
+        img (PIL.Image.Image): The image.
+        max_side (int): The largest width or height, in pixels.
+
+    Returns:
+        PIL.Image.Image: The downscaled image.
+    """
+    if max(img.size) <= max_side:
+        return img
+    scale = max_side / float(max(img.size))
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, Image.LANCZOS)
+
+
+# Function to binarise an image with a local threshold
+def adaptive_binarize(img, window=31, offset=0.15):
+    """
+    Binarises a grayscale image with a threshold computed from the mean of the pixels around each pixel, using an
+    integral image so that the cost does not depend on the window size. The integral image is kept in uint32: it
+    wraps around on very large images, but the window sums taken from it are still exact as they fit in 32 bits.
+
+    Args:
+        img (PIL.Image.Image): The grayscale image.
+        window (int): The side of the square window around each pixel, in pixels (default is 31).
+        offset (float): How much darker than the local mean a pixel must be to become black (default is 0.15).
+
+    Returns:
+        PIL.Image.Image: The black and white image, as a grayscale ('L') image.
+    """
+    pixels = np.asarray(img, dtype=np.uint8)
+    height, width = pixels.shape
+    half = window // 2
+
+    integral = np.zeros((height + 1, width + 1), dtype=np.uint32)
+    integral[1:, 1:] = pixels.cumsum(axis=0, dtype=np.uint32).cumsum(axis=1, dtype=np.uint32)
+
+    rows = np.arange(height)
+    cols = np.arange(width)
+    top, bottom = np.maximum(rows - half, 0), np.minimum(rows + half + 1, height)
+    left, right = np.maximum(cols - half, 0), np.minimum(cols + half + 1, width)
+    sums = (integral[bottom][:, right] - integral[top][:, right]
+            - integral[bottom][:, left] + integral[top][:, left])
+    counts = np.outer((bottom - top).astype(np.uint32), (right - left).astype(np.uint32))
+
+    # pixel < mean * (1 - offset), without dividing by the counts
+    binary = np.where(pixels * counts < sums.astype(np.float32) * (1 - offset), 0, 255).astype(np.uint8)
+    return Image.fromarray(binary, mode='L')
+
+
+# Function to estimate the skew angle of an image
+def estimate_skew(img, max_skew=5.0, step=0.5):
+    """
+    Estimates the skew of a grayscale image with the projection profile method: text lines are horizontal when the
+    sums of dark pixels per row vary the most.
+
+    Args:
+        img (PIL.Image.Image): The grayscale image.
+        max_skew (float): The largest angle tried either way, in degrees (default is 5.0).
+        step (float): The step between the angles tried, in degrees (default is 0.5).
+
+    Returns:
+        float: The counter-clockwise rotation in degrees that straightens the image.
+    """
+    if img.width > SKEW_ESTIMATE_WIDTH:
+        img = img.resize((SKEW_ESTIMATE_WIDTH, max(1, round(img.height * SKEW_ESTIMATE_WIDTH / img.width))))
+    # dark pixels as ink, on a black background so that rotating does not add ink at the corners
+    ink = Image.fromarray((np.asarray(img) < 128).astype(np.uint8) * 255, mode='L')
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_skew, max_skew + step / 2, step):
+        profile = np.asarray(ink.rotate(float(angle), resample=Image.NEAREST, expand=True)).sum(axis=1, dtype=np.float64)
+        score = np.square(np.diff(profile)).sum()
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+# Function to pre-process an image before OCR
+def preprocess_image(img, config=None):
+    """
+    Applies the pre-processing steps enabled in the config to an image, see PREPROCESS_CONFIG.
+
+    Args:
+        img (PIL.Image.Image): The image.
+        config (dict, optional): The pre-processing settings. Defaults to None (PREPROCESS_CONFIG).
+
+    Returns:
+        PIL.Image.Image: The pre-processed image.
+    """
+    config = {**PREPROCESS_CONFIG, **(config or {})}
+    dpi = img.info.get('dpi')
+
+    if config['grayscale'] or config['binarize'] or config['deskew']:
+        img = to_grayscale(img)
+        if dpi:
+            img.info['dpi'] = dpi
+    if config['target_dpi']:
+        img = downscale_to_dpi(img, config['target_dpi'])
+    if config['max_side']:
+        img = downscale_to_max_side(img, config['max_side'])
+    if config['binarize']:
+        img = adaptive_binarize(img, config['binarize_window'], config['binarize_offset'])
+    if config['deskew']:
+        angle = estimate_skew(img, config['max_skew'], config['skew_step'])
+        if angle:
+            # nearest neighbour keeps a binarised image black and white
+            resample = Image.NEAREST if config['binarize'] else Image.BICUBIC
+            img = img.rotate(angle, resample=resample, expand=True, fillcolor=255)
+    return img
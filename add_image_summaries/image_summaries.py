@@ -1,22 +1,26 @@
 # Overview of version: This generates the image summary INDIVIDUALLY based on text extracted from CSV FILE ONLY and output by matching to existing excel file INDIVIDUALLY.
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 import io
 import json
 import openpyxl
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Alignment
 from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
-from google.oauth2 import service_account
+from drive_api import configure_drive, drive_metrics, execute, filter_changed_folders, get_service, next_chunk, save_page_token
+from disk_cache import DiskCache, cache_key
+from drive_index import DriveIndex, md5_checksum, upload_or_update
+from element_table import ELEMENT_TABLE_FILE, build_element_table, write_arrow_file
+from extract_bundle import IMAGE_EXTENSIONS, TABLE_EXTENSIONS, is_extract_bundle, list_members, open_bundle, read_structured_data
+from ocr import ocr_images
 from PIL import Image
-import pytesseract
-import google.generativeai as genai
+from path_index import PathIndex
+from summary_dispatcher import acquire_quota, dispatch
+from vocabulary import gibberish_flags, valid_word_counts
 import os
+import posixpath
+from functools import lru_cache
 import pandas as pd
-import nltk
-from nltk.corpus import words
 
-# Authenticate and build the google Drive API client
+# Authenticate the google Drive API clients, built lazily for each thread by get_service
 '''
 Requires user specific inputs.
 
@@ -24,18 +28,109 @@ Replace SERVICE_ACCOUNT_FILE with the path to your JSON key file.
 '''
 SCOPES = ['https://www.googleapis.com/auth/drive']
 SERVICE_ACCOUNT_FILE = ''
-creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-service = build('drive', 'v3', credentials=creds)
+configure_drive(SERVICE_ACCOUNT_FILE, SCOPES)
 
-# Authenticate and build the gemini API client
+# page token of the Drive changes feed, saved after every successful run so that the next run only processes the
+# folders changed since. Delete the file to process every folder again.
+CHANGES_TOKEN_FILE = 'drive_changes_token_image_summaries.txt'
+
+# local index of the Drive folder and file metadata, used for every lookup, see drive_index.py
+drive_index = DriveIndex()
+
+# Authenticate and build the gemini API client, built lazily once per process by get_model
 '''
 Requires user specific inputs.
 
 Replace GEMINI_API_KEY with your gemini api key obtained.
+
+Successful summaries are cached in SUMMARY_CACHE_FILE, keyed by the prompt version, GEMINI_MODEL_NAME and the
+extracted text, so reruns only request the summaries that are new or failed before. Increase the prompt version
+next to a prompt (e.g. IMAGE_SUMMARY_PROMPT_VERSION) when editing it, so that the summaries are generated again.
 '''
 GEMINI_API_KEY = ''
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-flash')
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+SUMMARY_CACHE_FILE = 'summary_cache.sqlite'
+
+summary_cache = DiskCache(SUMMARY_CACHE_FILE, 'summaries')
+
+# Function to build the gemini model, once per process
+@lru_cache(maxsize=None)
+def get_model():
+    # imported here so that importing this script stays cheap for worker processes and tools
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+# model used instead of gemini when set with use_model (e.g. a StubModel for offline benchmarks, see stub_model.py)
+_model_override = None
+
+# Function to replace the gemini model with another client with the same interface
+def use_model(model):
+    """
+    Sends every summary request to the given client instead of gemini.
+
+    Args:
+        model: A client with generate_content(contents, generation_config=None) (see stub_model.py), or None to
+            use gemini again.
+
+    Returns:
+        None
+    """
+    global _model_override
+    _model_override = model
+
+# Function to send a prompt to gemini within the rate limits, see summary_dispatcher.py
+def generate_content(prompt, generation_config=None):
+    acquire_quota(prompt)
+    model = _model_override if _model_override is not None else get_model()
+    return model.generate_content(prompt, generation_config=generation_config)
+
+# Function to get the text of a gemini response
+def response_text(response):
+    # Debugging: Print the raw response
+    print("API Response:", response)
+    
+    # Safely access response content
+    if hasattr(response, 'text') and response.text:
+        return response.text.strip()
+    elif 'content' in response and response['content']:
+        return response['content'].strip()
+    return None
+
+# placeholders written instead of a summary when gemini gives none, they are never cached
+SUMMARY_EMPTY = "Summary could not be generated."
+SUMMARY_ERROR = "Error generating summary."
+FAILED_SUMMARIES = (SUMMARY_EMPTY, SUMMARY_ERROR)
+
+# Function to request a summary, reusing the cached one if there is one
+def request_summary(prompt, prompt_version, extracted_text):
+    """
+    Sends a summary prompt to gemini, unless a summary of the same text with the same prompt version and model is
+    cached. Only successful summaries are cached, so failed ones are requested again on the next run.
+
+    Args:
+        prompt (str or list): The full prompt, including the extracted text, or its parts (strings and images).
+        prompt_version (str): The name and version of the prompt template (e.g. 'image:1').
+        extracted_text (str or bytes): The extracted text (or image content) the prompt is built from.
+
+    Returns:
+        str: The summary, SUMMARY_EMPTY for an empty response or SUMMARY_ERROR if the request failed.
+    """
+    key = cache_key(prompt_version, GEMINI_MODEL_NAME, extracted_text)
+    summary = summary_cache.get(key)
+    if summary is not None:
+        return summary
+
+    try:
+        summary = response_text(generate_content(prompt))
+        if summary is None:
+            return SUMMARY_EMPTY
+    except Exception as e:
+        print(f"Error generating summary: {e}")
+        return SUMMARY_ERROR
+
+    summary_cache.set(key, summary)
+    return summary
 
 # Function to list folders in shared drive
 def list_folders_in_drive(service):
@@ -48,8 +143,8 @@ def list_folders_in_drive(service):
     Returns:
     list: A list of dictionaries containing folder id and name.
     """
-    results = service.files().list(q="mimeType = 'application/vnd.google-apps.folder'",
-                                   pageSize=100, fields="files(id, name)").execute()
+    results = execute(service.files().list(q="mimeType = 'application/vnd.google-apps.folder'",
+                                           pageSize=100, fields="files(id, name)"))
     return results.get('files', [])
 
 # Function to find the fileid GIVEN filename
@@ -64,16 +159,11 @@ def find_file_id(file_name, folder_id=None):
     Returns:
     str: The file ID of the found file, or None if not found.
     """
-    # find using exact file_name provided
-    query = f"name='{file_name}'"
-    # if folderid provided (optional), include it in the search criteria
+    # find using exact file_name provided, in the folder if provided (optional) or else in every indexed folder
     if folder_id:
-        query += f" and '{folder_id}' in parents"
-    
-    # variable to contain search results from google api
-    results = service.files().list(q=query, fields="files(id, name)").execute()
-    # extracts the list of files from result
-    items = results.get('files', [])
+        items = drive_index.children(get_service(), folder_id, name=file_name)
+    else:
+        items = drive_index.find_by_name(file_name)
 
     # if no files found
     if not items:
@@ -88,7 +178,8 @@ def find_file_id(file_name, folder_id=None):
 # Function to upload excel to drive
 def upload_excel_to_drive(service, folder_id, file_name):
     """
-    Uploads an Excel file to Google Drive in the specified folder.
+    Uploads an Excel file to Google Drive in the specified folder. An existing file with the same name is updated
+    in place, or left untouched if its content is unchanged.
     
     Args:
     service: Authorized Google Drive API service instance.
@@ -98,73 +189,96 @@ def upload_excel_to_drive(service, folder_id, file_name):
     Returns:
     None
     """
-    file_metadata = {
-        'name': file_name,
-        'parents': [folder_id],
-        'mimeType': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    }
-    media = MediaFileUpload(file_name, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    media = MediaFileUpload(file_name, mimetype=mime_type)
+    upload_or_update(service, drive_index, folder_id, file_name, media, md5_checksum(file_name), mime_type)
 
-# Function to match and merge the dataframes
-def merge_excel_files(structured_df, excel_summaries_df):
+# Function to write and upload the element table
+def upload_element_table(service, folder_id, data):
     """
-    Merges two dataframes by matching file names from an Excel summary dataframe with a structured dataframe.
-    
+    Writes the Arrow element table of a document and uploads it to Google Drive, so that edit_json and the
+    chunkers can memory-map it instead of re-parsing structuredData.json.
+
     Args:
-    structured_df (DataFrame): The dataframe containing structured data.
-    excel_summaries_df (DataFrame): The dataframe containing Excel summaries to merge.
-    
+    service: Authorized Google Drive API service instance.
+    folder_id (str): The ID of the folder to upload to.
+    data (dict): The parsed JSON data containing the 'elements' extracted from the PDF.
+
     Returns:
-    DataFrame: The updated structured dataframe with merged summaries.
+    None
     """
-    # Iterate through each row in the excel summaries dataframe
-    for _, summary_row in excel_summaries_df.iterrows():
-        file_name = summary_row['File Name']
-        summary = summary_row['Summary']
-        
-        # Iterate through the structured dataframe to find a match
-        for idx, structured_row in structured_df.iterrows():
-            files = structured_row['Files'].split(', ')
-            if any(file_name in file for file in files):
-                # If a match is found, append the summary to the 'Summaries' column
-                if pd.isna(structured_df.at[idx, 'Summaries']):
-                    structured_df.at[idx, 'Summaries'] = summary
-                else:
-                    structured_df.at[idx, 'Summaries'] += "\n" + summary
-    
-    return structured_df
+    write_arrow_file(build_element_table(data), ELEMENT_TABLE_FILE)
+    media = MediaFileUpload(ELEMENT_TABLE_FILE, mimetype='application/vnd.apache.arrow.file')
+    upload_or_update(service, drive_index, folder_id, ELEMENT_TABLE_FILE, media, md5_checksum(ELEMENT_TABLE_FILE))
+    print(f"Uploaded {ELEMENT_TABLE_FILE} to folder {folder_id}")
 
-# Function to match and merge the dataframes SECOND TIME (for image summaries)
-def second_merge_excel_files(combined_df, image_summaries_df):
+# Function to normalise file names into merge keys
+def summary_key(names):
     """
-    Merges two dataframes by matching image names from an image summaries dataframe with a combined dataframe.
-    
+    Normalises file names or paths (e.g. 'figures/fileoutpart3.png') into merge keys: the basename, stripped and
+    case folded.
+
     Args:
-    combined_df (DataFrame): The dataframe containing combined data.
-    image_summaries_df (DataFrame): The dataframe containing image summaries to merge.
-    
+    names (Series): The file names or paths.
+
     Returns:
-    DataFrame: The updated combined dataframe with merged image summaries.
+    Series: The merge keys.
     """
-    # Iterate through each row in the image summaries dataframe
-    for _, summary_row in image_summaries_df.iterrows():
-        image_name = summary_row['Image Name']
-        summary = summary_row['Summary']
-        
-        # Iterate through the structured dataframe to find a match
-        for idx, combined_row in combined_df.iterrows():
-            # Check if 'Summaries' column is empty or has the error message
-            if pd.isna(combined_row['Summaries']) or combined_row['Summaries'] == "Error generating summary.":
-                files = combined_row['Files'].split(', ')
-                if any(image_name in file for file in files):
-                    # If a match is found, append the summary to the 'Summaries' column
-                    if pd.isna(combined_df.at[idx, 'Summaries']):
-                        combined_df.at[idx, 'Summaries'] = summary
-                    else:
-                        combined_df.at[idx, 'Summaries'] += "\n" + summary
-    
-    return combined_df
+    return names.astype(str).map(posixpath.basename).str.strip().str.casefold()
+
+# Function to match and merge the summaries into the structured dataframe
+def merge_summaries(structured_df, summary_sources):
+    """
+    Merges summary sources into the 'Summaries' column of a structured dataframe in one pass per source. The file
+    basenames in the 'Files' column are indexed once and each source is hash joined against that index.
+
+    A source in 'append' mode adds its summaries to every matching row, in the order of the source. A source in
+    'fill' mode only writes to rows whose summary is empty or a failed summary placeholder (FAILED_SUMMARIES), with the
+    first matching summary, which replaces the placeholder.
+    Summary file names that match no row are reported.
+
+    Args:
+    structured_df (DataFrame): The dataframe containing structured data, with 'Files' and 'Summaries' columns.
+    summary_sources (list): (summaries_df, name_column, mode) tuples, applied in order. summaries_df has the file
+        names in name_column and the summaries in 'Summary', mode is 'append' or 'fill'.
+
+    Returns:
+    DataFrame: The updated structured dataframe with merged summaries.
+    """
+    # index the basenames of the files of each row once
+    files_index = pd.DataFrame({
+        'row': range(len(structured_df)),
+        'file': structured_df['Files'].fillna('').astype(str).str.split(', ')
+    }).explode('file')
+    files_index['key'] = summary_key(files_index['file'])
+    files_index = files_index[files_index['key'] != ''].drop_duplicates(['row', 'key'])
+
+    summaries = pd.Series(structured_df['Summaries'].to_numpy(), dtype=object)
+    for summaries_df, name_column, mode in summary_sources:
+        source = pd.DataFrame({
+            'order': range(len(summaries_df)),
+            'name': summaries_df[name_column].to_numpy(),
+            'key': summary_key(summaries_df[name_column]).to_numpy(),
+            'summary': summaries_df['Summary'].to_numpy()
+        })
+        unmatched = source.loc[~source['key'].isin(files_index['key']), 'name']
+        if not unmatched.empty:
+            print(f"No row found for {len(unmatched)} files: {', '.join(unmatched.astype(str))}")
+
+        matches = source[source['summary'].notna()].merge(files_index, on='key')
+        matches = matches.drop_duplicates(['row', 'order']).sort_values(['row', 'order'])
+        if mode == 'fill':
+            empty_rows = summaries.isna() | summaries.isin(FAILED_SUMMARIES)
+            matches = matches[matches['row'].map(empty_rows)].drop_duplicates('row')
+
+        added = matches['summary'].astype(str).groupby(matches['row']).agg('\n'.join).reindex(summaries.index).astype(object)
+        if mode == 'fill':
+            summaries = summaries.mask(added.notna() & summaries.isin(FAILED_SUMMARIES))
+        joined = (summaries + "\n" + added).where(summaries.notna(), added)
+        summaries = summaries.mask(added.notna(), joined)
+
+    structured_df['Summaries'] = summaries.to_numpy()
+    return structured_df
 
 
 # Function to delete xlsx file in drive
@@ -179,11 +293,8 @@ def delete_existing_xlsx_files(service, folder_id):
     Returns:
     None
     """
-    # Query to find existing .xlsx files in the specified folder
-    query = f"'{folder_id}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
-    
-    # Fetch the list of files matching the query
-    files = service.files().list(q=query, pageSize=10, fields="files(id, name)").execute().get('files', [])
+    # Find the existing .xlsx files in the specified folder
+    files = drive_index.children(service, folder_id, mime_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     
     # Check if there are files to delete
     if not files:
@@ -193,7 +304,8 @@ def delete_existing_xlsx_files(service, folder_id):
     # Iterate over the list of files and attempt to delete each
     for file in files:
         try:
-            service.files().delete(fileId=file['id']).execute()
+            execute(service.files().delete(fileId=file['id']))
+            drive_index.remove(file['id'])
             print(f"Deleted existing file {file['name']} from folder {folder_id}")
         except Exception as e:
             print(f"Failed to delete file {file['name']} from folder {folder_id}: {e}")
@@ -213,7 +325,8 @@ def delete_file_by_name(file_name, folder_id=None):
     file_id = find_file_id(file_name, folder_id)
     if file_id:
         try:
-            service.files().delete(fileId=file_id).execute()
+            execute(get_service().files().delete(fileId=file_id))
+            drive_index.remove(file_id)
             print(f'Successfully deleted file with name: {file_name}')
         except Exception as e:
             print(f'Error deleting file {file_name}: {e}')
@@ -236,7 +349,7 @@ def download_json_file(service, file_id, file_name):
     downloader = MediaIoBaseDownload(fh, request)
     done = False
     while done is False:
-        status, done = downloader.next_chunk()
+        status, done = next_chunk(downloader)
 
 # Function to process a JSON file: extracts paths, objects, and texts, and generates an Excel file containing this information.
 def process_json_and_generate_excel(json_file, excel_file):
@@ -253,6 +366,20 @@ def process_json_and_generate_excel(json_file, excel_file):
     with open(json_file, 'r') as f:
         data = json.load(f)
 
+    generate_excel_from_data(data, excel_file)
+
+# Function to generate the Excel file of paths, objects, and texts from parsed JSON data
+def generate_excel_from_data(data, excel_file):
+    """
+    Extracts paths, objects, and texts from parsed structuredData JSON data and generates an Excel file with this data.
+    
+    Args:
+    data (dict): The parsed JSON data containing the 'elements' extracted from the PDF.
+    excel_file (str): The path to save the output Excel file.
+    
+    Returns:
+    None
+    """
     # eg filePaths:'Path'
     general_paths = {}
     # eg filePaths:[]
@@ -276,14 +403,16 @@ def process_json_and_generate_excel(json_file, excel_file):
         texts[key] = []
         specific_paths[key] = []
 
+    # index the text elements by sorted Path once, the elements under each figure are then found by binary search
+    text_elements = [element for element in data['elements'] if 'Text' in element]
+    path_index = PathIndex([element['Path'] for element in text_elements])
+
     for key, value in general_paths.items():
-        for element in data['elements']:
-            if (element['Path'] + '/' == value or 
-                    (element['Path'].startswith(value) and len(element['Path']) > len(value))):
-                if 'Text' in element:
-                    texts[key].append(element['Text'])
-                    objects_text[key].append(element['ObjectID'])
-                    specific_paths[key].append(element['Path'])
+        for position in path_index.descendants(value[:-1]):
+            element = text_elements[position]
+            texts[key].append(element['Text'])
+            objects_text[key].append(element['ObjectID'])
+            specific_paths[key].append(element['Path'])
 
     combined_dict = {}
     for key in general_paths.keys():
@@ -310,11 +439,6 @@ def process_json_and_generate_excel(json_file, excel_file):
 
     wb.save(excel_file)
 
-nltk.download('words')
-
-# Set of valid English words
-english_vocab = set(words.words())
-
 # Function to detect gibberish
 # Adjust threshold as needed (now it's 90%)
 def is_gibberish(text, threshold=0.9):
@@ -329,14 +453,8 @@ def is_gibberish(text, threshold=0.9):
     Returns:
         bool: True if the text is considered gibberish, False otherwise.
     """
-    # Split the text into words and filter out short words
-    words_in_text = [word for word in text.split() if len(word) > 2]
-
-    # Check if there's a significant presence of valid English words
-    valid_words = [word for word in words_in_text if word.lower() in english_vocab]
-    
-    # Determine gibberish based on the stricter threshold
-    return len(valid_words) < len(words_in_text) * threshold
+    # Words longer than 2 characters are looked up lowercased in the compiled vocabulary, see vocabulary.py
+    return gibberish_flags([text], threshold)[0]
 
 # Function to download image from Google Drive
 def download_image_file(service, file_id, file_name):
@@ -357,34 +475,44 @@ def download_image_file(service, file_id, file_name):
     downloader = MediaIoBaseDownload(fh, request)
     done = False
     while not done:
-        status, done = downloader.next_chunk()
+        status, done = next_chunk(downloader)
     return file_name
 
-# Function to extract text from image using tesseract
-def extract_text_from_image(image_file):
+# Function to extract text from images using tesseract
+def extract_texts_from_images(image_names, image_sources):
     """
-    Extracts text from an image using Tesseract OCR. Attempts to rotate the image if the extracted 
-    text is gibberish, trying up to 3 rotations (90, 180, and 270 degrees).
+    Extracts the text of images using Tesseract OCR across a pool of worker processes (see ocr.py). Each image is
+    turned upright using the orientation detected by Tesseract before it is OCRed.
 
     Args:
-        image_file (str): The path to the image file from which to extract text.
+        image_names (list): The name of each image, used in the messages.
+        image_sources (list): The path or content (bytes) of each image.
 
     Returns:
-        str: The extracted text from the image.
+        list: The extracted text of each image, in the order of the images.
     """
-    img = Image.open(image_file)
-    text = pytesseract.image_to_string(img)
-
-    # If the text is gibberish, try rotating the image and re-extracting
-    for i in range(3):  # Try up to 3 rotations (90, 180, 270 degrees)
-        if not is_gibberish(text):
-            break  # Exit loop if valid text is found
-
-        img = img.rotate(90, expand=True)  # Rotate the image 90 degrees clockwise
-        text = pytesseract.image_to_string(img)
-
-    print(text)
-    return text
+    texts = ocr_images(image_sources)
+    for image_name, text, gibberish in zip(image_names, texts, gibberish_flags(texts)):
+        if gibberish:
+            print(f"The text extracted from {image_name} does not look like English, check the image.")
+        print(text)
+    return texts
+
+# version of the image summary prompt, increase it when the prompt is edited
+IMAGE_SUMMARY_PROMPT_VERSION = 1
+
+# instructions of the image summary prompt, shared by the single and batched requests
+IMAGE_SUMMARY_INSTRUCTIONS = (
+    "The following text is extracted from either images of flow charts, tables, questionnaires, or figures."
+    "Firstly, determine and remember what type of image the text was extracted from."
+    "Next, I would like you to summerise the text extracted. Ensure that the summary reflects the image structure and all textual information extracted"
+    "Organize the summary as follows:\n"
+    "1. For flow charts: Describe the flow and connections between boxes. Summarize the steps and decisions.\n"
+    "2. For tables: Determine the column and row structure. Then, for each row of the table, explain the text in the row with relevance to the columns. Include the row contents succinctly.\n"
+    "3. For questionnaires: Summarize the questions and the options for the questions. Ensure clarity and coherence.\n\n"
+    "4, For figures, briefly describe the texts extracted from the image."
+    "Ignore any gibberish or non-sensical content. Do not include any extraneous information or explanations. Provide a complete, clear, and concise summary of the extracted content.\n\n"
+)
 
 # Function to generate summary using gemini given text
 def generate_image_summary(extracted_text):
@@ -398,35 +526,210 @@ def generate_image_summary(extracted_text):
     Returns:
         str: A concise summary of the extracted content.
     """
+    prompt = IMAGE_SUMMARY_INSTRUCTIONS + f"Text: {extracted_text}"
+
+    return request_summary(prompt, f"image:{IMAGE_SUMMARY_PROMPT_VERSION}", extracted_text)
+
+# Batched image summaries
+'''
+Requires user specific inputs.
+
+Images with little text (logos, axis labels, small flow charts) are summarised several per request, with a JSON
+response keyed by image name, instead of sending the long instructions once per image. Images missing from the
+response, or all the images of a batch whose response cannot be parsed, are summarised one by one instead.
+
+1. BATCH_MAX_WORDS is the largest number of words extracted from an image for it to be batched (0 disables batching).
+
+2. BATCH_SIZE is the maximum number of images per batched request.
+'''
+BATCH_MAX_WORDS = 60
+BATCH_SIZE = 10
+IMAGE_BATCH_PROMPT_VERSION = 1
+
+# Function to look up the cached summary of an image text
+def cached_image_summary(extracted_text):
+    # a summary generated alone or in a batch is reused either way
+    for prompt_version in (f"image:{IMAGE_SUMMARY_PROMPT_VERSION}", f"image-batch:{IMAGE_BATCH_PROMPT_VERSION}"):
+        summary = summary_cache.get(cache_key(prompt_version, GEMINI_MODEL_NAME, extracted_text))
+        if summary is not None:
+            return summary
+    return None
+
+# Function to summarise several small image texts in one request
+def generate_batch_summaries(batch):
+    """
+    Summarises the extracted texts of several images in one request, with a JSON response keyed by image name.
+
+    Args:
+        batch (list): (image_name, extracted_text) tuples, with unique image names.
+
+    Returns:
+        dict: The summary of each image found in the response, empty if the request or its parsing failed.
+    """
     prompt = (
-        "The following text is extracted from either images of flow charts, tables, questionnaires, or figures."
-        "Firstly, determine and remember what type of image the text was extracted from."
-        "Next, I would like you to summerise the text extracted. Ensure that the summary reflects the image structure and all textual information extracted"
-        "Organize the summary as follows:\n"
-        "1. For flow charts: Describe the flow and connections between boxes. Summarize the steps and decisions.\n"
-        "2. For tables: Determine the column and row structure. Then, for each row of the table, explain the text in the row with relevance to the columns. Include the row contents succinctly.\n"
-        "3. For questionnaires: Summarize the questions and the options for the questions. Ensure clarity and coherence.\n\n"
-        "4, For figures, briefly describe the texts extracted from the image."
-        "Ignore any gibberish or non-sensical content. Do not include any extraneous information or explanations. Provide a complete, clear, and concise summary of the extracted content.\n\n"
-        f"Text: {extracted_text}"
+        IMAGE_SUMMARY_INSTRUCTIONS
+        + "The texts of several images are given below, each after the name of its image. Summarise the text of each "
+          "image separately, following the rules above. Respond with a JSON object whose keys are the image names "
+          "exactly as given and whose values are the summaries.\n\n"
+        + "\n\n".join(f"Image: {image_name}\nText: {extracted_text}" for image_name, extracted_text in batch)
     )
-
     try:
-        response = model.generate_content(prompt)
-        
-        # Debugging: Print the raw response
-        print("API Response:", response)
-        
-        # Safely access response content
-        if hasattr(response, 'text') and response.text:
-            return response.text.strip()
-        elif 'content' in response and response['content']:
-            return response['content'].strip()
-        else:
-            return "Summary could not be generated."
+        text = response_text(generate_content(prompt, generation_config={'response_mime_type': 'application/json'}))
+        summaries = json.loads(text) if text else None
     except Exception as e:
-        print(f"Error generating summary: {e}")
-        return "Error generating summary."
+        print(f"Error generating batched summaries, summarising the {len(batch)} images one by one: {e}")
+        return {}
+    if not isinstance(summaries, dict):
+        print(f"Batched summaries could not be parsed, summarising the {len(batch)} images one by one.")
+        return {}
+
+    results = {}
+    for image_name, extracted_text in batch:
+        summary = summaries.get(image_name)
+        if isinstance(summary, str) and summary.strip():
+            results[image_name] = summary.strip()
+            summary_cache.set(cache_key(f"image-batch:{IMAGE_BATCH_PROMPT_VERSION}", GEMINI_MODEL_NAME, extracted_text),
+                              results[image_name])
+    return results
+
+# Direct image summaries
+'''
+Requires user specific inputs.
+
+For flow charts and scanned tables the OCR text is often too poor for a good summary, these images can be sent to
+the multimodal model directly (downscaled) instead of their extracted text. An image takes the direct path when
+less than DIRECT_MAX_VALID_RATIO of its extracted words are English words (see vocabulary.py) or when it has fewer
+than DIRECT_MIN_WORDS_PER_MEGAPIXEL extracted words per megapixel, i.e. it is mostly graphics.
+
+1. DIRECT_SUMMARY enables the direct path.
+
+2. DIRECT_MAX_VALID_RATIO and DIRECT_MIN_WORDS_PER_MEGAPIXEL are the thresholds of the heuristic.
+
+3. DIRECT_IMAGE_MAX_SIDE is the largest width or height, in pixels, of the image sent to the model. It is part of
+   the summary cache key, changing it generates the direct summaries again.
+'''
+DIRECT_SUMMARY = False
+DIRECT_MAX_VALID_RATIO = 0.6
+DIRECT_MIN_WORDS_PER_MEGAPIXEL = 20
+DIRECT_IMAGE_MAX_SIDE = 1536
+IMAGE_DIRECT_PROMPT_VERSION = 1
+
+# Function to open an image from its path or content
+def open_image(image_source):
+    return Image.open(io.BytesIO(image_source) if isinstance(image_source, (bytes, bytearray)) else image_source)
+
+# Function to choose the images summarised from the image itself
+def direct_summary_flags(extracted_texts, image_sources):
+    """
+    Chooses, for each image, whether it is summarised from the image itself rather than its extracted text, from
+    the proportion of valid English words and the number of words per megapixel of the extracted text.
+
+    Args:
+        extracted_texts (list): The text extracted from each image.
+        image_sources (list): The path or content (bytes) of each image.
+
+    Returns:
+        list: True for each image to summarise directly, False otherwise.
+    """
+    valid_counts, totals = valid_word_counts(extracted_texts)
+    flags = []
+    for valid, total, image_source in zip(valid_counts, totals, image_sources):
+        with open_image(image_source) as img:
+            megapixels = img.width * img.height / 1e6
+        flags.append(bool(valid < total * DIRECT_MAX_VALID_RATIO or total < megapixels * DIRECT_MIN_WORDS_PER_MEGAPIXEL))
+    return flags
+
+# Function to generate summary using gemini given the image itself
+def generate_direct_summary(image_source):
+    """
+    Summarises an image by sending the (downscaled) image itself to the multimodal model.
+
+    Args:
+        image_source (str or bytes): The path or content of the image.
+
+    Returns:
+        str: A concise summary of the image, or an error message as returned by request_summary.
+    """
+    if isinstance(image_source, (bytes, bytearray)):
+        content = bytes(image_source)
+    else:
+        with open(image_source, 'rb') as f:
+            content = f.read()
+
+    with open_image(content) as img:
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+        img.thumbnail((DIRECT_IMAGE_MAX_SIDE, DIRECT_IMAGE_MAX_SIDE))
+        png = io.BytesIO()
+        img.save(png, format='PNG')
+
+    prompt = [
+        IMAGE_SUMMARY_INSTRUCTIONS.replace("The following text is extracted from", "The following image is")
+        + "The image itself is given instead of its extracted text, read the text from the image.",
+        {'mime_type': 'image/png', 'data': png.getvalue()}
+    ]
+    # the image content is hashed into the cache key like an extracted text, with the size the image is sent at
+    return request_summary(prompt, f"image-direct:{IMAGE_DIRECT_PROMPT_VERSION}:{DIRECT_IMAGE_MAX_SIDE}", content)
+
+# Function to summarise the extracted texts of several images
+def generate_image_summaries(image_names, extracted_texts, image_sources=None):
+    """
+    Summarises the extracted texts of several images through the summary dispatcher. Cached summaries are reused,
+    images with at most BATCH_MAX_WORDS words are summarised in batches and the other ones, or those a batch failed
+    to summarise, with one request each. With DIRECT_SUMMARY, the images chosen by direct_summary_flags are
+    summarised from the image itself.
+
+    Args:
+        image_names (list): The name of each image.
+        extracted_texts (list): The text extracted from each image.
+        image_sources (list, optional): The path or content (bytes) of each image, needed for the direct path.
+            Defaults to None.
+
+    Returns:
+        list: The summary of each image, in the order of the images.
+    """
+    summaries = [None] * len(image_names)
+    if DIRECT_SUMMARY and image_sources is not None:
+        direct = [index for index, flag in enumerate(direct_summary_flags(extracted_texts, image_sources)) if flag]
+        if direct:
+            print(f"Summarising {len(direct)} images from the image itself...")
+            for index, summary in zip(direct, dispatch(generate_direct_summary, [image_sources[i] for i in direct])):
+                summaries[index] = summary
+
+    for index, extracted_text in enumerate(extracted_texts):
+        if summaries[index] is None:
+            summaries[index] = cached_image_summary(extracted_text)
+
+    # pack the small texts into batches, an image name appears at most once per batch
+    batches = []
+    singles = []
+    for index, (image_name, extracted_text) in enumerate(zip(image_names, extracted_texts)):
+        if summaries[index] is not None:
+            continue
+        if not BATCH_MAX_WORDS or len(extracted_text.split()) > BATCH_MAX_WORDS:
+            singles.append(index)
+            continue
+        if not batches or len(batches[-1]) >= BATCH_SIZE or any(image_names[i] == image_name for i in batches[-1]):
+            batches.append([])
+        batches[-1].append(index)
+    # a batch of one image is a normal request
+    singles.extend(batch[0] for batch in batches if len(batch) == 1)
+    batches = [batch for batch in batches if len(batch) > 1]
+
+    if batches:
+        print(f"Summarising {sum(len(batch) for batch in batches)} small images in {len(batches)} batched requests...")
+        batch_results = dispatch(generate_batch_summaries,
+                                 [[(image_names[i], extracted_texts[i]) for i in batch] for batch in batches])
+        for batch, results in zip(batches, batch_results):
+            for index in batch:
+                if image_names[index] in results:
+                    summaries[index] = results[image_names[index]]
+                else:
+                    singles.append(index)
+
+    singles.sort()
+    for index, summary in zip(singles, dispatch(generate_image_summary, [extracted_texts[i] for i in singles])):
+        summaries[index] = summary
+    return summaries
     
 # Function to recursively process images in all folders and subfolders and output as a temp excel
 def process_images(service, folder_id, worksheet):
@@ -442,24 +745,22 @@ def process_images(service, folder_id, worksheet):
     Returns:
         None
     """
-    query = f"'{folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder'"
-    subfolders = service.files().list(q=query, pageSize=100, fields="files(id, name)").execute().get('files', [])
+    subfolders = drive_index.children(service, folder_id, folders=True)
     
     for subfolder in subfolders:
         process_images(service, subfolder['id'], worksheet)
     
-    query = f"'{folder_id}' in parents and mimeType contains 'image/'"
-    images = service.files().list(q=query, pageSize=100, fields="files(id, name)").execute().get('files', [])
+    images = drive_index.children(service, folder_id, mime_prefix='image/')
+
+    # download every image of the folder first so that they can be OCRed together
+    local_image_files = [download_image_file(service, image['id'], image['name']) for image in images]
+    extracted_texts = extract_texts_from_images([image['name'] for image in images], local_image_files)
+    print(f"Summarising {len(images)} images...")
+    summaries = generate_image_summaries([image['name'] for image in images], extracted_texts, local_image_files)
     
-    for image in images:
-        image_name = image['name']
-        print(f"Processing {image_name}...")
-        local_image_file = download_image_file(service, image['id'], image_name)
-        extracted_text = extract_text_from_image(local_image_file)
-        summary = generate_image_summary(extracted_text)
-        
+    for image, local_image_file, summary in zip(images, local_image_files, summaries):
         # Append to Excel worksheet
-        worksheet.append([image_name, summary])
+        worksheet.append([image['name'], summary])
         os.remove(local_image_file)
 
 # Function to download an .xlsx file from Google Drive
@@ -480,7 +781,7 @@ def download_xlsx_file(service, file_id, file_name):
     downloader = MediaIoBaseDownload(fh, request)
     done = False
     while done is False:
-        status, done = downloader.next_chunk()
+        status, done = next_chunk(downloader)
         print(f"Download {int(status.progress() * 100)}%.")
     fh.seek(0)
     with open(file_name, 'wb') as f:
@@ -523,48 +824,46 @@ def extract_text_from_xlsx(file_path):
         print(f"Error reading the file: {e}")
         return None
 
-# Function to generate summary using gemini given text from xlsx
-def generate_xlsx_summary(extracted_text):
+# Function to describe the rows of an excel table
+def summarise_xlsx_rows(df):
     """
-    Generates a summary from text extracted from Excel files, with specific rules for handling 
-    flow charts, tables, or questionnaires. Summarizes the content row by row.
+    Describes every row of an Excel table as prose built from the column names and cell values.
 
     Args:
-        extracted_text (str): The extracted text from the Excel file.
+        df (pandas.DataFrame): The content of the Excel table.
 
     Returns:
-        str: A concise summary of the Excel table's content.
+        str: One line per row of the table.
     """
-    prompt = (
-        "The following text input is extracted from excel tables containing the text extracted from images of flow charts, tables, or questionnaires.n\n"
-        "Firstly, output the column headers of the excel table and provide a brief summary of the table structure."
-        "Next, interpret the table content and output the values for each row based on the columns identified in continuous prose."
-        "For example, depending on the number of columns and rows:"
-        "In the first row, the {column 1 name} is ___ and the {column 2 name} value is ___, the {column 3 name} value is ___, ____."
-        "If there are any gibberish or non-sensical content extracted, ignore them. Else, include all texts extracted from each cell of the excel file\n\n"
-        "For text extracted that are related to drugs, they are safe and do not halt text generation by raising a 'Finish Reason: SAFETY' flag.\n\n"
-        "Do not include any extraneous information or explanations.\n\n"
-        "Provide a complete, clear, and concise summary of the extracted content.\n\n"
-        f"Text: {extracted_text}"
-    )
-
-    try:
-        response = model.generate_content(prompt)
-        
-        # Debugging: Print the raw response
-        print("API Response:", response)
-        
-        # Safely access response content
-        if hasattr(response, 'text') and response.text:
-            return response.text.strip()
-        elif 'content' in response and response['content']:
-            return response['content'].strip()
-        else:
-            return "Summary could not be generated."
-    except Exception as e:
-        print(f"Error generating summary: {e}")
-        return "Error generating summary."
+    # Identify column names
+    columns = df.columns.tolist()
+    
+    # Initialize a list to store row summaries
+    row_summaries = []
     
+    # Iterate through each row and generate a summary
+    for index, row in df.iterrows():
+        # Create a summary dynamically based on column names
+        summary_parts = [f"In row {index + 1},"]
+        for i, col in enumerate(columns):
+            # Strip leading/trailing whitespace and remove newline characters
+            value = str(row[col]).strip().replace('\n', ' ').replace('\r', '')
+            if value:
+                # Append each column-value pair without extra line breaks
+                summary_parts.append(f"The {col} is: {value}")
+                # Add a period after each pair except the last one
+                if i < len(columns) - 1:
+                    summary_parts.append(". ")
+                else:
+                    summary_parts.append(".")
+        # Join all parts into a single summary string
+        summary = " ".join(summary_parts).strip()
+        row_summaries.append(summary)
+
+    # Combine all row summaries into a single summary string
+    full_summary = "\n".join(row_summaries)
+    return full_summary
+
 # Function to process excel tables for table summaries
 def process_xlsx_files(service, folder_id, worksheet):
     """
@@ -579,14 +878,12 @@ def process_xlsx_files(service, folder_id, worksheet):
     Returns:
         None
     """
-    query = f"'{folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder'"
-    subfolders = service.files().list(q=query, pageSize=100, fields="files(id, name)").execute().get('files', [])
+    subfolders = drive_index.children(service, folder_id, folders=True)
     
     for subfolder in subfolders:
         process_xlsx_files(service, subfolder['id'], worksheet)
     
-    query = f"'{folder_id}' in parents and mimeType = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
-    files = service.files().list(q=query, pageSize=100, fields="files(id, name)").execute().get('files', [])
+    files = drive_index.children(service, folder_id, mime_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     
     for file in files:
         file_name = file['name']
@@ -601,34 +898,7 @@ def process_xlsx_files(service, folder_id, worksheet):
         
         # Load the Excel file
         df = pd.read_excel(local_file)
-        
-        # Identify column names
-        columns = df.columns.tolist()
-        
-        # Initialize a list to store row summaries
-        row_summaries = []
-        
-        # Iterate through each row and generate a summary
-        for index, row in df.iterrows():
-            # Create a summary dynamically based on column names
-            summary_parts = [f"In row {index + 1},"]
-            for i, col in enumerate(columns):
-                # Strip leading/trailing whitespace and remove newline characters
-                value = str(row[col]).strip().replace('\n', ' ').replace('\r', '')
-                if value:
-                    # Append each column-value pair without extra line breaks
-                    summary_parts.append(f"The {col} is: {value}")
-                    # Add a period after each pair except the last one
-                    if i < len(columns) - 1:
-                        summary_parts.append(". ")
-                    else:
-                        summary_parts.append(".")
-            # Join all parts into a single summary string
-            summary = " ".join(summary_parts).strip()
-            row_summaries.append(summary)
-
-        # Combine all row summaries into a single summary string
-        full_summary = "\n".join(row_summaries)
+        full_summary = summarise_xlsx_rows(df)
         
         # Print the summary to check
         print(f"Summary for {file_name}:\n{full_summary}\n")
@@ -640,6 +910,87 @@ def process_xlsx_files(service, folder_id, worksheet):
         os.remove(local_file)
 
 
+# Function to process the images of an extract bundle
+def process_bundle_images(bundle, worksheet):
+    """
+    Processes all images in an Adobe PDF Extract zip bundle, extracts text, generates summaries, and appends
+    the results to an Excel worksheet. The images are read straight from the bundle without extracting it to disk.
+
+    Args:
+        bundle (zipfile.ZipFile): The opened extract bundle.
+        worksheet (openpyxl.worksheet.worksheet.Worksheet): The worksheet to append the results to.
+
+    Returns:
+        None
+    """
+    members = list_members(bundle, IMAGE_EXTENSIONS)
+    image_names = [posixpath.basename(member) for member in members]
+    image_contents = [bundle.read(member) for member in members]
+    extracted_texts = extract_texts_from_images(image_names, image_contents)
+
+    print(f"Summarising {len(image_names)} images...")
+    summaries = generate_image_summaries(image_names, extracted_texts, image_contents)
+
+    for image_name, summary in zip(image_names, summaries):
+        # Append to Excel worksheet
+        worksheet.append([image_name, summary])
+
+# Function to process the excel tables of an extract bundle
+def process_bundle_xlsx_files(bundle, worksheet):
+    """
+    Processes all Excel tables in an Adobe PDF Extract zip bundle, generates summaries, and appends the results
+    to an Excel worksheet. The tables are read straight from the bundle without extracting it to disk.
+
+    Args:
+        bundle (zipfile.ZipFile): The opened extract bundle.
+        worksheet (openpyxl.worksheet.worksheet.Worksheet): The worksheet to append the results to.
+
+    Returns:
+        None
+    """
+    for member in list_members(bundle, TABLE_EXTENSIONS):
+        file_name = posixpath.basename(member)
+
+        # Check if the file name starts with "file"
+        if not file_name.startswith("file"):
+            print(f"Skipping {file_name} as it does not start with 'file'.")
+            continue
+
+        print(f"Processing {file_name}...")
+        with bundle.open(member) as f:
+            df = pd.read_excel(f)
+        full_summary = summarise_xlsx_rows(df)
+        print(f"Summary for {file_name}:\n{full_summary}\n")
+
+        # Append to Excel worksheet
+        worksheet.append([file_name, full_summary])
+
+# Function to download and open the extract bundle of a folder
+def fetch_extract_bundle(service, folder_id):
+    """
+    Finds an Adobe PDF Extract zip bundle in a Google Drive folder and downloads it into memory.
+
+    Args:
+        service (googleapiclient.discovery.Resource): The authenticated Google Drive service instance.
+        folder_id (str): The ID of the Google Drive folder to search.
+
+    Returns:
+        zipfile.ZipFile or None: The opened bundle, or None if the folder has no bundle.
+    """
+    files = drive_index.children(service, folder_id, folders=False)
+    for file in files:
+        if is_extract_bundle(file):
+            print(f"Found extract bundle {file['name']}")
+            request = service.files().get_media(fileId=file['id'])
+            fh = io.BytesIO()
+            downloader = MediaIoBaseDownload(fh, request)
+            done = False
+            while done is False:
+                status, done = next_chunk(downloader)
+            return open_bundle(fh.getvalue())
+    return None
+
+
 # Main application
 def main():
     '''
@@ -653,24 +1004,47 @@ def main():
     # Replace with the folderid of the folder you are interacting with
     root_folder_id = '1r38pL-SjbkwYBoK5EF1_Ou4sxb3iw0H7'
 
+    # Drive client of the main thread
+    service = get_service()
+
+    # Bring the local Drive index up to date
+    drive_index.refresh(service)
+
     # Get the IDs for the folders within the root folder
-    query = f"'{root_folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder'"
-    main_folders = service.files().list(q=query, pageSize=100, fields="files(id, name)").execute().get('files', [])
+    main_folders = drive_index.children(service, root_folder_id, folders=True)
     print("Main Folders:", main_folders)
 
+    # Only look at the folders changed since the previous run
+    main_folders, page_token = filter_changed_folders(service, main_folders, CHANGES_TOKEN_FILE, drive_index)
+
+    # Folders with failed summaries, left without a Combined file so that the next run processes them again
+    failed_folders = []
+
     for folder in main_folders:
         # Check if folder contains an Excel file starting with "Combined"
-        query_combined = f"'{folder['id']}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
-        xlsx_files = service.files().list(q=query_combined, pageSize=10, fields="files(id, name)").execute().get('files', [])
+        xlsx_files = drive_index.children(service, folder['id'], mime_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
         
         # If any file starts with "Combined", skip the loop
         if any(file['name'].startswith('Combined') for file in xlsx_files):
             print(f"Skipping folder {folder['name']} as it contains a file starting with 'Combined'")
             continue
 
+        # Parsed structuredData.json of the folder, its element table is uploaded with the Combined file
+        data = None
+
+        # Read the Adobe PDF Extract zip bundle directly if the folder has one
+        bundle = fetch_extract_bundle(service, folder['id'])
+        if bundle:
+            excel_file = 'structuredData.xlsx'
+            data = read_structured_data(bundle)
+            generate_excel_from_data(data, excel_file)
+
+            upload_excel_to_drive(service, folder['id'], excel_file)
+            print(f"Processed and uploaded {excel_file} to folder {folder['name']}")
+            structured_df = pd.read_excel(excel_file)
+
         # Process new .json files and generate .xlsx file
-        query = f"'{folder['id']}' in parents and mimeType='application/json'"
-        files = service.files().list(q=query, pageSize=10, fields="files(id, name)").execute().get('files', [])
+        files = [] if bundle else drive_index.children(service, folder['id'], mime_type='application/json')
 
         for file in files:
             json_file = file['name']
@@ -679,9 +1053,11 @@ def main():
                 continue
 
             download_json_file(service, file['id'], json_file)
+            with open(json_file, 'r') as f:
+                data = json.load(f)
             
             excel_file = json_file.replace('.json', '.xlsx')
-            process_json_and_generate_excel(json_file, excel_file)
+            generate_excel_from_data(data, excel_file)
             
             upload_excel_to_drive(service, folder['id'], excel_file)
             print(f"Processed and uploaded {excel_file} to folder {folder['name']}")
@@ -694,7 +1070,10 @@ def main():
         worksheet.append(["File Name", "Summary"])
 
         # Process xlsx in the current folder
-        process_xlsx_files(service, folder['id'], worksheet)
+        if bundle:
+            process_bundle_xlsx_files(bundle, worksheet)
+        else:
+            process_xlsx_files(service, folder['id'], worksheet)
 
         # Save the xlsx_summary file with the folder's name
         xlsx_summary_file_name = f"xlsx_Summaries_{folder['name']}.xlsx"
@@ -704,12 +1083,6 @@ def main():
         # Upload the xlsx_summary file to the Google Drive subfolder where the images were located
         upload_excel_to_drive(service, folder['id'], xlsx_summary_file_name)
 
-        # Combine Excel files
-        xlsx_summaries_df = pd.read_excel(xlsx_summary_file_name)
-        merged_df = merge_excel_files(structured_df, xlsx_summaries_df)
-        merged_excel_file_name = f"Combined_{folder['name']}.xlsx"
-        merged_df.to_excel(merged_excel_file_name, index=False)
-
         # Create a new Excel workbook and worksheet for image summaries
         workbook = openpyxl.Workbook()
         worksheet = workbook.active
@@ -717,7 +1090,10 @@ def main():
         worksheet.append(["Image Name", "Summary"])
 
         # Process images in the current folder
-        process_images(service, folder['id'], worksheet)
+        if bundle:
+            process_bundle_images(bundle, worksheet)
+        else:
+            process_images(service, folder['id'], worksheet)
 
         # Save the Excel file with the folder's name
         image_summary_file_name = f"Image_Summaries_{folder['name']}.xlsx"
@@ -726,11 +1102,24 @@ def main():
         # Upload the Excel file to the Google Drive subfolder where the images were located
         upload_excel_to_drive(service, folder['id'], image_summary_file_name)
 
-        combined_df = pd.read_excel(merged_excel_file_name)
+        # Combine Excel files, the image summaries only fill the rows left without a summary
+        xlsx_summaries_df = pd.read_excel(xlsx_summary_file_name)
         image_summaries_df = pd.read_excel(image_summary_file_name)
-        merged_df = second_merge_excel_files(combined_df,image_summaries_df)
+        failed = int(image_summaries_df['Summary'].isin(FAILED_SUMMARIES).sum())
+        if failed:
+            # no element table, Combined file or clean-up, so that edit_json leaves the folder alone. The successful
+            # summaries are cached and only the failed ones are requested again
+            print(f"{failed} image summaries failed in folder {folder['name']}, not uploading the Combined file "
+                  f"and keeping the individual files.")
+            failed_folders.append(folder)
+            continue
+
+        merged_df = merge_summaries(structured_df, [(xlsx_summaries_df, 'File Name', 'append'),
+                                                    (image_summaries_df, 'Image Name', 'fill')])
         merged_excel_file_name = f"Combined_{folder['name']}.xlsx"
         merged_df.to_excel(merged_excel_file_name, index=False)
+        if data is not None:
+            upload_element_table(service, folder['id'], data)
         upload_excel_to_drive(service, folder['id'], merged_excel_file_name)
 
         # Delete the individual files
@@ -738,5 +1127,14 @@ def main():
         delete_file_by_name(xlsx_summary_file_name)
         delete_file_by_name(image_summary_file_name)
 
+    # The next run starts from here, with the folders whose summaries failed
+    if failed_folders:
+        print(f"Summaries failed in {len(failed_folders)} folders ({', '.join(folder['name'] for folder in failed_folders)}), "
+              f"they are retried on the next run.")
+    save_page_token(CHANGES_TOKEN_FILE, page_token, [folder['id'] for folder in failed_folders])
+
+    # Print the latency and retry metrics of the Drive API calls
+    drive_metrics.report()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
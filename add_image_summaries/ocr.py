@@ -0,0 +1,155 @@
+import io
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import pytesseract
+from PIL import Image
+
+from disk_cache import DiskCache, cache_key
+from image_preprocess import PREPROCESS_CONFIG, preprocess_image
+
+'''
+OCR of the figure images with Tesseract.
+
+Each image is first pre-processed (grayscale, downscaling, binarisation, deskew, see image_preprocess.py), then its
+orientation is detected once with Tesseract OSD (orientation and script detection) and only the
+upright image is OCRed, instead of OCRing every rotation until the text looks like English. Images are OCRed in a
+pool of worker processes, one Tesseract run per core.
+
+The extracted texts are kept in a persistent cache keyed by the SHA-256 of the image content, the Tesseract version,
+OCR_CONFIG and the pre-processing settings, so reruns and images shared between documents (logos, evidence grade tables) are not OCRed again.
+
+1. OCR_MAX_WORKERS is the maximum number of worker processes (None uses all available cores).
+
+2. OCR_CONFIG is the extra Tesseract command line configuration (e.g. '--psm 6'), changing it invalidates the cache.
+
+3. OCR_CACHE_FILE is the path of the SQLite database of the OCR cache. Delete it to OCR every image again.
+'''
+OCR_MAX_WORKERS = None
+OCR_CONFIG = ''
+OCR_CACHE_FILE = 'ocr_cache.sqlite'
+
+ocr_cache = DiskCache(OCR_CACHE_FILE, 'ocr')
+
+# worker pool shared by every folder of the run, started on first use
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    # one thread per Tesseract run, the parallelism comes from the worker processes
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
+def _get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+        return _executor
+
+
+# Function to detect the rotation of an image
+def detect_rotation(img):
+    """
+    Detects the clockwise rotation that makes the text of an image upright, with Tesseract OSD.
+
+    Args:
+        img (PIL.Image.Image): The image.
+
+    Returns:
+        int: The rotation in degrees (0, 90, 180 or 270), 0 if it cannot be detected (e.g. too little text).
+    """
+    try:
+        osd = pytesseract.image_to_osd(img, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractError:
+        return 0
+    return int(osd.get('rotate', 0)) % 360
+
+
+# Function to extract text from an image with tesseract
+def ocr_image(source, preprocess_config=None):
+    """
+    Extracts the text of an image with Tesseract OCR, after pre-processing it and turning it upright.
+
+    Args:
+        source (str or bytes): The path of the image file, or its content.
+        preprocess_config (dict, optional): The pre-processing settings. Defaults to None (PREPROCESS_CONFIG).
+
+    Returns:
+        str: The extracted text.
+    """
+    img = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    img = preprocess_image(img, preprocess_config)
+    rotation = detect_rotation(img)
+    if rotation:
+        # PIL rotates counter-clockwise
+        img = img.rotate(-rotation, expand=True)
+    return pytesseract.image_to_string(img, config=OCR_CONFIG)
+
+
+# Function to get the version of the installed tesseract, once per process
+@lru_cache(maxsize=None)
+def tesseract_version():
+    return str(pytesseract.get_tesseract_version())
+
+
+# Function to build the OCR cache key of an image
+def ocr_cache_key(content):
+    """
+    Builds the OCR cache key of an image from everything its extracted text depends on.
+
+    Args:
+        content (bytes): The content of the image file.
+
+    Returns:
+        str: The cache key.
+    """
+    return cache_key(content, tesseract_version(), OCR_CONFIG, json.dumps(PREPROCESS_CONFIG, sort_keys=True))
+
+
+# Function to extract the text of several images, in parallel
+def ocr_images(sources, max_workers=OCR_MAX_WORKERS):
+    """
+    Extracts the text of each image with ocr_image, across a pool of worker processes when there is more than
+    one image to OCR. Cached texts are reused, new ones are added to the cache. The results are returned in the
+    order of the images.
+
+    Args:
+        sources (list): The path or content (bytes) of each image.
+        max_workers (int): The maximum number of worker processes (default is OCR_MAX_WORKERS).
+
+    Returns:
+        list: The extracted text of each image.
+    """
+    contents = []
+    for source in sources:
+        if isinstance(source, (bytes, bytearray)):
+            contents.append(bytes(source))
+        else:
+            with open(source, 'rb') as f:
+                contents.append(f.read())
+    keys = [ocr_cache_key(content) for content in contents]
+    texts = ocr_cache.get_many(keys)
+
+    cached = sum(key in texts for key in keys)
+    if cached:
+        print(f"{cached} of {len(keys)} images found in the OCR cache.")
+
+    # OCR each missing image once, even if it appears several times
+    missing = [key for key in dict.fromkeys(keys) if key not in texts]
+    missing_contents = [contents[keys.index(key)] for key in missing]
+
+    workers = min(max_workers or os.cpu_count() or 1, len(missing))
+    if workers < 2:
+        results = map(ocr_image, missing_contents)
+    else:
+        print(f"OCR of {len(missing)} images across {workers} worker processes.")
+        results = _get_executor(max_workers).map(ocr_image, missing_contents)
+    for key, text in zip(missing, results):
+        ocr_cache.set(key, text)
+        texts[key] = text
+    return [texts[key] for key in keys]
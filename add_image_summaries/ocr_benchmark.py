@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+
+from extract_bundle import IMAGE_EXTENSIONS
+from ocr import ocr_image
+from vocabulary import gibberish_flags, valid_word_counts
+
+'''
+Requires user specific inputs
+
+Benchmark of the OCR pre-processing settings on a local set of figure images. Every variant is OCRed without the
+OCR cache, one image at a time, and the OCR time is reported with two text quality measures: the proportion of
+valid English words (see vocabulary.py) and the number of images whose text is flagged as gibberish.
+
+Usage (from the add_image_summaries folder):
+    python ocr_benchmark.py                       benchmark every variant
+    python ocr_benchmark.py --variant binarized   only run one variant
+
+1. BENCHMARK_DIR is the folder holding the figure images (e.g. the figures folder of a few extract bundles).
+
+2. VARIANTS are the pre-processing settings to compare, by name. Each one overrides PREPROCESS_CONFIG of
+   image_preprocess.py.
+'''
+BENCHMARK_DIR = 'ocr_benchmark_images'
+VARIANTS = {
+    'none': {'grayscale': False, 'target_dpi': None, 'max_side': None, 'binarize': False, 'deskew': False},
+    'grayscale': {'grayscale': True, 'target_dpi': None, 'max_side': None, 'binarize': False, 'deskew': False},
+    'downscaled': {'grayscale': True, 'target_dpi': 300, 'binarize': False, 'deskew': False},
+    'binarized': {'grayscale': True, 'target_dpi': 300, 'binarize': True, 'deskew': False},
+    'full': {'grayscale': True, 'target_dpi': 300, 'binarize': True, 'deskew': True},
+}
+
+
+# Function to run the benchmark
+def main(args):
+    variants = [args[args.index('--variant') + 1]] if '--variant' in args else list(VARIANTS)
+
+    images = sorted(name for name in os.listdir(BENCHMARK_DIR) if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not images:
+        print(f"No images found in {BENCHMARK_DIR}.")
+        return 1
+    paths = [os.path.join(BENCHMARK_DIR, name) for name in images]
+
+    print(f"{'variant':<14}{'seconds':>10}{'s/image':>10}{'words':>10}{'valid':>9}{'gibberish':>11}")
+    for variant in variants:
+        start = time.perf_counter()
+        texts = [ocr_image(path, VARIANTS[variant]) for path in paths]
+        seconds = time.perf_counter() - start
+
+        valid_counts, totals = valid_word_counts(texts)
+        valid_ratio = valid_counts.sum() / totals.sum() if totals.sum() else 0.0
+        gibberish = sum(gibberish_flags(texts))
+        print(f"{variant:<14}{seconds:>10.2f}{seconds / len(paths):>10.3f}{int(totals.sum()):>10}"
+              f"{valid_ratio:>9.1%}{gibberish:>6} / {len(paths)}")
+    return 0
+
+
+# Execute the main function
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
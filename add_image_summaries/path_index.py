@@ -0,0 +1,64 @@
+from bisect import bisect_left, bisect_right
+
+'''
+Sorted index of element paths (e.g. //Document/Sect[2]/Figure/P[3]), used to find every element below a path
+without scanning all the elements.
+
+The paths are sorted once, the elements below a path P are then the ones whose path is P itself or starts with
+P + '/', and each of these sets is a contiguous range of the sorted paths found with two binary searches. Building
+the index is O(E log E) for E elements and each lookup O(log E + k) for k results.
+'''
+
+# '0' is the character right after '/', so every path starting with prefix + '/' sorts before prefix + '0'
+_AFTER_SEPARATOR = chr(ord('/') + 1)
+
+
+class PathIndex:
+    """
+    Index of the paths of a list of elements, giving the positions of the elements at or below a path in
+    document order.
+
+    Args:
+        paths (list): The path of each element, in document order.
+    """
+
+    def __init__(self, paths):
+        order = sorted(range(len(paths)), key=paths.__getitem__)
+        self.positions = order
+        self.sorted_paths = [paths[position] for position in order]
+
+    def _range(self, low, high):
+        # positions of the sorted paths in [low, high), in sorted order
+        start = bisect_left(self.sorted_paths, low)
+        end = bisect_left(self.sorted_paths, high, lo=start)
+        return self.positions[start:end]
+
+    def equal(self, path):
+        """
+        Finds the elements whose path is exactly the given path.
+
+        Args:
+            path (str): The path to look up.
+
+        Returns:
+            list: The positions of the elements, in document order.
+        """
+        start = bisect_left(self.sorted_paths, path)
+        end = bisect_right(self.sorted_paths, path, lo=start)
+        return sorted(self.positions[start:end])
+
+    def descendants(self, path, include_self=True):
+        """
+        Finds the elements below the given path, i.e. whose path starts with path + '/'.
+
+        Args:
+            path (str): The path of the parent element, without a trailing '/'.
+            include_self (bool): Whether to include the elements whose path is the given path (default is True).
+
+        Returns:
+            list: The positions of the elements, in document order.
+        """
+        positions = self._range(path + '/', path + _AFTER_SEPARATOR)
+        if include_self:
+            positions = positions + self.equal(path)
+        return sorted(positions)
@@ -0,0 +1,55 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to keep API calls within a quota.
+
+    Tokens are added continuously at `rate` tokens per second up to `capacity`. Every call
+    consumes tokens before it is sent, so bursts are allowed up to `capacity` and the long
+    run average never exceeds `rate`. One bucket should be shared by every thread that
+    calls the same API so that concurrent workers can push close to the quota without
+    exceeding it.
+
+    Args:
+        rate (float): The number of tokens added to the bucket per second.
+        capacity (float): The maximum number of tokens the bucket can hold (burst size).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until the requested number of tokens is available and consumes them.
+
+        Requests larger than the bucket capacity are clamped to the capacity so that they
+        wait for a full bucket instead of blocking forever.
+
+        Args:
+            tokens (float): The number of tokens to consume (default is 1).
+
+        Returns:
+            float: The number of seconds spent waiting for tokens.
+        """
+        tokens = min(float(tokens), self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,65 @@
+import json
+import re
+import threading
+import time
+
+'''
+Offline stand-in for the gemini model, used to benchmark the summary paths without an API key or quota.
+
+Every summary request goes through a client with the interface of google.generativeai.GenerativeModel:
+generate_content(contents, generation_config=None), where contents is a prompt string or a list of parts (strings
+and {'mime_type': ..., 'data': bytes} images), returning a response with a `text` attribute. StubModel implements
+that interface, answers batched requests with the JSON object they ask for, and counts the requests and the parts it
+receives. Pass it to image_summaries.use_model to run the pipeline against it.
+'''
+
+
+class StubResponse:
+    """
+    Response of a StubModel request.
+
+    Args:
+        text (str): The text of the response.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """
+    Thread-safe stub of the gemini model with a simulated latency.
+
+    Args:
+        latency (float): The fixed latency of a request, in seconds (default is 0.0).
+        seconds_per_kilochar (float): The additional latency per 1,000 characters of prompt (default is 0.0).
+        image_latency (float): The additional latency per image part (default is 0.0).
+    """
+
+    def __init__(self, latency=0.0, seconds_per_kilochar=0.0, image_latency=0.0):
+        self.latency = latency
+        self.seconds_per_kilochar = seconds_per_kilochar
+        self.image_latency = image_latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_chars = 0
+        self.images = 0
+
+    def generate_content(self, contents, generation_config=None):
+        parts = contents if isinstance(contents, list) else [contents]
+        texts = [part for part in parts if isinstance(part, str)]
+        images = len(parts) - len(texts)
+        prompt = ''.join(texts)
+        with self.lock:
+            self.requests += 1
+            self.prompt_chars += len(prompt)
+            self.images += images
+        time.sleep(self.latency + len(prompt) / 1000 * self.seconds_per_kilochar + images * self.image_latency)
+
+        if generation_config and generation_config.get('response_mime_type') == 'application/json':
+            # batched request, one summary per image name of the prompt
+            image_names = re.findall(r'^Image: (.+)$', prompt, re.MULTILINE)
+            return StubResponse(json.dumps({name: f"Stub summary of {name}." for name in image_names}))
+        if images:
+            return StubResponse(f"Stub summary of {images} image(s).")
+        return StubResponse(f"Stub summary of {len(prompt)} characters of prompt.")
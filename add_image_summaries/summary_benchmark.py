@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+
+import image_summaries
+import summary_dispatcher
+from disk_cache import DiskCache
+from extract_bundle import IMAGE_EXTENSIONS
+from rate_limit import TokenBucket
+from stub_model import StubModel
+
+'''
+Requires user specific inputs
+
+Offline benchmark of the image summary paths (text only, batched, direct image, heuristic) against StubModel, so
+that no API key or quota is needed. The images of BENCHMARK_DIR are OCRed once (through the OCR cache), then every
+mode summarises all of them with an empty summary cache and the quota limits lifted, and the number of requests,
+the prompt size, the images sent, the wall time and the number of images summarised directly are reported.
+
+Usage (from the add_image_summaries folder):
+    python summary_benchmark.py                    benchmark every mode
+    python summary_benchmark.py --mode heuristic   only run one mode
+
+1. BENCHMARK_DIR is the folder holding the figure images.
+
+2. STUB_LATENCY, STUB_SECONDS_PER_KILOCHAR and STUB_IMAGE_LATENCY are the simulated latencies of the stub model, in
+   seconds per request, per 1,000 prompt characters and per image.
+
+3. MODES are the settings of image_summaries compared, by name.
+'''
+BENCHMARK_DIR = 'summary_benchmark_images'
+STUB_LATENCY = 1.0
+STUB_SECONDS_PER_KILOCHAR = 0.05
+STUB_IMAGE_LATENCY = 0.5
+MODES = {
+    'text': {'BATCH_MAX_WORDS': 0, 'DIRECT_SUMMARY': False},
+    'batched': {'BATCH_MAX_WORDS': 60, 'DIRECT_SUMMARY': False},
+    'direct': {'BATCH_MAX_WORDS': 0, 'DIRECT_SUMMARY': True, 'DIRECT_MAX_VALID_RATIO': float('inf')},
+    'heuristic': {'BATCH_MAX_WORDS': 60, 'DIRECT_SUMMARY': True},
+}
+
+
+# Function to run the benchmark
+def main(args):
+    modes = [args[args.index('--mode') + 1]] if '--mode' in args else list(MODES)
+
+    image_names = sorted(name for name in os.listdir(BENCHMARK_DIR) if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not image_names:
+        print(f"No images found in {BENCHMARK_DIR}.")
+        return 1
+    image_sources = [os.path.join(BENCHMARK_DIR, name) for name in image_names]
+    extracted_texts = image_summaries.ocr_images(image_sources)
+
+    # the stub has no quota
+    summary_dispatcher.request_bucket = TokenBucket(1e9, 1e9)
+    summary_dispatcher.token_bucket = TokenBucket(1e12, 1e12)
+
+    defaults = {name: getattr(image_summaries, name) for mode in MODES.values() for name in mode}
+    results = []
+    for mode in modes:
+        settings = {**defaults, **MODES[mode]}
+        for name, value in settings.items():
+            setattr(image_summaries, name, value)
+        stub = StubModel(STUB_LATENCY, STUB_SECONDS_PER_KILOCHAR, STUB_IMAGE_LATENCY)
+        image_summaries.use_model(stub)
+        image_summaries.summary_cache = DiskCache(':memory:', 'summaries')
+
+        direct = sum(image_summaries.direct_summary_flags(extracted_texts, image_sources)) if settings['DIRECT_SUMMARY'] else 0
+        start = time.perf_counter()
+        image_summaries.generate_image_summaries(image_names, extracted_texts, image_sources)
+        results.append((mode, stub.requests, stub.prompt_chars, stub.images, direct, time.perf_counter() - start))
+
+    image_summaries.use_model(None)
+    print(f"{len(image_names)} images")
+    print(f"{'mode':<12}{'requests':>10}{'prompt chars':>14}{'images':>8}{'direct':>8}{'seconds':>10}")
+    for mode, requests, prompt_chars, images, direct, seconds in results:
+        print(f"{mode:<12}{requests:>10}{prompt_chars:>14,}{images:>8}{direct:>8}{seconds:>10.2f}")
+    return 0
+
+
+# Execute the main function
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
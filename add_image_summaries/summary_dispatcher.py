@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limit import TokenBucket
+
+'''
+Concurrent dispatcher for the Gemini summary requests.
+
+Most of the time of a summary is spent waiting on Gemini, so the summaries of a folder are requested from a bounded
+pool of threads. Every request first takes one token from a requests-per-minute bucket and its estimated size from a
+tokens-per-minute bucket (see rate_limit.py), both shared by every thread of the process, so the workers can use the
+quota without exceeding it. The results are returned in the order of the inputs, so the worksheets are written in
+the same order as before.
+
+Requires user specific inputs
+
+1. GEMINI_REQUESTS_PER_MINUTE and GEMINI_TOKENS_PER_MINUTE are the quotas of the Gemini model for the API key,
+   divided by the number of runs executing at the same time.
+
+2. GEMINI_BURST_SECONDS is the number of seconds of quota that may be used back to back.
+
+3. SUMMARY_MAX_WORKERS is the maximum number of summary requests in flight.
+
+4. CHARS_PER_TOKEN, IMAGE_TOKENS and SUMMARY_OUTPUT_TOKENS are used to estimate the tokens of a request before it
+   is sent: the prompt length divided by CHARS_PER_TOKEN, IMAGE_TOKENS per image, plus the expected length of the
+   summary.
+'''
+GEMINI_REQUESTS_PER_MINUTE = 15
+GEMINI_TOKENS_PER_MINUTE = 1000000
+GEMINI_BURST_SECONDS = 10
+SUMMARY_MAX_WORKERS = 8
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+SUMMARY_OUTPUT_TOKENS = 1000
+
+# token buckets shared by every Gemini request made from this process
+request_bucket = TokenBucket(GEMINI_REQUESTS_PER_MINUTE / 60,
+                             max(1, GEMINI_REQUESTS_PER_MINUTE / 60 * GEMINI_BURST_SECONDS))
+token_bucket = TokenBucket(GEMINI_TOKENS_PER_MINUTE / 60, GEMINI_TOKENS_PER_MINUTE / 60 * GEMINI_BURST_SECONDS)
+
+
+# Function to estimate the number of tokens of a request
+def estimate_tokens(prompt):
+    """
+    Estimates the number of tokens a request will count against the tokens-per-minute quota.
+
+    Args:
+        prompt (str or list): The prompt of the request, or its parts (strings and images).
+
+    Returns:
+        int: The estimated number of input and output tokens.
+    """
+    parts = prompt if isinstance(prompt, list) else [prompt]
+    tokens = sum(len(part) // CHARS_PER_TOKEN + 1 if isinstance(part, str) else IMAGE_TOKENS for part in parts)
+    return tokens + SUMMARY_OUTPUT_TOKENS
+
+
+# Function to wait for the rate limits before a request
+def acquire_quota(prompt):
+    """
+    Blocks until a request with this prompt fits in the requests-per-minute and tokens-per-minute quotas, and
+    consumes its share of them.
+
+    Args:
+        prompt (str or list): The prompt of the request, or its parts (strings and images).
+
+    Returns:
+        float: The number of seconds spent waiting.
+    """
+    return request_bucket.acquire(1) + token_bucket.acquire(estimate_tokens(prompt))
+
+
+# Function to run summary requests concurrently
+def dispatch(summarise_func, inputs, max_workers=SUMMARY_MAX_WORKERS):
+    """
+    Calls summarise_func on every input from a pool of threads. summarise_func is expected to call acquire_quota
+    before each request it sends.
+
+    Args:
+        summarise_func (callable): The function generating the summary of one input.
+        inputs (list): The inputs to summarise (e.g. the extracted texts).
+        max_workers (int): The maximum number of requests in flight (default is SUMMARY_MAX_WORKERS).
+
+    Returns:
+        list: The summary of each input, in the order of the inputs.
+    """
+    inputs = list(inputs)
+    if not inputs:
+        return []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(inputs))) as executor:
+        summaries = list(executor.map(summarise_func, inputs))
+    print(f"Generated {len(summaries)} summaries in {time.perf_counter() - start:.1f}s.")
+    return summaries
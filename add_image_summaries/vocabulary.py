@@ -0,0 +1,126 @@
+import hashlib
+import os
+from functools import lru_cache
+
+import numpy as np
+
+'''
+English vocabulary used to tell OCR text from gibberish.
+
+The NLTK words corpus is compiled once into a sorted array of 64-bit word hashes saved as a .npy file. Later runs
+memory-map that file on first use instead of downloading the corpus and building a Python set of its 236k words, and
+looking up all the words of many texts is one vectorised binary search (numpy searchsorted). With 64-bit hashes the
+chance of a word wrongly counted as valid is negligible (about 1 in 10^13 per word).
+
+Requires user specific inputs
+
+VOCAB_FILE is the path of the compiled vocabulary. Delete it to compile it again from the NLTK corpus.
+'''
+VOCAB_FILE = 'english_vocab.npy'
+
+# only words longer than this are scored, shorter ones are mostly valid whatever the OCR quality
+MIN_WORD_LENGTH = 2
+
+
+# Function to hash words into the 64-bit keys of the vocabulary
+def hash_words(words):
+    """
+    Hashes words into unsigned 64-bit integers (the first 8 bytes of their BLAKE2b digest).
+
+    Args:
+        words (list): The words to hash.
+
+    Returns:
+        np.ndarray: The uint64 hash of each word.
+    """
+    digests = b''.join(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest() for word in words)
+    return np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+
+
+# Function to compile the vocabulary file
+def compile_vocabulary(words, path=VOCAB_FILE):
+    """
+    Compiles a list of words into a sorted array of unique word hashes and saves it as a .npy file.
+
+    Args:
+        words (list): The words of the vocabulary, matched case-sensitively.
+        path (str): The path of the compiled vocabulary (default is VOCAB_FILE).
+
+    Returns:
+        None
+    """
+    np.save(path, np.unique(hash_words(list(words))))
+
+
+# Function to load the compiled vocabulary, once per process
+@lru_cache(maxsize=None)
+def load_vocabulary(path=VOCAB_FILE):
+    """
+    Memory-maps the compiled vocabulary, compiling it from the NLTK words corpus first if the file does not exist.
+    The corpus is only downloaded when it is not installed yet.
+
+    Args:
+        path (str): The path of the compiled vocabulary (default is VOCAB_FILE).
+
+    Returns:
+        np.ndarray: The sorted uint64 hashes of the words.
+    """
+    if not os.path.exists(path):
+        import nltk
+        from nltk.corpus import words
+        try:
+            vocabulary = words.words()
+        except LookupError:
+            nltk.download('words')
+            vocabulary = words.words()
+        compile_vocabulary(vocabulary, path)
+        print(f"Compiled {len(vocabulary)} words into {path}.")
+    return np.load(path, mmap_mode='r')
+
+
+# Function to count the valid English words of several texts
+def valid_word_counts(texts, path=VOCAB_FILE):
+    """
+    Counts, for each text, the words longer than MIN_WORD_LENGTH and how many of them are English words once
+    lowercased. All the words of all the texts are looked up in one vectorised search.
+
+    Args:
+        texts (list): The texts to score.
+        path (str): The path of the compiled vocabulary (default is VOCAB_FILE).
+
+    Returns:
+        tuple: Two np.ndarray with the number of valid words and the number of words of each text.
+    """
+    text_ids = []
+    words_in_texts = []
+    for text_id, text in enumerate(texts):
+        words_in_text = [word.lower() for word in text.split() if len(word) > MIN_WORD_LENGTH]
+        words_in_texts.extend(words_in_text)
+        text_ids.extend([text_id] * len(words_in_text))
+    text_ids = np.array(text_ids, dtype=np.int64)
+
+    vocabulary = load_vocabulary(path)
+    hashes = hash_words(words_in_texts)
+    positions = np.minimum(np.searchsorted(vocabulary, hashes), max(len(vocabulary) - 1, 0))
+    valid = vocabulary[positions] == hashes if len(vocabulary) else np.zeros(len(hashes), dtype=bool)
+
+    totals = np.bincount(text_ids, minlength=len(texts))
+    valid_counts = np.bincount(text_ids[valid], minlength=len(texts))
+    return valid_counts, totals
+
+
+# Function to detect gibberish in several texts at once
+def gibberish_flags(texts, threshold=0.9, path=VOCAB_FILE):
+    """
+    Flags the texts whose proportion of valid English words is below the threshold, see valid_word_counts.
+
+    Args:
+        texts (list): The texts to analyse.
+        threshold (float): The threshold for valid words proportion (default is 0.9).
+        path (str): The path of the compiled vocabulary (default is VOCAB_FILE).
+
+    Returns:
+        list: True for each text considered gibberish, False otherwise.
+    """
+    valid_counts, totals = valid_word_counts(texts, path)
+    return (valid_counts < totals * threshold).tolist()
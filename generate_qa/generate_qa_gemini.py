@@ -6,6 +6,7 @@ DOC_TITLE = 'When to order MRI for low back pain'
 DATAPATH = f'../generate_qa/'
 INPUTFILE = 'When to order MRI for low back pain.xlsx'
 OUTPUTFILE = 'When to order MRI for low back pain_v2.csv'
+CHANGESFILE = None  # e.g. 'Chunk_changes.pkl' from the chunker to only generate QA for the added / modified chunks
 TEMPERATURE = 0.0
 
 specialchar_replacements = {'\u2265': ' more than or equals to ', '\u2264': ' less than or equals to ',
@@ -13,12 +14,7 @@ specialchar_replacements = {'\u2265': ' more than or equals to ', '\u2264': ' le
 
 
 """# Imports"""
-from ragas_metrics_0_1_5 import _faithfulness_custom
-from ragas_metrics_0_1_5 import _answer_relevance_custom
-from ragas_metrics_0_1_5 import _context_precision_custom
-from ragas_metrics_0_1_5 import _context_recall_custom
-from ragas_metrics_0_1_5 import _answer_similarity_custom
-from ragas_metrics_0_1_5 import _answer_correctness_custom
+from phrase_matcher import PhraseMatcher
 import os
 import pandas as pd
 import numpy as np
@@ -27,25 +23,31 @@ import pickle
 import re
 import logging
 from datetime import datetime
-import google.generativeai as genai
-from datasets import Dataset
+from functools import lru_cache
 
 
-# Authenticate and build the gemini API client
+# Authenticate and build the gemini API client, built lazily once per process by get_model
 '''
 Requires user specific inputs.
 
 Replace GEMINI_API_KEY with your gemini api key obtained.
 '''
 GEMINI_API_KEY = ''
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-flash')
-
-# Setup logging
-logging.basicConfig(filename=f'{LOGSFOLDER}/app_{datetime.now().strftime("%Y%m%d")}.log', 
-                    filemode='w', format='%(name)s - %(levelname)s - %(message)s')
 
 # Functions
+@lru_cache(maxsize=None)
+def get_model():
+    """
+    Builds the Gemini model client on first use and caches it for the rest of the process.
+
+    Returns:
+        genai.GenerativeModel: The Gemini model client.
+    """
+    # imported here so that importing this script stays cheap for worker processes and tools
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel('gemini-1.5-flash')
+
 def generate_qa(doc_chunk, title=DOC_TITLE):
     """
     Generates at least twenty unique question-answer pairs based on the given document chunk using a template. 
@@ -107,7 +109,7 @@ def generate_qa(doc_chunk, title=DOC_TITLE):
 
     start = time.time()
     try:
-        response = model.generate_content(template_protocol)
+        response = get_model().generate_content(template_protocol)
         if hasattr(response, 'text') and response.text:
             end = time.time()
             print(f'\nInference Time: {round(end - start, 3)}s')
@@ -187,7 +189,7 @@ def get_context(question, answer, source):
     """
     try:
         # Call the Gemini model to generate content
-        response = model.generate_content(template_context)
+        response = get_model().generate_content(template_context)
 
         # Check if the response contains valid text
         if hasattr(response, 'text') and response.text:
@@ -201,135 +203,169 @@ def get_context(question, answer, source):
         print(f"Error generating context: {e}")
         return ""
 
-# Read the .xlsx file into a DataFrame
-"""
-Reads an Excel file containing clinical protocol data, processes it, and generates a list of question-answer pairs based on the content.
-The questions are extracted using the `generate_qa` function, and the results are saved in a temporary CSV file for evaluation.
-
-Requires user specific inputs.
-
-Edit the sheet_name accordingly to the one that contains the reviewed text chunks
-"""
-df = pd.read_excel(DATAPATH + INPUTFILE, sheet_name='Copy of Sheet1')
-
-# Save the DataFrame as a pickle file
-with open('Final_chunks.pkl', 'wb') as f:
-    pickle.dump(df, f)
+# Function to generate and evaluate the QA pairs of the document
+def main():
+    """
+    Reads an Excel file containing clinical protocol data, processes it, and generates a list of question-answer pairs based on the content.
+    The questions are extracted using the `generate_qa` function, and the results are saved in a temporary CSV file for evaluation.
 
-"""# Read Data"""
-with open('Final_chunks.pkl', 'rb') as fp:
-    data = pickle.load(fp)
+    Requires user specific inputs.
 
-df = pd.DataFrame(data)
-df.head()
+    Edit the sheet_name accordingly to the one that contains the reviewed text chunks
+    """
+    # Setup logging
+    logging.basicConfig(filename=f'{LOGSFOLDER}/app_{datetime.now().strftime("%Y%m%d")}.log', 
+                        filemode='w', format='%(name)s - %(levelname)s - %(message)s')
+
+    # Read the .xlsx file into a DataFrame
+    df = pd.read_excel(DATAPATH + INPUTFILE, sheet_name='Copy of Sheet1')
+
+    # Save the DataFrame as a pickle file
+    with open('Final_chunks.pkl', 'wb') as f:
+        pickle.dump(df, f)
+
+    """# Read Data"""
+    with open('Final_chunks.pkl', 'rb') as fp:
+        data = pickle.load(fp)
+
+    df = pd.DataFrame(data)
+    df.head()
+
+    # remove those without section name (between title and first section header)
+    df = df[~df['section_name'].isna()]
+
+    # identify each chunk by its section name, the number of earlier sections with that name and its position in the
+    # section, like the chunk change list of the chunker. The chunks of a section share the same text_id list.
+    section_start = (df['section_name'] != df['section_name'].shift()) | (df['text_id'].astype(str) != df['text_id'].astype(str).shift())
+    section_run = section_start.cumsum()
+    df['section_occurrence'] = section_run.groupby(df['section_name']).rank(method='dense').astype(int) - 1
+    df['chunk_index'] = df.groupby(section_run).cumcount()
+
+    # Replace special characters
+    df['text_chunk'] = df['text_chunk'].replace(specialchar_replacements, regex=True)
+    df[df['text_chunk'].str.len()<100]
+
+    # keep only those chunks with at least 100 characters
+    filtered_df = df[df['text_chunk'].str.len() > 100]
+    filtered_df
+
+    # keep only the chunks added or modified since the previous chunking run
+    if CHANGESFILE:
+        with open(DATAPATH + CHANGESFILE, 'rb') as fp:
+            changes = pickle.load(fp)
+        changed_keys = {(change['section_name'], change['section_occurrence'], change['chunk_index'])
+                        for change in changes if change['change'] != 'removed'}
+        chunk_keys = pd.Series(list(zip(filtered_df['section_name'], filtered_df['section_occurrence'], filtered_df['chunk_index'])),
+                               index=filtered_df.index)
+        filtered_df = filtered_df[chunk_keys.isin(changed_keys)]
+        print(f"{len(filtered_df)} text chunks changed since the previous chunking run.")
+    else:
+        '''
+        Requires user specific inputs.
 
-# remove those without section name (between title and first section header)
-df = df[~df['section_name'].isna()]
+        Edit the range for the filtered_df accordingly. Currently it only generates QA for 1 row of text chunk.
+        '''
+        filtered_df = filtered_df.iloc[8:10]
 
-# Replace special characters
-df['text_chunk'] = df['text_chunk'].replace(specialchar_replacements, regex=True)
-df[df['text_chunk'].str.len()<100]
+    # Generate QA pairs
+    start = time.time()
+    qa_dataset = []
+    response_all = []
 
-# keep only those chunks with at least 100 characters
-filtered_df = df[df['text_chunk'].str.len() > 100]
-filtered_df
+    for _, row in filtered_df.iterrows():
+        time.sleep(30)
+        response_text, pages, section = generate_qa(row)
+        print(response_text)
 
-'''
-Requires user specific inputs.
+        response_all.append(response_text)
 
-Edit the range for the filtered_df accordingly. Currently it only generates QA for 1 row of text chunk.
-'''
-filtered_df = filtered_df.iloc[8:10]
+        qa_list = extract_qa(response_text)
+        print(len(qa_list))
 
-# Generate QA pairs
-start = time.time()
-qa_dataset = []
-response_all = []
+        doc_chunk = row['text_chunk']
 
-for _, row in filtered_df.iterrows():
-    time.sleep(30)
-    response_text, pages, section = generate_qa(row)
-    print(response_text)
+        for qa_pair in qa_list:
+            question = qa_pair[0]
+            answer = qa_pair[1]
+            reference = f"For more information, refer to clinical protocol {DOC_TITLE}, Section {section}, Pages {pages}"
 
-    response_all.append(response_text)
 
-    qa_list = extract_qa(response_text)
-    print(len(qa_list))
+            qa_dataset.append({'question': question,
+                               'answer': answer,
+                               'full_text': response_text,
+                               'reference': reference,
+                               'section': section,
+                               'pages': pages,
+                               'doc_chunk': doc_chunk,
+                               })
 
-    doc_chunk = row['text_chunk']
 
-    for qa_pair in qa_list:
-        question = qa_pair[0]
-        answer = qa_pair[1]
-        reference = f"For more information, refer to clinical protocol {DOC_TITLE}, Section {section}, Pages {pages}"
+        tmp = pd.DataFrame(qa_dataset)
+        tmp.to_csv("QA_tmp.csv", index=False)
 
+    end = time.time()
+    print(f'\nTotal Time: {round(end - start, 3)}s')
 
-        qa_dataset.append({'question': question,
-                           'answer': answer,
-                           'full_text': response_text,
-                           'reference': reference,
-                           'section': section,
-                           'pages': pages,
-                           'doc_chunk': doc_chunk,
-                           })
+    model_output = pd.DataFrame(qa_dataset)
+    model_output['Title'] = DOC_TITLE
 
+    """# Checks & Eval"""
 
-    tmp = pd.DataFrame(qa_dataset)
-    tmp.to_csv("QA_tmp.csv", index=False)
+    keywords = ['the source', 'this information', 'these guidelines', 'this source']
 
-end = time.time()
-print(f'\nTotal Time: {round(end - start, 3)}s')
+    # Manual check for keywords, ignoring case and whitespace differences
+    keyword_matcher = PhraseMatcher({'source': keywords}, casefold=True)
+    model_output['Flag_Source'] = np.where(model_output['question'].map(lambda question: 'source' in keyword_matcher.contains(question)),
+                                    1, 0)
 
-model_output = pd.DataFrame(qa_dataset)
-model_output['Title'] = DOC_TITLE
+    model_output.head()
 
-"""# Checks & Eval"""
+    model_output[model_output['Flag_Source']==1]
 
-keywords = ['the source', 'this information', 'these guidelines', 'this source']
+    """### Run Faithfulness"""
+    # imported here so that importing this script does not need ragas and datasets, which are slow to import
+    from datasets import Dataset
+    from ragas_metrics_0_1_5 import _faithfulness_custom
 
-# Manual check for keywords
-model_output['Flag_Source'] = np.where(model_output['question'].str.lower().str.contains('|'.join(keywords)),
-                                1, 0)
+    # format data
+    model_output = model_output.rename(columns={"doc_chunk":"contexts"})
+    model_output = model_output[~model_output['contexts'].isna()]
+    model_output['contexts'] = model_output['contexts'].replace({'"': '\''}, regex=True)
+    model_output = Dataset.from_pandas(model_output)
+    print(model_output.shape)
+    model_output[0]
 
-model_output.head()
+    eval_output = model_output.to_pandas()
+    eval_output.head()
 
-model_output[model_output['Flag_Source']==1]
+    # run faithfulness
+    start_point = 0
+    eval_df = pd.DataFrame()
 
-"""### Run Faithfulness"""
-# format data
-model_output = model_output.rename(columns={"doc_chunk":"contexts"})
-model_output = model_output[~model_output['contexts'].isna()]
-model_output['contexts'] = model_output['contexts'].replace({'"': '\''}, regex=True)
-model_output = Dataset.from_pandas(model_output)
-print(model_output.shape)
-model_output[0]
+    for i in range(start_point, len(model_output)):
+        if model_output['Flag_Source'] == 1:
+            faithfulness_result = [np.nan, np.nan]
 
-eval_output = model_output.to_pandas()
-eval_output.head()
+        else:
+        # faithfulness
+            print(f"model_output: {model_output[i]}")
+            faithfulness_result = _faithfulness_custom.faithfulness(model_output[i], model=get_model())
+            print(f"faithfulness_result: {faithfulness_result}")
 
-# run faithfulness
-start_point = 0
-eval_df = pd.DataFrame()
 
-for i in range(start_point, len(model_output)):
-    if model_output['Flag_Source'] == 1:
-        faithfulness_result = [np.nan, np.nan]
-    
-    else:
-    # faithfulness
-        print(f"model_output: {model_output[i]}")
-        faithfulness_result = _faithfulness_custom.faithfulness(model_output[i], model=model)
-        print(f"faithfulness_result: {faithfulness_result}")
+        tmp = pd.DataFrame({
+                            'faithfulness': faithfulness_result[0],
+                            'faithfulness_reasons': str(faithfulness_result[1]),
 
+                            }, index=[0])
+        eval_df = pd.concat([eval_df, tmp], ignore_index=True)
+        output = pd.concat([eval_output[start_point:i+1], eval_df], axis=1)
+        output.to_csv("eval_tmp.csv", index=False)
 
-    tmp = pd.DataFrame({
-                        'faithfulness': faithfulness_result[0],
-                        'faithfulness_reasons': str(faithfulness_result[1]),
+    output = pd.concat([eval_output[start_point:i+1].reset_index(drop=True), eval_df.reset_index(drop=True)], axis=1)
+    output.to_csv(DATAPATH+OUTPUTFILE, index=False)
 
-                        }, index=[0])
-    eval_df = pd.concat([eval_df, tmp], ignore_index=True)
-    output = pd.concat([eval_output[start_point:i+1], eval_df], axis=1)
-    output.to_csv("eval_tmp.csv", index=False)
 
-output = pd.concat([eval_output[start_point:i+1].reset_index(drop=True), eval_df.reset_index(drop=True)], axis=1)
-output.to_csv(DATAPATH+OUTPUTFILE, index=False)
\ No newline at end of file
+# Execute the main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+import hashlib
+import sqlite3
+import threading
+
+from googleapiclient.errors import HttpError
+
+from drive_api import execute, execute_create, fetch_changes, get_start_page_token
+
+'''
+Local SQLite index of the Google Drive metadata used by the lookup helpers (folder and file listings, lookups by
+name), so that repeated lookups are local queries instead of API calls.
+
+A folder is listed from Drive the first time it is looked up, after that it is kept up to date from the Drive
+changes feed (refresh) and from the files this process creates or deletes itself (upsert / remove).
+
+Requires user specific inputs
+
+DRIVE_INDEX_FILE is the path of the SQLite database. Delete it to rebuild the index from scratch.
+'''
+DRIVE_INDEX_FILE = 'drive_index.sqlite'
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# metadata requested for every file put in the index
+INDEX_FIELDS = 'id, name, mimeType, parents, md5Checksum, modifiedTime, trashed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    mime_type TEXT,
+    md5 TEXT,
+    modified_time TEXT
+);
+CREATE TABLE IF NOT EXISTS parents (
+    file_id TEXT NOT NULL,
+    parent_id TEXT NOT NULL,
+    PRIMARY KEY (parent_id, file_id)
+);
+CREATE INDEX IF NOT EXISTS parents_file_id ON parents (file_id);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE TABLE IF NOT EXISTS listed_folders (
+    id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class DriveIndex:
+    """
+    Thread-safe local index of Google Drive file metadata (ids, names, parents, mime types, checksums and
+    modified times). The database is opened on first use.
+
+    Args:
+        db_path (str): The path of the SQLite database (default is DRIVE_INDEX_FILE).
+    """
+
+    def __init__(self, db_path=DRIVE_INDEX_FILE):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self._connection = None
+        # folders being listed from Drive, by ID, so that other threads wait for that listing instead of repeating it
+        self._listing = {}
+
+    @property
+    def connection(self):
+        with self.lock:
+            if self._connection is None:
+                self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._connection.row_factory = sqlite3.Row
+                self._connection.executescript(SCHEMA)
+            return self._connection
+
+    def _get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def upsert(self, file):
+        """
+        Adds or updates a file in the index, or removes it if it is trashed.
+
+        Args:
+            file (dict): The file metadata, with at least 'id' and 'name' (see INDEX_FIELDS).
+
+        Returns:
+            None
+        """
+        if file.get('trashed'):
+            self.remove(file['id'])
+            return
+        with self.lock, self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO files (id, name, mime_type, md5, modified_time) VALUES (?, ?, ?, ?, ?)",
+                (file['id'], file['name'], file.get('mimeType'), file.get('md5Checksum'), file.get('modifiedTime'))
+            )
+            if 'parents' in file:
+                connection.execute("DELETE FROM parents WHERE file_id = ?", (file['id'],))
+                connection.executemany("INSERT OR IGNORE INTO parents (file_id, parent_id) VALUES (?, ?)",
+                                       [(file['id'], parent_id) for parent_id in file['parents']])
+
+    def remove(self, file_id):
+        """
+        Removes a file from the index.
+
+        Args:
+            file_id (str): The ID of the file.
+
+        Returns:
+            None
+        """
+        with self.lock, self.connection as connection:
+            connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            connection.execute("DELETE FROM parents WHERE file_id = ?", (file_id,))
+
+    def refresh(self, service):
+        """
+        Applies the changes of the Drive changes feed made since the previous refresh. The first refresh only
+        records the current position of the feed, folders are listed in full when they are first looked up.
+
+        Args:
+            service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+
+        Returns:
+            int: The number of changes applied.
+        """
+        with self.lock:
+            page_token = self._get_meta('changes_token')
+        if page_token is None:
+            self._start_changes_feed(service)
+            return 0
+
+        changes, new_page_token = fetch_changes(service, page_token)
+        with self.lock:
+            for change in changes:
+                if change.get('removed') or 'file' not in change:
+                    self.remove(change['fileId'])
+                elif self._is_tracked(change['file']):
+                    self.upsert(change['file'])
+            with self.connection:
+                self._set_meta('changes_token', new_page_token)
+        print(f"Drive index refreshed with {len(changes)} changes.")
+        return len(changes)
+
+    def _start_changes_feed(self, service):
+        # record the position of the changes feed before anything is listed, so that no change is missed
+        with self.lock:
+            if self._get_meta('changes_token') is not None:
+                return
+        page_token = get_start_page_token(service)
+        with self.lock, self.connection:
+            if self._get_meta('changes_token') is None:
+                self._set_meta('changes_token', page_token)
+
+    def _is_tracked(self, file):
+        # only files already indexed or in a listed folder are kept, the changes feed covers the whole Drive
+        if self.connection.execute("SELECT 1 FROM files WHERE id = ?", (file['id'],)).fetchone():
+            return True
+        parents = file.get('parents', [])
+        return bool(parents) and self.connection.execute(
+            f"SELECT 1 FROM listed_folders WHERE id IN ({', '.join('?' * len(parents))})", parents
+        ).fetchone() is not None
+
+    def _list_folder(self, service, folder_id):
+        # list the children of a folder from Drive the first time it is looked up, the lock is only held for the
+        # SQLite reads and writes so that lookups from other threads are not blocked by the HTTP calls
+        while True:
+            with self.lock:
+                if self.connection.execute("SELECT 1 FROM listed_folders WHERE id = ?", (folder_id,)).fetchone():
+                    return
+                listing = self._listing.get(folder_id)
+                if listing is None:
+                    listing = self._listing[folder_id] = threading.Event()
+                    break
+            # another thread is listing this folder, check again once it is done (it may have failed)
+            listing.wait()
+
+        try:
+            self._start_changes_feed(service)
+            query = f"'{folder_id}' in parents and trashed = false"
+            page_token = None
+            files = []
+            while True:
+                response = execute(service.files().list(q=query, pageSize=1000, pageToken=page_token,
+                                                        fields=f"nextPageToken, files({INDEX_FIELDS})"))
+                files.extend(response.get('files', []))
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+            with self.lock:
+                for file in files:
+                    self.upsert(file)
+                with self.connection as connection:
+                    connection.execute("INSERT OR IGNORE INTO listed_folders (id) VALUES (?)", (folder_id,))
+        finally:
+            with self.lock:
+                del self._listing[folder_id]
+            listing.set()
+
+    def parents(self, service, file_id):
+        """
+        Gets the IDs of the folders directly containing a file. Files missing from the index are fetched from Drive
+        and indexed.
+
+        Args:
+            service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+            file_id (str): The ID of the file.
+
+        Returns:
+            list: The IDs of the parent folders, empty for a root folder or a file that no longer exists.
+        """
+        with self.lock:
+            known = self.connection.execute("SELECT 1 FROM files WHERE id = ?", (file_id,)).fetchone()
+            rows = self.connection.execute("SELECT parent_id FROM parents WHERE file_id = ?", (file_id,)).fetchall()
+        if known:
+            return [row['parent_id'] for row in rows]
+        try:
+            file = execute(service.files().get(fileId=file_id, fields=INDEX_FIELDS))
+        except HttpError:
+            return []
+        self.upsert(file)
+        return file.get('parents', [])
+
+    def ancestors(self, service, file_ids, stop_ids=()):
+        """
+        Collects the folders containing the files, directly or through any number of subfolders.
+
+        Args:
+            service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+            file_ids (iterable): The IDs of the files.
+            stop_ids (iterable, optional): The IDs of folders whose own ancestors are not needed (e.g. the folders
+                being looked for). Defaults to ().
+
+        Returns:
+            set: The IDs of the ancestor folders.
+        """
+        stop_ids = set(stop_ids)
+        found = set()
+        pending = [file_id for file_id in file_ids if file_id not in stop_ids]
+        visited = set(pending)
+        while pending:
+            for parent_id in self.parents(service, pending.pop()):
+                found.add(parent_id)
+                if parent_id not in stop_ids and parent_id not in visited:
+                    visited.add(parent_id)
+                    pending.append(parent_id)
+        return found
+
+    def children(self, service, folder_id, name=None, mime_type=None, mime_prefix=None, folders=None):
+        """
+        Lists the files in a folder, most recently modified first.
+
+        Args:
+            service (googleapiclient.discovery.Resource): The authenticated Google Drive API service, used to list
+                the folder if it is not indexed yet.
+            folder_id (str): The ID of the folder.
+            name (str, optional): Only files with this name. Defaults to None.
+            mime_type (str, optional): Only files with this mime type. Defaults to None.
+            mime_prefix (str, optional): Only files whose mime type starts with this prefix (e.g. 'image/').
+                Defaults to None.
+            folders (bool, optional): True for subfolders only, False for files only. Defaults to None (both).
+
+        Returns:
+            list: A list of dictionaries with the 'id', 'name', 'mimeType', 'md5Checksum' and 'modifiedTime' of
+            each file.
+        """
+        self._list_folder(service, folder_id)
+        if folders:
+            mime_type = FOLDER_MIME_TYPE
+        query = ("SELECT files.* FROM parents JOIN files ON files.id = parents.file_id "
+                 "WHERE parents.parent_id = ?")
+        args = [folder_id]
+        for condition, value in (("files.name = ?", name), ("files.mime_type = ?", mime_type),
+                                 ("files.mime_type LIKE ? || '%'", mime_prefix)):
+            if value is not None:
+                query += f" AND {condition}"
+                args.append(value)
+        if folders is False:
+            query += " AND files.mime_type IS NOT ?"
+            args.append(FOLDER_MIME_TYPE)
+        query += " ORDER BY files.modified_time DESC, files.name"
+        with self.lock:
+            rows = self.connection.execute(query, args).fetchall()
+        return [self._to_file(row) for row in rows]
+
+    def find_by_name(self, name):
+        """
+        Finds the indexed files with a name, in any indexed folder, most recently modified first.
+
+        Args:
+            name (str): The name of the file.
+
+        Returns:
+            list: A list of dictionaries as returned by children.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM files WHERE name = ? ORDER BY modified_time DESC", (name,)
+            ).fetchall()
+        return [self._to_file(row) for row in rows]
+
+    @staticmethod
+    def _to_file(row):
+        return {'id': row['id'], 'name': row['name'], 'mimeType': row['mime_type'],
+                'md5Checksum': row['md5'], 'modifiedTime': row['modified_time']}
+
+
+# Function to compute the MD5 checksum Drive reports for a file
+def md5_checksum(source):
+    """
+    Computes the MD5 checksum of local content, comparable with the md5Checksum of a Drive file.
+
+    Args:
+        source (bytes or str): The content of the file, or the path of a local file.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.md5()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    else:
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to upload a file, updating the existing one in place
+def upload_or_update(service, drive_index, folder_id, file_name, media, md5, mime_type=None):
+    """
+    Uploads a file to a folder unless a file with the same name and content is already there. A file with the
+    same name but different content is updated in place with files().update instead of adding a duplicate.
+
+    Args:
+        service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        drive_index (DriveIndex): The local index of the Drive metadata.
+        folder_id (str): The ID of the folder to upload to.
+        file_name (str): The name of the file in Drive.
+        media (googleapiclient.http.MediaUpload): The content to upload.
+        md5 (str): The MD5 checksum of the content, see md5_checksum.
+        mime_type (str, optional): The MIME type to set when the file is created. Defaults to None.
+
+    Returns:
+        dict: The metadata of the file in Drive (see INDEX_FIELDS).
+    """
+    existing = drive_index.children(service, folder_id, name=file_name, folders=False)
+    if existing:
+        # update the most recently modified one if earlier runs left duplicates
+        file = existing[0]
+        if file['md5Checksum'] == md5:
+            print(f"{file_name} is unchanged in folder {folder_id}, skipping upload.")
+            return file
+        file = execute(service.files().update(fileId=file['id'], media_body=media, fields=INDEX_FIELDS))
+    else:
+        file_metadata = {'name': file_name, 'parents': [folder_id]}
+        if mime_type:
+            file_metadata['mimeType'] = mime_type
+        file = execute_create(service, service.files().create(body=file_metadata, media_body=media, fields=INDEX_FIELDS),
+                              folder_id, file_name, INDEX_FIELDS, md5=md5)
+    drive_index.upsert(file)
+    return file
@@ -0,0 +1,130 @@
+import math
+import pyarrow as pa
+
+'''
+Canonical Arrow element table shared by the pipeline stages.
+
+The elements of structuredData.json are written once per document as an uncompressed Arrow IPC (Feather v2) file,
+so later stages memory-map it with zero copy instead of re-parsing the JSON. Edits from edit_json are stored as a
+separate file holding only the replaced Text column, which is swapped into the table when it is read.
+
+1. ELEMENT_TABLE_FILE is the name of the element table uploaded next to structuredData.json.
+
+2. EDITED_TEXT_FILE is the name of the file holding the edited Text column.
+'''
+ELEMENT_TABLE_FILE = 'structuredData.arrow'
+EDITED_TEXT_FILE = 'structuredData_edited_text.arrow'
+
+ELEMENT_SCHEMA = pa.schema([
+    ('ObjectID', pa.int64()),
+    ('Path', pa.string()),
+    ('Text', pa.string()),
+    ('Page', pa.int64()),
+    ('filePaths', pa.list_(pa.string())),
+])
+
+
+# Function to build the element table from parsed JSON data
+def build_element_table(data):
+    """
+    Builds the element table from parsed structuredData JSON data.
+
+    Args:
+        data (dict): The parsed JSON data containing the 'elements' extracted from the PDF.
+
+    Returns:
+        pyarrow.Table: The element table, one row per element in document order.
+    """
+    elements = data['elements']
+    columns = {name: [element.get(name) for element in elements] for name in ELEMENT_SCHEMA.names}
+    # NaN is used for missing values by pandas, store it as null
+    columns['Text'] = [None if isinstance(text, float) and math.isnan(text) else text for text in columns['Text']]
+    return pa.table(columns, schema=ELEMENT_SCHEMA)
+
+
+# Function to write an Arrow table to disk
+def write_arrow_file(table, path):
+    """
+    Writes a table as an uncompressed Arrow IPC file so that it can be memory-mapped.
+
+    Args:
+        table (pyarrow.Table): The table to write.
+        path (str): The path of the output file.
+
+    Returns:
+        None
+    """
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+# Function to read an Arrow table without copying it
+def read_arrow_file(source):
+    """
+    Reads an Arrow IPC file with zero copy, memory-mapping local files.
+
+    Args:
+        source (str or bytes): The path of a local file, or the content of the file already in memory.
+
+    Returns:
+        pyarrow.Table: The table.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return pa.ipc.open_file(pa.BufferReader(source)).read_all()
+    return pa.ipc.open_file(pa.memory_map(source, 'r')).read_all()
+
+
+# Function to write the edited Text column
+def write_text_column(texts, path):
+    """
+    Writes the edited Text column of the element table.
+
+    Args:
+        texts (iterable): The text of every element in document order, None or NaN for elements without text.
+        path (str): The path of the output file.
+
+    Returns:
+        None
+    """
+    texts = [None if not isinstance(text, str) else text for text in texts]
+    write_arrow_file(pa.table({'Text': pa.array(texts, type=pa.string())}), path)
+
+
+# Function to read the element table with the edited Text column swapped in
+def read_element_table(source, edited_text_source=None):
+    """
+    Reads the element table, replacing its Text column by the edited one if given.
+
+    Args:
+        source (str or bytes): The element table, as a local path or the file content.
+        edited_text_source (str or bytes, optional): The edited Text column, as a local path or the file content. Defaults to None.
+
+    Returns:
+        pyarrow.Table: The element table.
+    """
+    table = read_arrow_file(source)
+    if edited_text_source is not None:
+        texts = read_arrow_file(edited_text_source).column('Text')
+        if len(texts) != table.num_rows:
+            raise ValueError(f"Edited Text column has {len(texts)} rows but the element table has {table.num_rows}.")
+        table = table.set_column(table.schema.get_field_index('Text'), 'Text', texts)
+    return table
+
+
+# Function to convert the element table to a DataFrame
+def element_table_to_df(table):
+    """
+    Converts the element table to a DataFrame shaped like pd.DataFrame(data['elements']), i.e. with NaN for missing
+    Text / filePaths and filePaths as lists, so that the existing stages can use it unchanged.
+
+    Args:
+        table (pyarrow.Table): The element table.
+
+    Returns:
+        pandas.DataFrame: The elements.
+    """
+    df = table.to_pandas()
+    df['Text'] = df['Text'].astype(object).where(df['Text'].notna(), float('nan'))
+    df['filePaths'] = [paths if paths is not None else float('nan') for paths in table.column('filePaths').to_pylist()]
+    return df
@@ -0,0 +1,106 @@
+import json
+import posixpath
+import zipfile
+from io import BytesIO
+
+'''
+Helpers to read the zip bundle produced by Adobe PDF Extract directly, without unpacking it to disk.
+
+A bundle contains structuredData.json, the figure renditions under figures/ (e.g. figures/fileoutpart0.png)
+and the tables under tables/ (e.g. tables/fileoutpart1.xlsx). Members are streamed with zipfile, so uploading
+one archive per document replaces uploading and downloading every file separately.
+'''
+ZIP_MIME_TYPES = {'application/zip', 'application/x-zip-compressed', 'application/x-zip'}
+STRUCTURED_DATA_FILE = 'structuredData.json'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+TABLE_EXTENSIONS = ('.xlsx',)
+
+
+# Function to check whether a Drive file is an extract bundle
+def is_extract_bundle(file):
+    """
+    Checks whether a Google Drive file is a zip bundle.
+
+    Args:
+        file (dict): The file metadata, containing 'name' and optionally 'mimeType'.
+
+    Returns:
+        bool: True if the file is a zip archive, False otherwise.
+    """
+    return file.get('mimeType') in ZIP_MIME_TYPES or file['name'].lower().endswith('.zip')
+
+
+# Function to open an extract bundle
+def open_bundle(source):
+    """
+    Opens an extract bundle for reading.
+
+    Args:
+        source (bytes or str): The content of the zip file, or the path to a local zip file.
+
+    Returns:
+        zipfile.ZipFile: The opened bundle.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    return zipfile.ZipFile(source)
+
+
+# Function to find a member of a bundle by its file name
+def find_member(bundle, file_name):
+    """
+    Finds a member of the bundle by file name, in the root of the archive or in a top level folder.
+
+    Args:
+        bundle (zipfile.ZipFile): The opened bundle.
+        file_name (str): The file name to find (e.g. 'structuredData.json').
+
+    Returns:
+        str or None: The name of the member in the archive, or None if not found.
+    """
+    matches = [name for name in bundle.namelist() if posixpath.basename(name) == file_name]
+    # prefer the shallowest match if the archive was zipped with a top level folder
+    return min(matches, key=lambda name: name.count('/')) if matches else None
+
+
+# Function to read a JSON member of a bundle
+def read_structured_data(bundle, file_name=STRUCTURED_DATA_FILE):
+    """
+    Reads and parses a JSON member of the bundle.
+
+    Args:
+        bundle (zipfile.ZipFile): The opened bundle.
+        file_name (str): The name of the JSON file (default is STRUCTURED_DATA_FILE).
+
+    Returns:
+        dict or None: The parsed JSON data, or None if the bundle does not contain the file.
+    """
+    member = find_member(bundle, file_name)
+    if member is None:
+        return None
+    with bundle.open(member) as f:
+        return json.load(f)
+
+
+# Function to list the members of a bundle
+def list_members(bundle, extensions, folder=None):
+    """
+    Lists the files of the bundle with the given extensions, optionally only those in one folder
+    (e.g. 'figures' or 'tables').
+
+    Args:
+        bundle (zipfile.ZipFile): The opened bundle.
+        extensions (tuple): The accepted file extensions, in lower case.
+        folder (str, optional): The name of the folder the files must be in. Defaults to None (any folder).
+
+    Returns:
+        list: The names of the matching members, sorted by name.
+    """
+    members = []
+    for info in bundle.infolist():
+        if info.is_dir() or not info.filename.lower().endswith(extensions):
+            continue
+        if folder is not None and posixpath.basename(posixpath.dirname(info.filename)) != folder:
+            continue
+        members.append(info.filename)
+    return sorted(members)
@@ -0,0 +1,100 @@
+import json
+import re
+import time
+
+import pandas as pd
+
+from element_table import element_table_to_df, read_element_table
+from extract_bundle import open_bundle, read_structured_data
+
+'''
+Header-only preview used to tune KEEPTEXT / EXCLUDETEXT / REFERENCETEXT on a local copy of a document.
+
+Only split_using_pathheader is run, so the section tree is printed without splitting the sections into chunks,
+pickling or uploading anything. Run a chunker with `--preview <path>`, where <path> is a local structuredData.json
+(or structuredData_edited.json), an extract bundle (.zip) or an element table (.arrow).
+'''
+PREVIEW_ARG = '--preview'
+
+
+# Function to load the elements of a local file
+def load_local_elements(path):
+    """
+    Loads the elements of a locally cached document.
+
+    Args:
+        path (str): The path of a structuredData JSON file, an extract bundle (.zip) or an element table (.arrow).
+
+    Returns:
+        pd.DataFrame: The elements extracted from the PDF, one row per element.
+    """
+    if path.lower().endswith('.zip'):
+        with open_bundle(path) as bundle:
+            data = read_structured_data(bundle)
+        if data is None:
+            raise ValueError(f"No structuredData.json found in {path}.")
+    elif path.lower().endswith('.arrow'):
+        return element_table_to_df(read_element_table(path))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    return pd.DataFrame(data['elements'])
+
+
+# Function to estimate the depth of a section header
+def section_depth(section):
+    """
+    Estimates the depth of a section header in the section tree, from its numbering (e.g. 2.1.3) if it has one,
+    otherwise from the heading level in its Path (e.g. /H2).
+
+    Args:
+        section (dict): The section, with 'section_name' and 'Path'.
+
+    Returns:
+        int: The depth of the section, starting from 1.
+    """
+    numbering = re.match(r'^\s*(\d+(?:\.\d+)*)', str(section['section_name']))
+    if numbering:
+        return numbering.group(1).count('.') + 1
+    heading = re.search(r'/H(\d)', str(section['Path']))
+    return int(heading.group(1)) if heading else 1
+
+
+# Function to print the section tree of a document
+def preview_headers(split_func, elements_df, specialchar_replacements):
+    """
+    Classifies the elements with the header rules only and prints the title and the section tree with pages and
+    the amount of text under each section.
+
+    Args:
+        split_func (callable): The split_using_pathheader function of the chunker.
+        elements_df (pd.DataFrame): The elements extracted from the PDF, one row per element.
+        specialchar_replacements (dict): A dictionary of regex replacements for special characters.
+
+    Returns:
+        list: The sections found.
+    """
+    start = time.perf_counter()
+    elements_df = elements_df.replace(specialchar_replacements, regex=True)
+    title, tables, figures, text_chunks, sections, exception_section = split_func(elements_df)
+    elapsed = time.perf_counter() - start
+
+    text_counts = {}
+    for entry in text_chunks:
+        count, chars = text_counts.get(entry['section_id'], (0, 0))
+        text_counts[entry['section_id']] = (count + 1, chars + len(entry['Text']))
+    exception_ids = {section['section_id'] for section in exception_section}
+
+    for entry in title:
+        print(f"Title: {entry['title_name'].strip()} (page {entry['Page']})")
+    if 0 in text_counts:
+        print(f"(before first section) {text_counts[0][0]} texts, {text_counts[0][1]} chars")
+    for section in sections:
+        count, chars = text_counts.get(section['section_id'], (0, 0))
+        marker = ' [KEEPTEXT]' if section['section_id'] in exception_ids else ''
+        indent = '  ' * (section_depth(section) - 1)
+        print(f"{section['section_id']:>4} {indent}{str(section['section_name']).strip()}{marker}"
+              f"  (page {section['Page']}, {count} texts, {chars} chars)")
+    print(f"{len(sections)} sections, {len(text_chunks)} texts, {len(tables)} tables, {len(figures)} figures "
+          f"classified in {elapsed:.3f}s.")
+    return sections
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import pickle
+from collections import defaultdict
+from io import BytesIO
+
+from drive_api import next_chunk
+from googleapiclient.http import MediaIoBaseDownload
+
+'''
+Section level incremental re-chunking.
+
+edit_json usually changes only a few Text values of a document (figure summaries added, text inside figures blanked),
+so the previous run's section boundaries and per-section content hashes are kept in a manifest uploaded with the other
+metadata pickles. On the next run only the sections whose content hash changed are chunked again, the chunks of the
+other sections are reused, and a chunk level change list is produced for the QA generation.
+
+1. MANIFEST_FILE is the name of the manifest uploaded to the output folder of each document.
+
+2. CHANGES_FILE is the name of the change list uploaded to the output folder of each document. Every entry is a dict
+   with 'change' ('added', 'modified' or 'removed'), 'section_name', 'section_occurrence' (number of earlier sections
+   with the same name, None for removed sections), 'chunk_index' (position within the section) and 'text_chunk' (the
+   new text, or the old one for removed chunks). Section name, occurrence and chunk index identify a chunk in the
+   chunk spreadsheet even after its text is edited by a reviewer.
+'''
+MANIFEST_FILE = 'Sections_manifest.pkl'
+CHANGES_FILE = 'Chunk_changes.pkl'
+MANIFEST_VERSION = 1
+
+
+# Function to describe the chunking settings stored with the manifest
+def chunker_config(version, **settings):
+    """
+    Describes what the chunks of a section depend on besides its content: the version of the chunking code and a hash
+    of the chunking settings (chunk size and overlap, section rule tables, special character replacements). A previous
+    manifest is only reused when both are unchanged.
+
+    Args:
+        version (int): The version of the chunking code of the chunker.
+        **settings: The chunking settings, JSON serialisable.
+
+    Returns:
+        dict: The config to pass to IncrementalChunker.
+    """
+    encoded = json.dumps(settings, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return {'version': version, 'settings_hash': hashlib.sha256(encoded).hexdigest()}
+
+
+# Function to build the key identifying a section across runs
+def section_key(section, occurrence=0):
+    """
+    Builds the key identifying a section across runs. The ObjectID of the header element does not change when
+    edit_json edits the Text values, the occurrence number separates headers that share an ObjectID and name.
+
+    Args:
+        section (dict): The section, with 'ObjectID' and 'section_name'.
+        occurrence (int): The number of earlier sections with the same ObjectID and name (default is 0).
+
+    Returns:
+        str: The section key.
+    """
+    return f"{section['ObjectID']}:{section['section_name']}:{occurrence}"
+
+
+# Function to hash the content of a section
+def section_hash(section, text_chunks):
+    """
+    Hashes the content a section is chunked from: its name and the text and page of each of its text chunks.
+    The text_id values are left out since they shift whenever an earlier section gains or loses an element.
+
+    Args:
+        section (dict): The section, with 'section_name'.
+        text_chunks (list): The text chunks of the section, in document order.
+
+    Returns:
+        str: The hex digest of the section content.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(section['section_name']).encode('utf-8'))
+    for entry in text_chunks:
+        digest.update(b'\x00')
+        digest.update(str(entry['Text']).encode('utf-8'))
+        digest.update(b'\x01')
+        digest.update(str(int(entry['Page'])).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Function to list the changes between the old and new chunks of a section
+def diff_chunks(section_name, old_chunks, new_chunks, section_occurrence=None):
+    """
+    Compares the chunk texts of a section position by position.
+
+    Args:
+        section_name (str): The name of the section.
+        old_chunks (list): The chunk texts of the previous run.
+        new_chunks (list): The chunk texts of this run.
+        section_occurrence (int, optional): The number of earlier sections with the same name. Defaults to None.
+
+    Returns:
+        list: The change list entries of the section.
+    """
+    changes = []
+    for index in range(max(len(old_chunks), len(new_chunks))):
+        if index >= len(old_chunks):
+            change, text = 'added', new_chunks[index]
+        elif index >= len(new_chunks):
+            change, text = 'removed', old_chunks[index]
+        elif old_chunks[index] != new_chunks[index]:
+            change, text = 'modified', new_chunks[index]
+        else:
+            continue
+        changes.append({'change': change, 'section_name': section_name, 'section_occurrence': section_occurrence,
+                        'chunk_index': index, 'text_chunk': text})
+    return changes
+
+
+class IncrementalChunker:
+    """
+    Drop-in replacement for process_extract in combine_texts that only chunks the sections changed since the
+    previous run. After it is called, `manifest` holds the manifest to upload and `changes` the chunk level change list.
+
+    Args:
+        process_extract_func (callable): The process_extract function of the chunker, accepting chunk_counts.
+        previous_manifest (dict, optional): The manifest of the previous run. Defaults to None (chunk everything).
+        config (dict, optional): The chunking settings, see chunker_config. The previous manifest is ignored if
+            they differ. Defaults to None.
+    """
+
+    def __init__(self, process_extract_func, previous_manifest=None, config=None):
+        self.process_extract_func = process_extract_func
+        self.config = config or {}
+        if previous_manifest is not None and (previous_manifest.get('version') != MANIFEST_VERSION
+                                              or previous_manifest.get('config') != self.config):
+            print("Chunking settings changed since the previous run, chunking every section again.")
+            previous_manifest = None
+        self.previous_manifest = previous_manifest
+        self.manifest = None
+        self.changes = []
+
+    def __call__(self, text_chunks, sections):
+        grouped_chunks = defaultdict(list)
+        for entry in text_chunks:
+            grouped_chunks[entry['section_id']].append(entry)
+
+        previous = {}
+        if self.previous_manifest is not None:
+            previous = {entry['key']: entry for entry in self.previous_manifest['sections']}
+
+        # Find the sections whose content changed since the previous run
+        occurrences = defaultdict(int)
+        entries = []
+        changed_ids = set()
+        for section in sections:
+            key = section_key(section, occurrences[(section['ObjectID'], section['section_name'])])
+            occurrences[(section['ObjectID'], section['section_name'])] += 1
+            content_hash = section_hash(section, grouped_chunks[section['section_id']])
+            old_entry = previous.get(key)
+            if old_entry is None or old_entry['hash'] != content_hash:
+                changed_ids.add(section['section_id'])
+            entries.append((section, key, content_hash, old_entry))
+
+        # Chunk the changed sections in one call so that their oversized sections are still split together
+        chunk_counts = {}
+        changed_chunks = self.process_extract_func(
+            [entry for entry in text_chunks if entry['section_id'] in changed_ids],
+            [section for section in sections if section['section_id'] in changed_ids],
+            chunk_counts
+        )
+        print(f"Re-chunked {len(changed_ids)} of {len(sections)} sections.")
+
+        chunks_data = []
+        manifest_sections = []
+        self.changes = []
+        position = 0
+        name_occurrences = defaultdict(int)
+        for section, key, content_hash, old_entry in entries:
+            section_id = section['section_id']
+            section_occurrence = name_occurrences[section['section_name']]
+            name_occurrences[section['section_name']] += 1
+            if section_id in changed_ids:
+                new_chunks = changed_chunks[position:position + chunk_counts[section_id]]
+                position += chunk_counts[section_id]
+                old_texts = old_entry['chunks'] if old_entry is not None else []
+                self.changes.extend(diff_chunks(section['section_name'], old_texts, [chunk['text_chunk'] for chunk in new_chunks],
+                                                section_occurrence))
+            else:
+                # the text_id values are refreshed since they may have shifted
+                section_chunks = grouped_chunks[section_id]
+                new_chunks = [{
+                    'text_chunk': text,
+                    'section_name': section['section_name'],
+                    'text_id': [entry['text_id'] for entry in section_chunks],
+                    'pages': list(set(entry['Page'] for entry in section_chunks))
+                } for text in old_entry['chunks']]
+            chunks_data.extend(new_chunks)
+            manifest_sections.append({'key': key, 'hash': content_hash, 'chunks': [chunk['text_chunk'] for chunk in new_chunks]})
+
+        # Sections of the previous run that no longer exist
+        current_keys = {entry['key'] for entry in manifest_sections}
+        for key, old_entry in previous.items():
+            if key not in current_keys:
+                section_name = key.split(':', 1)[1].rsplit(':', 1)[0]
+                self.changes.extend(diff_chunks(section_name, old_entry['chunks'], []))
+
+        self.manifest = {'version': MANIFEST_VERSION, 'config': self.config, 'sections': manifest_sections}
+        return chunks_data
+
+
+# Function to load the manifest of the previous run
+def load_previous_manifest(drive_service, output_folder_id, drive_index):
+    """
+    Downloads the manifest of the previous run from the output folder, if there is one.
+
+    Args:
+        drive_service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        output_folder_id (str): The ID of the Google Drive output folder of the document.
+        drive_index (DriveIndex): The local index of the Drive metadata used to find the manifest.
+
+    Returns:
+        dict or None: The manifest, or None if the document was not chunked before.
+    """
+    files = drive_index.children(drive_service, output_folder_id, name=MANIFEST_FILE)
+    if not files:
+        return None
+
+    request = drive_service.files().get_media(fileId=files[0]['id'])
+    file_data = BytesIO()
+    downloader = MediaIoBaseDownload(file_data, request)
+    done = False
+    while not done:
+        status, done = next_chunk(downloader)
+    file_data.seek(0)
+    return pickle.load(file_data)
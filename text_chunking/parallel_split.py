@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+'''
+Settings for splitting oversized sections of a document in parallel.
+
+1. PARALLEL_SPLIT_MAX_WORKERS is the maximum number of worker processes (None uses all available cores).
+
+2. SPLIT_CHARS_PER_SECOND is a conservative estimate of the single core splitting speed of the text splitter.
+   Text with paragraph breaks splits at about 100M characters per second, text that has to be split on spaces
+   at about 3M characters per second, the lower figure is used so that the estimate does not underrate the work.
+
+3. WORKER_STARTUP_SECONDS is the estimated cost of starting the worker pool for each process start method.
+   'spawn' (the default on Windows and macOS) re-imports the modules in every worker and is much slower than 'fork'.
+'''
+PARALLEL_SPLIT_MAX_WORKERS = None
+SPLIT_CHARS_PER_SECOND = 3000000
+WORKER_STARTUP_SECONDS = {'fork': 0.05, 'forkserver': 1.0, 'spawn': 2.0}
+
+# worker pool shared by every document of the run, started on first use
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers)
+        return _executor
+
+
+# Function to decide whether splitting in parallel pays off
+def should_split_in_parallel(texts, workers):
+    """
+    Estimates whether splitting the texts across worker processes is faster than splitting them on one core.
+
+    Splitting on one core takes about total_chars / SPLIT_CHARS_PER_SECOND seconds, splitting in parallel saves
+    (1 - 1 / workers) of that time but has to pay for starting the worker pool unless it is already running.
+
+    Args:
+        texts (list): The texts to split.
+        workers (int): The number of worker processes that would be used.
+
+    Returns:
+        bool: True if splitting in parallel is expected to be faster, False otherwise.
+    """
+    if workers < 2:
+        return False
+    serial_seconds = sum(len(text) for text in texts) / SPLIT_CHARS_PER_SECOND
+    startup_seconds = 0 if _executor is not None else WORKER_STARTUP_SECONDS.get(multiprocessing.get_start_method(), 2.0)
+    return serial_seconds * (1 - 1 / workers) > startup_seconds
+
+
+# Function to split several texts, in parallel when it pays off
+def split_texts(text_splitter, texts, max_workers=PARALLEL_SPLIT_MAX_WORKERS):
+    """
+    Splits each text with the text splitter. The texts are dispatched to a pool of worker processes when
+    should_split_in_parallel expects it to be faster, the results are always returned in the order of the texts.
+
+    Args:
+        text_splitter (langchain_text_splitters.TextSplitter): The text splitter used for each text.
+        texts (list): The texts to split.
+        max_workers (int): The maximum number of worker processes (default is PARALLEL_SPLIT_MAX_WORKERS).
+
+    Returns:
+        list: A list containing the list of chunks of each text.
+    """
+    workers = min(max_workers or os.cpu_count() or 1, len(texts))
+    if not should_split_in_parallel(texts, workers):
+        return [text_splitter.split_text(text) for text in texts]
+
+    print(f"Splitting {len(texts)} oversized sections across {workers} worker processes.")
+    # largest texts first keeps the workers busy until the end, the results are put back in order afterwards
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    executor = _get_executor(max_workers)
+    results = executor.map(text_splitter.split_text, [texts[i] for i in order])
+    split_chunks = [None] * len(texts)
+    for i, chunks in zip(order, results):
+        split_chunks[i] = chunks
+    return split_chunks
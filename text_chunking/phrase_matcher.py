@@ -0,0 +1,135 @@
+import unicodedata
+from collections import deque
+
+'''
+Multi-phrase matcher for the configured text lists (KEEPTEXT, EXCLUDETEXT, REFERENCETEXT, QA keywords).
+
+Texts and phrases are normalised the same way before matching (Unicode NFKC, runs of whitespace collapsed to one
+space, leading / trailing whitespace removed, and optionally case folded), so variants such as the double-spaced
+"Recommendation  1" match without adding every spelling to the lists.
+
+Whole-text matches (is the text one of the phrases) are a dictionary lookup on the normalised text. Phrases
+contained anywhere in a text are found with an Aho-Corasick automaton built once from all phrases, which tests a
+text against every phrase in a single linear scan.
+'''
+
+
+# Function to normalise a text before matching
+def normalize_text(text, casefold=False):
+    """
+    Normalises a text for matching: Unicode NFKC, whitespace collapsed and stripped, optionally case folded.
+
+    Args:
+        text (str): The text to normalise.
+        casefold (bool): Whether to ignore case (default is False).
+
+    Returns:
+        str: The normalised text.
+    """
+    text = ' '.join(unicodedata.normalize('NFKC', text).split())
+    return text.casefold() if casefold else text
+
+
+class PhraseMatcher:
+    """
+    Matches texts against labelled lists of phrases.
+
+    Args:
+        phrases (dict): The phrases by label (e.g. {'keep': KEEPTEXT, 'reference': REFERENCETEXT}). A value can be
+            a list of phrases or a single phrase.
+        casefold (bool): Whether to ignore case (default is False).
+    """
+
+    def __init__(self, phrases, casefold=False):
+        self.casefold = casefold
+        self._labels = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for label, label_phrases in phrases.items():
+            if isinstance(label_phrases, str):
+                label_phrases = [label_phrases]
+            for phrase in label_phrases or []:
+                key = normalize_text(phrase, casefold)
+                if not key:
+                    continue
+                self._labels.setdefault(key, set()).add(label)
+                self._add(label, key)
+        self._build_failure_links()
+
+    def _add(self, label, key):
+        node = 0
+        for char in key:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((label, key))
+
+    def _build_failure_links(self):
+        # breadth first, so the failure link of a node always points to a shallower node that is already done
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(char, 0)
+                self._output[next_node] = self._output[next_node] + self._output[self._fail[next_node]]
+
+    def full_matches(self, text):
+        """
+        Finds the labels of the phrases equal to the whole (normalised) text.
+
+        Args:
+            text (str): The text to match.
+
+        Returns:
+            set: The labels of the matching phrases, empty if there is none or the text is not a string.
+        """
+        if not isinstance(text, str):
+            return set()
+        return self._labels.get(normalize_text(text, self.casefold), set())
+
+    def find(self, text):
+        """
+        Finds every occurrence of every phrase in the (normalised) text, in one scan.
+
+        Args:
+            text (str): The text to search.
+
+        Returns:
+            list: (label, phrase, start, end) tuples, with positions in the normalised text.
+        """
+        if not isinstance(text, str):
+            return []
+        text = normalize_text(text, self.casefold)
+        goto, fail, output = self._goto, self._fail, self._output
+        matches = []
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for label, key in output[node]:
+                matches.append((label, key, end - len(key), end))
+        return matches
+
+    def contains(self, text):
+        """
+        Finds the labels of the phrases occurring anywhere in the (normalised) text.
+
+        Args:
+            text (str): The text to search.
+
+        Returns:
+            set: The labels of the phrases found.
+        """
+        return {label for label, _, _, _ in self.find(text)}
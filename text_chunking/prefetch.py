@@ -0,0 +1,69 @@
+import queue
+import threading
+
+'''
+Requires user specific inputs
+
+PREFETCH_DEPTH is the number of documents downloaded ahead of the document being chunked. At most PREFETCH_DEPTH + 2
+documents are held in memory at once (the queued ones, the one being downloaded and the one being chunked).
+'''
+PREFETCH_DEPTH = 2
+
+# marks the end of the items in the queue
+_DONE = object()
+
+
+# Function to load items in a background thread while the caller processes earlier items
+def prefetch(items, load, depth=PREFETCH_DEPTH):
+    """
+    Loads items in a background thread and yields them in order, keeping at most `depth` loaded items queued
+    so that I/O (e.g. downloads) overlaps with the processing done by the caller.
+
+    The `load` function runs in the background thread, so it must not share a non thread-safe client
+    (e.g. a Drive service object) with the caller. Errors raised by `load` are re-raised in the caller.
+
+    Args:
+        items (iterable): The items to load, in processing order.
+        load (callable): The function called with each item, returning the loaded value.
+        depth (int): The maximum number of loaded items waiting to be processed (default is PREFETCH_DEPTH).
+
+    Returns:
+        generator: Yields (item, loaded value) tuples in the order of `items`.
+    """
+    loaded = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def put(entry):
+        # block while the queue is full, unless the caller stopped consuming
+        while not stop.is_set():
+            try:
+                loaded.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def worker():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                put((item, load(item), None))
+        except Exception as e:
+            put((None, None, e))
+        finally:
+            put(_DONE)
+
+    thread = threading.Thread(target=worker, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            entry = loaded.get()
+            if entry is _DONE:
+                break
+            item, value, error = entry
+            if error is not None:
+                raise error
+            yield item, value
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,179 @@
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from header_preview import load_local_elements
+
+'''
+Requires user specific inputs
+
+Regression and speed harness for the chunker variants. Every variant is run over every document of a local corpus
+and each output list of combine_texts (title, tables, figures, text_chunks, sections, exception_chunks, chunks_data)
+is compared with a golden snapshot, so that optimisations cannot change the output silently.
+
+Usage (from the text_chunking folder):
+    python regression_harness.py             compare against the golden snapshots and report throughput
+    python regression_harness.py --update    (re)write the golden snapshots from the current code
+    python regression_harness.py --variant text_chunking_ace.py    only run one variant
+
+1. CORPUS_DIR is the folder holding the local copies of the extracts (structuredData JSON files, extract bundles
+   (.zip) or element tables (.arrow)). The committed corpus is synthetic and small: it exercises the title, keep,
+   exclude, header and reference rules of every variant, tables, figures, special characters and oversized sections.
+   Add copies of the documents the variants are meant for to cover more cases.
+
+2. GOLDEN_DIR is the folder holding the golden snapshots, one JSON file per variant and document with the records of
+   each output list. The outputs are compared as DataFrames after the same JSON round trip, so the snapshots can be
+   diffed and do not depend on the pandas or numpy version. The committed snapshots were produced by the original
+   chunkers, before their optimisation, and test_regression_harness.py runs the comparison under pytest.
+
+3. VARIANTS are the chunker scripts to run.
+
+4. REPEAT is the number of timed runs per document, the fastest one is reported.
+'''
+CORPUS_DIR = 'regression_corpus'
+GOLDEN_DIR = 'regression_golden'
+VARIANTS = ['text_chunking_ace.py', 'text_chunking_acg.py', 'text_chunking_healtiersg.py', 'text_chunking_numbering.py']
+REPEAT = 3
+
+OUTPUT_NAMES = ['title', 'tables', 'figures', 'text_chunks', 'sections', 'exception_chunks', 'chunks_data']
+CORPUS_EXTENSIONS = ('.json', '.zip', '.arrow')
+
+
+# Function to load a chunker variant from its path
+def load_variant(path):
+    """
+    Imports a chunker script as a module, without running its main function.
+
+    Args:
+        path (str): The path of the chunker script.
+
+    Returns:
+        module: The imported chunker.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Function to run a chunker variant on a document
+def run_variant(module, elements_df):
+    """
+    Runs the chunking steps of a variant that do not touch Google Drive.
+
+    Args:
+        module (module): The imported chunker.
+        elements_df (pd.DataFrame): The elements extracted from the PDF, one row per element.
+
+    Returns:
+        dict: The output lists of combine_texts, by name.
+    """
+    outputs = module.combine_texts(
+        module.split_using_pathheader, module.process_extract, module.process_exceptiontext,
+        elements_df, module.specialchar_replacements
+    )
+    return dict(zip(OUTPUT_NAMES, outputs))
+
+
+# Function to convert an output list to JSON records
+def to_records(output):
+    """
+    Converts an output list of dictionaries to JSON-compatible records, turning numpy values into Python values
+    and NaN into None.
+
+    Args:
+        output (list): An output list of combine_texts.
+
+    Returns:
+        list: The records of the output.
+    """
+    return json.loads(pd.DataFrame(output).to_json(orient='records', double_precision=15, force_ascii=False))
+
+
+# Function to find the difference between two outputs
+def frame_difference(expected, actual):
+    """
+    Compares two outputs as DataFrames built from their JSON records.
+
+    Args:
+        expected (list): The golden records.
+        actual (list): The records produced by the current code.
+
+    Returns:
+        str or None: A description of the difference, or None if the outputs are equal.
+    """
+    try:
+        pd.testing.assert_frame_equal(pd.DataFrame(expected), pd.DataFrame(actual))
+    except AssertionError as e:
+        return " ".join(str(e).split())[:200]
+    return None
+
+
+# Function to run the harness
+def main(args):
+    update = '--update' in args
+    variants = [args[args.index('--variant') + 1]] if '--variant' in args else VARIANTS
+
+    documents = sorted(name for name in os.listdir(CORPUS_DIR) if name.lower().endswith(CORPUS_EXTENSIONS))
+    if not documents:
+        print(f"No documents found in {CORPUS_DIR}.")
+        return 1
+    corpus = {name: load_local_elements(os.path.join(CORPUS_DIR, name)) for name in documents}
+
+    failures = 0
+    for variant in variants:
+        module = load_variant(variant)
+        variant_name = os.path.splitext(variant)[0]
+        os.makedirs(os.path.join(GOLDEN_DIR, variant_name), exist_ok=True)
+        total_seconds = 0.0
+        total_elements = 0
+        total_chars = 0
+
+        for name, elements_df in corpus.items():
+            timings = []
+            for _ in range(max(1, REPEAT)):
+                start = time.perf_counter()
+                outputs = run_variant(module, elements_df)
+                timings.append(time.perf_counter() - start)
+            seconds = min(timings)
+            total_seconds += seconds
+            total_elements += len(elements_df)
+            total_chars += int(elements_df['Text'].dropna().str.len().sum()) if 'Text' in elements_df else 0
+
+            records = {output_name: to_records(outputs[output_name]) for output_name in OUTPUT_NAMES}
+            golden_path = os.path.join(GOLDEN_DIR, variant_name, f"{name}.json")
+            if update:
+                with open(golden_path, 'w', encoding='utf-8') as f:
+                    json.dump(records, f, ensure_ascii=False, indent=1)
+                    f.write("\n")
+                status = 'updated'
+            elif not os.path.exists(golden_path):
+                status = 'NO GOLDEN'
+                failures += 1
+            else:
+                with open(golden_path, encoding='utf-8') as f:
+                    golden = json.load(f)
+                differences = [(output_name, frame_difference(golden[output_name], records[output_name]))
+                               for output_name in OUTPUT_NAMES]
+                differences = [f"{output_name}: {difference}" for output_name, difference in differences if difference]
+                status = 'ok' if not differences else f"CHANGED {differences[0]}"
+                failures += bool(differences)
+            print(f"{variant_name:<28}{name[:40]:<42}{1e3 * seconds:>9.1f} ms  {status}")
+
+        if total_seconds:
+            print(f"{variant_name:<28}{'total':<42}{1e3 * total_seconds:>9.1f} ms  "
+                  f"{total_elements / total_seconds:,.0f} elements/s, {total_chars / total_seconds:,.0f} chars/s")
+
+    if not update:
+        print("All outputs match the golden snapshots." if not failures else f"{failures} outputs differ from the golden snapshots.")
+    return 1 if failures else 0
+
+
+# Execute the main function
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,127 @@
+import time
+
+'''
+Requires user specific inputs
+
+PROFILE_SAMPLES is the number of sample elements kept for each rule in the report.
+'''
+PROFILE_SAMPLES = 3
+
+
+class RuleProfiler:
+    """
+    Records, for each rule of split_using_pathheader, how often it was evaluated, how often it fired, the cumulative
+    time spent evaluating it and a few sample elements it fired on.
+
+    The conditions are evaluated in place and their results passed to `check`, so the rules run in the same order
+    and with the same short-circuiting as without the profiler. The time of a rule is the time since the previous
+    mark of the same element: the start of the element in `rows`, or the previous `check` or `hit`. Branches without
+    a condition (e.g. the final else) call `hit`.
+
+    Args:
+        document_name (str): The name of the document, shown in the report.
+        max_samples (int): The number of sample elements kept for each rule (default is PROFILE_SAMPLES).
+    """
+
+    def __init__(self, document_name='', max_samples=PROFILE_SAMPLES):
+        self.document_name = document_name
+        self.max_samples = max_samples
+        self.rules = {}
+        self._mark = time.perf_counter()
+
+    def _stats(self, rule):
+        if rule not in self.rules:
+            self.rules[rule] = {'evaluated': 0, 'hits': 0, 'seconds': 0.0, 'samples': []}
+        return self.rules[rule]
+
+    def rows(self, elements_df):
+        """
+        Iterates over the elements, marking the start of each one for the timing of its first rule.
+
+        Args:
+            elements_df (pd.DataFrame): The elements extracted from the PDF.
+
+        Yields:
+            tuple: The index and row of each element, as DataFrame.iterrows.
+        """
+        for ind, row in elements_df.iterrows():
+            self._mark = time.perf_counter()
+            yield ind, row
+
+    def check(self, rule, row, result):
+        """
+        Records the cost of a rule condition, evaluated since the previous mark, and whether it fired.
+
+        Args:
+            rule (str): The name of the rule.
+            row (pd.Series): The element the rule is evaluated on.
+            result: The result of the condition.
+
+        Returns:
+            The result of the condition, unchanged.
+        """
+        stats = self._stats(rule)
+        stats['seconds'] += time.perf_counter() - self._mark
+        stats['evaluated'] += 1
+        if result:
+            self._record_hit(stats, row)
+        self._mark = time.perf_counter()
+        return result
+
+    def hit(self, rule, row):
+        """
+        Records a branch taken without a condition of its own (e.g. the final else).
+
+        Args:
+            rule (str): The name of the branch.
+            row (pd.Series): The element that took the branch.
+
+        Returns:
+            None
+        """
+        stats = self._stats(rule)
+        stats['evaluated'] += 1
+        self._record_hit(stats, row)
+        self._mark = time.perf_counter()
+
+    def _record_hit(self, stats, row):
+        stats['hits'] += 1
+        if len(stats['samples']) < self.max_samples:
+            text = row['Text'] if isinstance(row['Text'], str) else ''
+            stats['samples'].append(f"{row['ObjectID']} {row['Path']} {text[:40]!r}")
+
+    def report(self):
+        """
+        Builds a compact report of the rules, the most expensive first.
+
+        Returns:
+            str: The report.
+        """
+        lines = [f"Rule profile {self.document_name}".rstrip(),
+                 f"{'rule':<24}{'evaluated':>10}{'hits':>8}{'hit %':>8}{'total ms':>10}{'us/eval':>9}"]
+        for rule, stats in sorted(self.rules.items(), key=lambda item: item[1]['seconds'], reverse=True):
+            hit_rate = 100 * stats['hits'] / stats['evaluated'] if stats['evaluated'] else 0
+            per_eval = 1e6 * stats['seconds'] / stats['evaluated'] if stats['evaluated'] else 0
+            lines.append(f"{rule:<24}{stats['evaluated']:>10}{stats['hits']:>8}{hit_rate:>8.1f}"
+                         f"{1e3 * stats['seconds']:>10.2f}{per_eval:>9.1f}")
+            for sample in stats['samples']:
+                lines.append(f"    {sample}")
+        return "\n".join(lines)
+
+
+class NullProfiler:
+    """
+    Profiler used when profiling is off, passing the condition results through without recording anything.
+    """
+
+    def rows(self, elements_df):
+        return elements_df.iterrows()
+
+    def check(self, rule, row, result):
+        return result
+
+    def hit(self, rule, row):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
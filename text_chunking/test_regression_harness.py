@@ -0,0 +1,10 @@
+import os
+
+import regression_harness
+
+
+# Every chunker variant must reproduce the golden snapshots of the synthetic corpus (see regression_harness.py)
+def test_chunkers_match_golden_snapshots(monkeypatch):
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    monkeypatch.setattr(regression_harness, 'REPEAT', 1)
+    assert regression_harness.main([]) == 0
@@ -2,16 +2,25 @@ import json
 import pandas as pd
 import pickle
 from collections import defaultdict
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import re
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from functools import lru_cache
+import sys
 import io
 from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.http import MediaIoBaseUpload
 from io import BytesIO
-
-# Authenticate and build the google Drive API client
+from drive_api import configure_drive, drive_metrics, execute, execute_create, filter_changed_folders, get_service, next_chunk, save_page_token
+from drive_index import INDEX_FIELDS, DriveIndex, md5_checksum, upload_or_update
+from element_table import EDITED_TEXT_FILE, ELEMENT_TABLE_FILE, element_table_to_df, read_element_table
+from extract_bundle import STRUCTURED_DATA_FILE, is_extract_bundle, open_bundle, read_structured_data
+from header_preview import PREVIEW_ARG, load_local_elements, preview_headers
+from incremental_rechunk import CHANGES_FILE, MANIFEST_FILE, IncrementalChunker, chunker_config, load_previous_manifest
+from parallel_split import split_texts
+from phrase_matcher import PhraseMatcher
+from prefetch import PREFETCH_DEPTH, prefetch
+from rule_profiler import NULL_PROFILER, RuleProfiler
+
+# Authenticate the google Drive API clients, built lazily for each thread by get_service
 '''
 Requires user specific inputs
 
@@ -19,8 +28,14 @@ Replace SERVICE_ACCOUNT_FILE with the path to your JSON key file.
 '''
 SCOPES = ['https://www.googleapis.com/auth/drive']
 SERVICE_ACCOUNT_FILE = ''
-creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-service = build('drive', 'v3', credentials=creds)
+configure_drive(SERVICE_ACCOUNT_FILE, SCOPES)
+
+# page token of the Drive changes feed, saved after every successful run so that the next run only processes the
+# folders changed since. Delete the file to process every folder again.
+CHANGES_TOKEN_FILE = 'drive_changes_token_text_chunking_numbering.txt'
+
+# local index of the Drive folder and file metadata, used for every lookup, see drive_index.py
+drive_index = DriveIndex()
 
 # Set the variables
 '''
@@ -34,22 +49,41 @@ TO EDIT KEEPTEXT and REFERENCETEXT and MAX_TEXT_CHAR
 2. REFERENCETEXT is the "Text" that will stop the split_using_pathheader function and stop text chunking
 
 3. MAX_TEXT_CHAR is the maximum number of characters in one chunk
+
+These texts are compared with the element texts after Unicode (NFKC) and whitespace normalisation, e.g. "Recommendation  1" matches "Recommendation 1".
 '''
 
 REFERENCETEXT = "References"
 KEEPTEXT = ["Scope of the guidelines", "Algorithm for the management of breastfeeding", "Summary of recommendations", "Levels of Evidence and Grades of Recommendation","Key references", "Acknowledgements", "STATEMENT OF INTENT", "FOREWORD", "CONTENTS"]
 MAX_TEXT_CHAR = 3000
 
+# whole-text matcher of the texts above, built once and used by split_using_pathheader
+HEADER_MATCHER = PhraseMatcher({'keep': KEEPTEXT, 'reference': REFERENCETEXT})
+
+# set to True to print, for each document, the hits and evaluation time of each rule in split_using_pathheader
+PROFILE_RULES = False
+
 # to replace special characters
 specialchar_replacements = {'≥': 'more than or equals to', '≤': 'less than or equals to'}
 
-# text splitter to use for large chunks within sections
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=MAX_TEXT_CHAR,
-    chunk_overlap=100,
-    length_function=len,
-    is_separator_regex=False,
-)
+# number of characters shared by consecutive chunks of a large section
+CHUNK_OVERLAP = 100
+
+# version of the chunking code, increase it when split_using_pathheader, process_extract or process_exceptiontext
+# change so that the chunks of the previous run are not reused
+CHUNKER_VERSION = 1
+
+# Function to build the text splitter used for large chunks within sections, once per process
+@lru_cache(maxsize=None)
+def get_text_splitter():
+    # langchain is imported here since importing it takes a noticeable part of a second
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=MAX_TEXT_CHAR,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        is_separator_regex=False,
+    )
 
 # Find for the folder and return folder id, if not found create and return folder id
 def get_or_create_folder_in_drive(parent_folder_id, folder_name):
@@ -64,33 +98,26 @@ def get_or_create_folder_in_drive(parent_folder_id, folder_name):
     Returns:
         str: The ID of the existing or newly created folder.
     """
-    # Define the query to check for the folder
-    query = f"'{parent_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and name='{folder_name}'"
+    # Check if the folder exists
+    items = drive_index.children(get_service(), parent_folder_id, name=folder_name, folders=True)
     
-    try:
-        # Check if the folder exists
-        results = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-        items = results.get('files', [])
-        
-        if items:
-            print(f"Folder '{folder_name}' already exists with ID: {items[0]['id']}")
-            return items[0]['id']
-        
-        # If the folder doesn't exist, create it
-        else:
-            print(f"Folder '{folder_name}' does not exists, creating now")
-            folder_metadata = {
-                'name': folder_name,
-                'mimeType': 'application/vnd.google-apps.folder',
-                'parents': [parent_folder_id]
-            }
-            folder = service.files().create(body=folder_metadata, fields='id').execute()
-            print(f"Folder '{folder_name}' created with ID: {folder.get('id')}")
-            return folder.get('id')
+    if items:
+        print(f"Folder '{folder_name}' already exists with ID: {items[0]['id']}")
+        return items[0]['id']
     
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
+    # If the folder doesn't exist, create it
+    else:
+        print(f"Folder '{folder_name}' does not exists, creating now")
+        folder_metadata = {
+            'name': folder_name,
+            'mimeType': 'application/vnd.google-apps.folder',
+            'parents': [parent_folder_id]
+        }
+        folder = execute_create(get_service(), get_service().files().create(body=folder_metadata, fields=INDEX_FIELDS),
+                                parent_folder_id, folder_name, INDEX_FIELDS, mime_type=folder_metadata['mimeType'])
+        drive_index.upsert(folder)
+        print(f"Folder '{folder_name}' created with ID: {folder.get('id')}")
+        return folder.get('id')
 
 # New function to list folders
 def list_folders_in_folder(folder_id):
@@ -103,9 +130,7 @@ def list_folders_in_folder(folder_id):
     Returns:
         list: A list of dictionaries, each representing a subfolder with its metadata (e.g., 'name' and 'id').
     """
-    query = f"'{folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder'"
-    results = service.files().list(q=query).execute()
-    return results.get('files', [])
+    return drive_index.children(get_service(), folder_id, folders=True)
 
 # New function to list files
 def list_files_in_folder(folder_id):
@@ -118,14 +143,13 @@ def list_files_in_folder(folder_id):
     Returns:
         list: A list of dictionaries, each representing a file with its metadata (e.g., 'name' and 'id').
     """
-    query = f"'{folder_id}' in parents and mimeType != 'application/vnd.google-apps.folder'"
-    results = service.files().list(q=query).execute()
-    return results.get('files', [])
+    return drive_index.children(get_service(), folder_id, folders=False)
 
 # Function to upload files
 def upload_file(service, file_name, mime_type, file_data, parent_folder_id):
     """
-    Uploads a file to Google Drive under a specified parent folder.
+    Uploads a file to Google Drive under a specified parent folder. An existing file with the same name is
+    updated in place, or left untouched if its content is unchanged.
 
     Args:
         service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
@@ -137,15 +161,9 @@ def upload_file(service, file_name, mime_type, file_data, parent_folder_id):
     Returns:
         str: The ID of the uploaded file.
     """
-    file_metadata = {
-        'name': file_name,
-        'mimeType': mime_type,
-        'parents': [parent_folder_id]
-    }
-    
     media = MediaIoBaseUpload(io.BytesIO(file_data), mimetype=mime_type)
     
-    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    file = upload_or_update(service, drive_index, parent_folder_id, file_name, media, md5_checksum(file_data), mime_type)
     print(f'Uploaded {file_name} with ID: {file.get("id")}')
     return file.get('id')
 
@@ -161,15 +179,89 @@ def download_file_from_drive(file_id, destination_path):
     Returns:
         None
     """
-    request = service.files().get_media(fileId=file_id)
+    request = get_service().files().get_media(fileId=file_id)
     fh = io.FileIO(destination_path, 'wb')
     downloader = MediaIoBaseDownload(fh, request)
     done = False
     while done is False:
-        status, done = downloader.next_chunk()
+        status, done = next_chunk(downloader)
         print(f"Download {int(status.progress() * 100)}% complete.")
     print(f"File downloaded to {destination_path}.")
 
+# Function to download a file into memory
+def download_bytes_from_drive(drive_service, file_id):
+    """
+    Downloads a file from Google Drive into memory.
+
+    Args:
+        drive_service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        file_id (str): The ID of the Google Drive file to download.
+
+    Returns:
+        bytes: The content of the file.
+    """
+    request = drive_service.files().get_media(fileId=file_id)
+    fh = BytesIO()
+    downloader = MediaIoBaseDownload(fh, request)
+    done = False
+    while done is False:
+        status, done = next_chunk(downloader)
+    return fh.getvalue()
+
+# Function to download a JSON file into memory
+def download_json_from_drive(drive_service, file_id):
+    """
+    Downloads a JSON file from Google Drive into memory and parses it.
+
+    Args:
+        drive_service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        file_id (str): The ID of the Google Drive file to download.
+
+    Returns:
+        dict: The parsed JSON data.
+    """
+    return json.loads(download_bytes_from_drive(drive_service, file_id))
+
+# Function to find and download the elements of a folder
+def fetch_elements(drive_service, folder_id, target_file_name='structuredData_edited.json'):
+    """
+    Finds the elements of a document in a Google Drive folder and downloads them into memory, trying in order:
+        - the Arrow element table with its edited Text column (written by image_summaries and edit_json),
+        - the target JSON file,
+        - the target file (or structuredData.json if the bundle was not edited) in an Adobe PDF Extract zip bundle.
+
+    Args:
+        drive_service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        folder_id (str): The ID of the Google Drive folder to search.
+        target_file_name (str): The name of the JSON file to download (default is 'structuredData_edited.json').
+
+    Returns:
+        tuple: The metadata of the file read (dict) and the elements (pd.DataFrame), or (None, None) if none was found.
+    """
+    files = drive_index.children(drive_service, folder_id, folders=False)
+    files_by_name = {file['name']: file for file in files}
+
+    # Read the element table with the edited Text column swapped in, zero copy from the downloaded bytes
+    if ELEMENT_TABLE_FILE in files_by_name and EDITED_TEXT_FILE in files_by_name:
+        table = read_element_table(download_bytes_from_drive(drive_service, files_by_name[ELEMENT_TABLE_FILE]['id']),
+                                   download_bytes_from_drive(drive_service, files_by_name[EDITED_TEXT_FILE]['id']))
+        return files_by_name[EDITED_TEXT_FILE], element_table_to_df(table)
+
+    if target_file_name in files_by_name:
+        data = download_json_from_drive(drive_service, files_by_name[target_file_name]['id'])
+        return files_by_name[target_file_name], pd.DataFrame(data['elements'])
+
+    # Fall back to reading the JSON file straight from the extract bundle
+    for file in files:
+        if is_extract_bundle(file):
+            bundle = open_bundle(download_bytes_from_drive(drive_service, file['id']))
+            for json_file_name in (target_file_name, STRUCTURED_DATA_FILE):
+                data = read_structured_data(bundle, json_file_name)
+                if data is not None:
+                    print(f"Read {json_file_name} from extract bundle {file['name']}.")
+                    return file, pd.DataFrame(data['elements'])
+    return None, None
+
 # Function to extract element from string
 def extract_element(text, to_match="Table"):
     """
@@ -188,7 +280,7 @@ def extract_element(text, to_match="Table"):
 
 
 # All other functions related to text chunking (split_using_pathheader, process_extract, etc.) remain unchanged
-def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keepexceptiontext=KEEPTEXT):
+def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keepexceptiontext=KEEPTEXT, profiler=None):
     """
     Splits and categorizes text elements from an input DataFrame based on their paths and attributes.
 
@@ -196,6 +288,7 @@ def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keep
         inputs_elements_df (pd.DataFrame): A DataFrame containing text elements with attributes such as 'Path', 'Text', 'Page', etc.
         referencetext (str): The reference text used to identify the stopping condition (default is REFERENCETEXT).
         keepexceptiontext (list): A list of texts that should be kept as exception sections (default is KEEPTEXT).
+        profiler (RuleProfiler, optional): Records the hits and evaluation time of each rule. Defaults to None (no profiling).
 
     Returns:
         tuple: A tuple containing categorized data:
@@ -221,7 +314,16 @@ def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keep
     text_chunks_count = 0
     exception_section = []
 
-    for ind, row in elements_df.iterrows():
+    # only texts other than the configured ones need a matcher of their own
+    if (keepexceptiontext, referencetext) == (KEEPTEXT, REFERENCETEXT):
+        header_matcher = HEADER_MATCHER
+    else:
+        header_matcher = PhraseMatcher({'keep': keepexceptiontext, 'reference': referencetext})
+    profiler = profiler or NULL_PROFILER
+    # bound once, when profiling is off check only passes the condition result through
+    check, hit = profiler.check, profiler.hit
+
+    for ind, row in profiler.rows(elements_df):
         if isinstance(row['Text'], str):
             '''
             Requires user specific inputs
@@ -235,17 +337,20 @@ def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keep
             4. check if special case 2 is relevant, if yes uncomment portion            
                 # # SPECIAL CASE 2: when we have text in /H and starting with numbers BUT SHOULD NOT BE TREATED AS HEADERS            
             '''
+            # whole-text matches against the configured text lists, see phrase_matcher.py
+            header_labels = check('phrase_match', row, header_matcher.full_matches(row['Text']))
+
             # edit path used to identify title
-            if ("//Document/P[2]" == row['Path']):
+            if check('title', row, ("//Document/P[2]" == row['Path'])):
                 title_count +=1
                 tmp_dict = {'title_id': title_count, 'title_name': row['Text'], 'Path': row['Path'], 'Page': row['Page']+1, 'ObjectID': row['ObjectID']} # page need to add 1 because start counting from 0}
                 title.append(tmp_dict)
 
-            elif row['Text'].strip() == referencetext:
+            elif check('reference_stop', row, 'reference' in header_labels):
                 print(f"Hit references, ending function")
                 return title, tables, figures, text_chunks, sections, exception_section
 
-            elif row['Text'].strip() in keepexceptiontext:
+            elif check('keep_text', row, 'keep' in header_labels):
                     sections_count += 1
                     tmp_dict = {'section_id': sections_count, 'section_name': row['Text'], 'Path': row['Path'], 'Page': row['Page']+1, 'ObjectID': row['ObjectID']} # page need to add 1 because start counting from 0}
                     sections.append(tmp_dict)
@@ -253,9 +358,9 @@ def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keep
                     print(f"Found {keepexceptiontext}, section_id {sections_count}, ObjectID {row['ObjectID']}.")
 
             # edit this elif condition to suit the characteristics of the path attribute for the majority section names
-            elif "/H" in row['Path'] and re.match(r'^\d+', row['Text']) and row['Path'] not in ["//Document/H1[8]", "//Document/H1[9]", "//Document/H1[10]", "//Document/Aside[4]/H1"]:  # Check Path and text starting with numbers: # identify the section headers
+            elif check('section_header', row, "/H" in row['Path'] and re.match(r'^\d+', row['Text']) and row['Path'] not in ["//Document/H1[8]", "//Document/H1[9]", "//Document/H1[10]", "//Document/Aside[4]/H1"]):  # Check Path and text starting with numbers: # identify the section headers
                 # check if section is under References, stop function if so
-                if row['Text'].strip() == referencetext:
+                if check('reference_stop', row, 'reference' in header_labels):
                     print(f"Hit {referencetext}, ending function")
                     return title, tables, figures, text_chunks, sections, exception_section
             
@@ -269,7 +374,7 @@ def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keep
                 }
                 sections.append(tmp_dict)
 
-            elif "Span" not in row['Path'] and re.match(r'^\d+\.\d+(\.\d+)?(\.\d+)?', row['Text']):
+            elif check('subsection_numbered', row, "Span" not in row['Path'] and re.match(r'^\d+\.\d+(\.\d+)?(\.\d+)?', row['Text'])):
                 sections_count += 1
                 tmp_dict = {
                     'section_id': sections_count,
@@ -294,6 +399,7 @@ def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keep
 
 
             else: # not section headers
+                hit('body_text', row)
                 text_chunks_count += 1
                 # check if text is part of table / figure
                 element = extract_element(row['Path'], "Table")
@@ -302,16 +408,16 @@ def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keep
                 text_chunks.append(tmp_dict)
 
         else: # those with text is na could be tables or figures, save them
-            if "/Table" in row['Path']:
+            if check('table', row, "/Table" in row['Path']):
                 pattern = re.compile(r'^//Document/Table(?:\[\d+\])?$')
-                match = pattern.match(row['Path'])
+                match = check('table_top_level', row, pattern.match(row['Path']))
                 if match:
                     tables_count += 1
                     tmp_dict = {'table_id': tables_count, 'Path': row['Path'], 'Page': row['Page']+1, 'filePath': row['filePaths'], 'ObjectID': row['ObjectID']} # page need to add 1 because start counting from 0}
                     tables.append(tmp_dict)
-            elif "/Figure" in row['Path']:
+            elif check('figure', row, "/Figure" in row['Path']):
                 pattern = re.compile(r'^//Document/Figure(?:\[\d+\])?$')
-                match = pattern.match(row['Path'])
+                match = check('figure_top_level', row, pattern.match(row['Path']))
                 if match:
                     figures_count += 1
                     tmp_dict = {'figure_id': figures_count, 'Path': row['Path'], 'Page': row['Page']+1, 'filePath': row['filePaths'], 'ObjectID': row['ObjectID']} # page need to add 1 because start counting from 0}
@@ -320,13 +426,14 @@ def split_using_pathheader(inputs_elements_df, referencetext=REFERENCETEXT, keep
     return title, tables, figures, text_chunks, sections, exception_section
 
 # Process and combine text chunks based on sections
-def process_extract(text_chunks, sections):
+def process_extract(text_chunks, sections, chunk_counts=None):
     """
     Processes text chunks and combines them into sections based on their IDs, ensuring semantic chunking when necessary.
 
     Args:
         text_chunks (list): A list of dictionaries representing individual text chunks.
         sections (list): A list of dictionaries representing sections with IDs and names.
+        chunk_counts (dict, optional): If given, filled with the number of chunks created for each section_id. Defaults to None.
 
     Returns:
         list: A list of dictionaries representing processed and combined text chunks for each section.
@@ -355,15 +462,20 @@ def process_extract(text_chunks, sections):
     # Create section lookup
     lookup_dict = {d['section_id']: d['section_name'] for d in sections}
 
+    # Split the oversized sections up front, in parallel when the document is large enough for it to pay off
+    oversized_ids = [section['section_id'] for section in sections if len(grouped_texts.get(section['section_id'], "")) > MAX_TEXT_CHAR]
+    split_results = dict(zip(oversized_ids, split_texts(get_text_splitter(), [grouped_texts[section_id] for section_id in oversized_ids])))
+
     # Create chunks data for every section, even if there's no text
     for section in sections:
         section_id = section['section_id']
+        chunks_start = len(chunks_data)
         section_name = lookup_dict.get(section_id, None)
         concatenated_text = grouped_texts.get(section_id, "")
 
         if len(concatenated_text) > MAX_TEXT_CHAR:
-            # Split the concatenated text into semantic chunks
-            split_chunks = text_splitter.split_text(concatenated_text)
+            # Semantic chunks of the concatenated text
+            split_chunks = split_results[section_id]
             for chunk in split_chunks:
                 tmp_dict = {
                     'text_chunk': chunk,
@@ -381,6 +493,9 @@ def process_extract(text_chunks, sections):
             }
             chunks_data.append(tmp_dict)
 
+        if chunk_counts is not None:
+            chunk_counts[section_id] = len(chunks_data) - chunks_start
+
     return chunks_data
 
 # Process exception sections
@@ -540,33 +655,66 @@ def process_json_file(json_file, output_folder_id, drive_service, xlsx_file_name
     # Now open and process the downloaded JSON file
     with open(json_path, 'r') as file:
         data = json.load(file)
-        # Process your JSON data here...
-        elements_df = pd.DataFrame(data['elements'])
-        title, tables, figures, text_chunks, sections, exception_chunks, chunks_data = combine_texts(
-            split_using_pathheader, process_extract, process_exceptiontext, elements_df, specialchar_replacements
+
+    process_elements(pd.DataFrame(data['elements']), output_folder_id, drive_service, xlsx_file_name)
+
+# Function to process the elements of a document
+def process_elements(elements_df, output_folder_id, drive_service, xlsx_file_name):
+    """
+    Chunks the elements extracted from a PDF and uploads the outputs to Google Drive.
+
+    Args:
+        elements_df (pd.DataFrame): The elements extracted from the PDF, one row per element.
+        output_folder_id (str): The ID of the Google Drive folder where processed files will be uploaded.
+        drive_service (googleapiclient.discovery.Resource): The authenticated Google Drive API service.
+        xlsx_file_name (str): The name of the final Excel file to be uploaded.
+
+    Returns:
+        None
+    """
+    # Only the sections changed since the previous run of this document are chunked again
+    incremental_chunker = IncrementalChunker(
+        process_extract, load_previous_manifest(drive_service, output_folder_id, drive_index),
+        chunker_config(
+            CHUNKER_VERSION, MAX_TEXT_CHAR=MAX_TEXT_CHAR, CHUNK_OVERLAP=CHUNK_OVERLAP, REFERENCETEXT=REFERENCETEXT, KEEPTEXT=KEEPTEXT,
+            specialchar_replacements=specialchar_replacements
         )
+    )
+
+    rule_profiler = RuleProfiler(xlsx_file_name) if PROFILE_RULES else NULL_PROFILER
+
+    # Process your JSON data here...
+    title, tables, figures, text_chunks, sections, exception_chunks, chunks_data = combine_texts(
+        lambda df: split_using_pathheader(df, profiler=rule_profiler), incremental_chunker, process_exceptiontext,
+        elements_df, specialchar_replacements
+    )
+    if PROFILE_RULES:
+        print(rule_profiler.report())
+    print(f"{len(incremental_chunker.changes)} chunks added, modified or removed.")
+    
+    # Prepare metadata files for upload
+    metadata_files = {
+        'Tables.pkl': tables,
+        'Figures.pkl': figures,
+        'Exception_chunks.pkl': exception_chunks,
+        'Text_chunks.pkl': text_chunks,
+        'Sections.pkl': sections,
+        'Final_chunks.pkl': chunks_data,
+        MANIFEST_FILE: incremental_chunker.manifest,
+        CHANGES_FILE: incremental_chunker.changes
+    }
+    
+    for file_name, data in metadata_files.items():
+        # Save metadata to BytesIO stream
+        file_data = BytesIO()
+        pickle.dump(data, file_data)
+        file_data.seek(0)  # Move to the start of the BytesIO stream
         
-        # Prepare metadata files for upload
-        metadata_files = {
-            'Tables.pkl': tables,
-            'Figures.pkl': figures,
-            'Exception_chunks.pkl': exception_chunks,
-            'Text_chunks.pkl': text_chunks,
-            'Sections.pkl': sections,
-            'Final_chunks.pkl': chunks_data
-        }
-        
-        for file_name, data in metadata_files.items():
-            # Save metadata to BytesIO stream
-            file_data = BytesIO()
-            pickle.dump(data, file_data)
-            file_data.seek(0)  # Move to the start of the BytesIO stream
-            
-            # Upload file to Google Drive
-            upload_file(drive_service, file_name, 'application/octet-stream', file_data.read(), output_folder_id)
-        
-        # Also save other output if needed
-        save_output(service,output_folder_id, title, chunks_data, xlsx_file_name)
+        # Upload file to Google Drive
+        upload_file(drive_service, file_name, 'application/octet-stream', file_data.read(), output_folder_id)
+    
+    # Also save other output if needed
+    save_output(drive_service,output_folder_id, title, chunks_data, xlsx_file_name)
 
 
 # Main function for dynamic processing
@@ -578,35 +726,41 @@ def main():
 
     TO EDIT:
     1. Replace root_folder_id and output_root_id with the folder id of the google drive folders of interest
-    2. Edit the string folder name in line 599 to the name of the PDF you are chunking for
+    2. Edit the string folder name in line 748 to the name of the PDF you are chunking for
     '''
     # Define the folder IDs
     root_folder_id = '1r38pL-SjbkwYBoK5EF1_Ou4sxb3iw0H7' # Set this to the actual root folder ID (PDF Extracted data folder)
     output_root_id = '1zkLENCBiRboBEF_MBk59fBH5efjVUuvW'  # Set this to the actual output root folder ID (Processed Data folder)
 
+    # Drive client of the main thread
+    service = get_service()
+
+    # Bring the local Drive index up to date
+    drive_index.refresh(service)
+
     # Get all subfolders in the root folder
     folders = list_folders_in_folder(root_folder_id)
 
-    # Loop through each folder
-    for folder in folders:
+    # Only look at the folders changed since the previous run
+    changed_folders, page_token = filter_changed_folders(service, folders, CHANGES_TOKEN_FILE, drive_index)
+
+    # Only chunk the folder of the PDF you are chunking for
+    folders = [folder for folder in changed_folders if folder['name'] == 'National Guidelines on Nursing Management of Nasogastric tube in Adult Patients']
+
+    target_file_name = 'structuredData_edited.json'
+
+    # Loop through each folder, downloading the elements of the next folders while the current one is chunked.
+    # get_service gives the download thread its own Drive client as the client is not thread-safe
+    processed_ids = set()
+    prefetched = prefetch(folders, lambda folder: fetch_elements(get_service(), folder['id'], target_file_name), PREFETCH_DEPTH)
+    for folder, (json_file, elements_df) in prefetched:
 
         folder_id = folder['id']
         folder_name = folder['name']
-        target_file_name = 'structuredData_edited.json'
-        files = list_files_in_folder(folder_id)
         xlsx_file_name = folder_name
 
-        if folder_name != 'National Guidelines on Nursing Management of Nasogastric tube in Adult Patients':
-            continue
-        
-        json_file = None
-        for file in files:
-            if file['name'] == target_file_name:
-                json_file = file
-                break
-
         if not json_file:
-            print(f"No {json_file} found in {folder_name} (ID: {folder_id}). Skipping folder.")
+            print(f"No {target_file_name} or extract bundle found in {folder_name} (ID: {folder_id}). Skipping folder.")
             continue
 
         print(f"Processing {json_file} in folder '{folder_name}' (ID: {folder_id}).")
@@ -614,10 +768,20 @@ def main():
         output_folder_id = get_or_create_folder_in_drive(output_root_id, folder_name)
 
         # Proceed with processing
-        process_json_file(json_file, output_folder_id, service, xlsx_file_name)
+        process_elements(elements_df, output_folder_id, service, xlsx_file_name)
+        processed_ids.add(folder_id)
         print(f"Processed {json_file} in folder '{folder_name}'.")
-        
+
+    # The next run starts from here, with the changed folders this run did not process (other PDFs or no extract)
+    save_page_token(CHANGES_TOKEN_FILE, page_token, [folder['id'] for folder in changed_folders if folder['id'] not in processed_ids])
+
+    # Print the latency and retry metrics of the Drive API calls
+    drive_metrics.report()
 
 # Execute the main function
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) == 3 and sys.argv[1] == PREVIEW_ARG:
+        # Print the section tree of a local file without chunking or uploading, see header_preview.py
+        preview_headers(split_using_pathheader, load_local_elements(sys.argv[2]), specialchar_replacements)
+    else:
+        main()